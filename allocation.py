@@ -0,0 +1,289 @@
+"""
+Simulador de alocação de orçamento (emendas) entre cidades.
+
+Modelo de resposta ajustado com o histórico: para cada cidade e eleição, a
+taxa de conversão (votos / eleitores) é explicada pelo investimento por
+eleitor nos anos anteriores, com retorno decrescente:
+
+    conversão = α + Σ_área β_área · log(1 + investimento_área / eleitores)
+
+(regressão ridge, com os β por área puxados para o β geral quando há poucos
+dados). Os votos extras de aplicar A reais numa cidade com E eleitores e
+investimento atual B são então E·β·[log(1 + (B + A)/E) − log(1 + B/E)],
+limitados a MAX_CONVERSION do eleitorado.
+
+Como o retorno é côncavo, a alocação ótima iguala o retorno marginal entre
+as cidades (water-filling): A = clip(E·β/λ − E − B, mín, máx), com λ achado
+por bissecção — vetorizado em todas as cidades e em vários orçamentos de uma
+vez. Milhares de cenários aleatórios são avaliados em lote para comparação.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+from text_utils import fold_accents
+
+ELECTION_WINDOW_YEARS = 2  # investimentos do ano da eleição e do anterior contam para ela
+RIDGE_LAMBDA = 1.0
+BISECTION_STEPS = 60
+MAX_CONVERSION = 0.6  # teto de votos / eleitores: acima disso o dinheiro extra não rende votos
+MIN_RELIABLE_SAMPLES = 10
+
+
+class InfeasibleAllocation(ValueError):
+    pass
+
+
+class UnreliableModel(ValueError):
+    """Histórico insuficiente para projetar votos (ver ResponseModel.reliable)."""
+
+
+def _area_key(area):
+    return fold_accents(area or "sem área").strip()
+
+
+class ResponseModel:
+    def __init__(self, alpha, beta, area_beta, samples, r2, latest_investment, latest_conversion=None):
+        self.alpha = alpha
+        self.beta = beta  # efeito geral
+        self.area_beta = area_beta  # {área: β}
+        self.samples = samples
+        self.r2 = r2
+        self.latest_investment = latest_investment  # {cidade: investimento na última janela}
+        self.latest_conversion = latest_conversion or {}  # {cidade: votos / eleitores na última eleição}
+
+    @classmethod
+    def fit(cls, investments, votos, electorate):
+        """Ajusta o modelo com os pares (cidade, eleição) que têm eleitorado conhecido."""
+        by_city_year = defaultdict(lambda: defaultdict(float))  # (cidade, ano) -> {área: valor}
+        areas = set()
+        latest_year = None
+        for inv in investments:
+            slug, ano = inv.get("cityId"), inv.get("ano")
+            if not slug or not isinstance(ano, int):
+                continue
+            area = _area_key(inv.get("area"))
+            areas.add(area)
+            by_city_year[slug, ano][area] += inv.get("valor", 0) or 0
+            latest_year = ano if latest_year is None else max(latest_year, ano)
+        areas = sorted(areas)
+        area_index = {a: i for i, a in enumerate(areas)}
+
+        rows, targets = [], []
+        latest_conversion = {}
+        for slug, entries in votos.items():
+            eleitores = electorate.get(slug, 0)
+            if not eleitores:
+                continue
+            for entry in entries:
+                year = entry.get("ano")
+                x = np.zeros(len(areas))
+                for offset in range(ELECTION_WINDOW_YEARS):
+                    for area, value in by_city_year.get((slug, year - offset), {}).items():
+                        x[area_index[area]] += value
+                rows.append(np.log1p(x / eleitores))
+                targets.append(entry.get("votos", 0) / eleitores)
+            if entries:
+                last = max(entries, key=lambda e: e.get("ano") or 0)
+                latest_conversion[slug] = last.get("votos", 0) / eleitores
+
+        latest = defaultdict(float)
+        if latest_year is not None:
+            for (slug, ano), values in by_city_year.items():
+                if ano > latest_year - ELECTION_WINDOW_YEARS:
+                    latest[slug] += sum(values.values())
+
+        if len(rows) < 2:
+            return cls(float(np.mean(targets)) if targets else 0.0, 0.0, {a: 0.0 for a in areas}, len(rows), 0.0,
+                       dict(latest), latest_conversion)
+
+        X = np.array(rows)
+        y = np.array(targets)
+        # β geral: regressão simples no investimento total
+        total = np.log1p(np.expm1(X).sum(axis=1))
+        tc, yc = total - total.mean(), y - y.mean()
+        beta = max(float(tc @ yc / (tc @ tc)) if tc @ tc > 0 else 0.0, 0.0)
+
+        # β por área: ridge em torno do β geral
+        Xc = X - X.mean(axis=0)
+        prior = np.full(len(areas), beta)
+        betas = prior + np.linalg.solve(Xc.T @ Xc + RIDGE_LAMBDA * np.eye(len(areas)), Xc.T @ (yc - Xc @ prior))
+        betas = np.maximum(betas, 0.0)
+        alpha = float(y.mean() - X.mean(axis=0) @ betas)
+
+        residual = y - alpha - X @ betas
+        ss_tot = float(yc @ yc)
+        r2 = 1 - float(residual @ residual) / ss_tot if ss_tot > 0 else 0.0
+        return cls(alpha, beta, dict(zip(areas, betas.tolist())), len(rows), r2, dict(latest), latest_conversion)
+
+    def unknown_areas(self, areas):
+        """Áreas pedidas sem nenhum investimento no histórico (sem β estimado)."""
+        return [a for a in areas or () if _area_key(a) not in self.area_beta]
+
+    def effect(self, areas=None):
+        """
+        β aplicável: o melhor entre as áreas permitidas (o dinheiro vai para a
+        área de maior retorno). As áreas devem existir no modelo (unknown_areas).
+        """
+        if not areas:
+            return max(self.area_beta.values(), default=self.beta) or self.beta
+        return max(self.area_beta[_area_key(a)] for a in areas)
+
+    @property
+    def reliable(self):
+        return self.samples >= MIN_RELIABLE_SAMPLES and self.r2 > 0
+
+    def describe(self):
+        return {"alpha": round(self.alpha, 6), "beta": round(self.beta, 6),
+                "beta_por_area": {a: round(b, 6) for a, b in self.area_beta.items()},
+                "amostras": self.samples, "r2": round(self.r2, 4), "confiavel": self.reliable}
+
+
+def vote_ceiling(model, eleitores, base, beta, slugs):
+    """
+    Votos extras máximos por cidade: até MAX_CONVERSION do eleitorado,
+    descontada a conversão atual (a observada na última eleição; a do modelo
+    para cidades sem votação registrada).
+    """
+    fitted = model.alpha + beta * np.log1p(base / eleitores)
+    observed = np.array([model.latest_conversion.get(s, np.nan) for s in slugs])
+    current = np.clip(np.where(np.isnan(observed), fitted, observed), 0.0, MAX_CONVERSION)
+    return eleitores * (MAX_CONVERSION - current)
+
+
+def saturation_point(eleitores, base, beta, ceiling):
+    """Investimento a partir do qual a cidade bate no teto de votos."""
+    if beta <= 0:
+        return np.zeros_like(eleitores)
+    return eleitores * np.expm1(ceiling / (eleitores * beta) + np.log1p(base / eleitores)) - base
+
+
+def expected_votes(allocations, eleitores, base, beta, ceiling=np.inf):
+    """Votos extras esperados; `allocations` pode ser (cidades,) ou (cenários, cidades)."""
+    votes = eleitores * beta * (np.log1p((base + allocations) / eleitores) - np.log1p(base / eleitores))
+    return np.minimum(votes, ceiling)
+
+
+def optimal_allocation(budgets, eleitores, base, beta, lower, upper):
+    """
+    Water-filling vetorizado para vários orçamentos ao mesmo tempo:
+    devolve a matriz (orçamentos, cidades) com a alocação ótima.
+    """
+    budgets = np.atleast_1d(np.asarray(budgets, dtype=np.float64))[:, None]
+
+    def allocate(lam):
+        return np.clip(eleitores * beta / lam - eleitores - base, lower, upper)
+
+    if beta <= 0:
+        # Sem efeito estimado: qualquer alocação viável é equivalente; distribui proporcionalmente à folga
+        slack = upper - lower
+        share = slack / slack.sum() if slack.sum() > 0 else np.full_like(slack, 1 / len(slack))
+        return lower + (budgets - lower.sum()) * share
+
+    # Retorno marginal máximo (primeiro real em cada cidade) limita λ por cima
+    lo = np.full(budgets.shape, 1e-12)
+    hi = np.full(budgets.shape, float((eleitores * beta / (eleitores + base + lower)).max()) * 2)
+    for _ in range(BISECTION_STEPS):
+        mid = (lo + hi) / 2
+        over = allocate(mid).sum(axis=1, keepdims=True) > budgets
+        lo = np.where(over, mid, lo)
+        hi = np.where(over, hi, mid)
+    allocation = allocate(hi)
+    # Ajuste fino: distribui o resto da bissecção entre as cidades que ainda têm folga
+    remainder = budgets - allocation.sum(axis=1, keepdims=True)
+    room = np.where(remainder > 0, upper - allocation, allocation - lower)
+    total_room = room.sum(axis=1, keepdims=True)
+    return allocation + np.where(total_room > 0, remainder * room / np.maximum(total_room, 1e-12), 0.0)
+
+
+def random_allocations(n, budget, lower, upper, rng):
+    """Cenários aleatórios viáveis (Dirichlet sobre a folga, com o excedente dos tetos redistribuído)."""
+    weights = rng.dirichlet(np.ones(len(lower)), size=n)
+    allocation = lower + weights * (budget - lower.sum())
+    for _ in range(10):
+        excess = np.maximum(allocation - upper, 0.0)
+        allocation -= excess
+        spill = excess.sum(axis=1, keepdims=True)
+        if not spill.any():
+            break
+        room = upper - allocation
+        allocation += spill * room / np.maximum(room.sum(axis=1, keepdims=True), 1e-12)
+    return allocation
+
+
+def simulate(model, budget, eleitores, slugs, lower, upper, areas=None, scenarios=2000, seed=None, curve_points=9,
+             allow_unreliable=False):
+    """
+    Avalia a alocação ótima, `scenarios` alocações aleatórias e a curva de
+    votos × orçamento (0,25× a 2× o valor pedido), tudo vetorizado.
+
+    Com um modelo não confiável (poucas amostras ou r² ≤ 0) os votos
+    projetados não têm base: recusa com UnreliableModel, a menos que
+    allow_unreliable seja pedido explicitamente.
+    """
+    if not model.reliable and not allow_unreliable:
+        raise UnreliableModel(
+            f"Histórico insuficiente para projetar votos: {model.samples} pares cidade/eleição "
+            f"(mínimo {MIN_RELIABLE_SAMPLES}) e r² {model.r2:.2f}.")
+    if lower.sum() > budget + 1e-6:
+        raise InfeasibleAllocation("A soma dos mínimos por cidade passa do orçamento.")
+    if upper.sum() < budget - 1e-6:
+        raise InfeasibleAllocation("A soma dos máximos por cidade não alcança o orçamento.")
+
+    beta = model.effect(areas)
+    base = np.array([model.latest_investment.get(s, 0.0) for s in slugs])
+    ceiling = vote_ceiling(model, eleitores, base, beta, slugs)
+    # Acima do ponto de saturação o dinheiro não rende: o ótimo só passa dele se o orçamento obrigar
+    useful = np.clip(saturation_point(eleitores, base, beta, ceiling), lower, upper)
+
+    def best_for(budgets):
+        budgets = np.atleast_1d(np.asarray(budgets, dtype=np.float64))
+        allocation = optimal_allocation(np.minimum(budgets, useful.sum()), eleitores, base, beta, lower, useful)
+        leftover = np.maximum(budgets - useful.sum(), 0.0)[:, None]
+        slack = upper - useful
+        if leftover.any() and slack.sum() > 0:
+            allocation = allocation + leftover * slack / slack.sum()
+        return allocation
+
+    best = best_for(budget)[0]
+    best_votes = expected_votes(best, eleitores, base, beta, ceiling)
+
+    rng = np.random.default_rng(seed)
+    sampled = random_allocations(scenarios, budget, lower, upper, rng) if scenarios else np.empty((0, len(slugs)))
+    sampled_totals = expected_votes(sampled, eleitores, base, beta, ceiling).sum(axis=1)
+
+    proportional = lower + (budget - lower.sum()) * eleitores / eleitores.sum()
+    proportional = np.minimum(proportional, upper)
+    proportional_votes = float(expected_votes(proportional, eleitores, base, beta, ceiling).sum())
+
+    curve_budgets = budget * np.linspace(0.25, 2.0, curve_points)
+    feasible = (curve_budgets >= lower.sum()) & (curve_budgets <= upper.sum())
+    curve_budgets = curve_budgets[feasible]
+    curve = best_for(curve_budgets) if len(curve_budgets) else None
+    curve_votes = expected_votes(curve, eleitores, base, beta, ceiling).sum(axis=1) if curve is not None else []
+
+    total_votes = float(best_votes.sum())
+    order = np.argsort(-best)
+    return {
+        "orcamento": budget,
+        "votos_esperados": round(total_votes, 1),
+        "custo_por_voto": round(budget / total_votes, 2) if total_votes > 0 else None,
+        "alocacao": [
+            {"cidade": slugs[i], "valor": round(float(best[i]), 2), "votos_esperados": round(float(best_votes[i]), 1)}
+            for i in order if best[i] >= 0.01
+        ],
+        "comparacao": {
+            "cenarios_aleatorios": int(scenarios),
+            "melhor_aleatorio": round(float(sampled_totals.max()), 1) if scenarios else None,
+            "mediana_aleatorios": round(float(np.median(sampled_totals)), 1) if scenarios else None,
+            "proporcional_ao_eleitorado": round(proportional_votes, 1),
+        },
+        "curva": [{"orcamento": round(float(b), 2), "votos_esperados": round(float(v), 1)}
+                  for b, v in zip(curve_budgets, curve_votes)],
+        "beta_aplicado": round(beta, 6),
+        "orcamento_saturado": bool(budget > useful.sum() + 1e-6),
+        "aviso": None if model.reliable else (
+            f"Modelo ajustado com {model.samples} pares cidade/eleição (r² {model.r2:.2f}): "
+            "trate os votos esperados como indicativos."),
+    }
@@ -0,0 +1,1172 @@
+"""
+Benchmarks e testes de carga do servidor, executados em processo (ASGI) ou
+contra um servidor já rodando (--url). No modo em processo os dados ficam
+em um diretório temporário — os arquivos do projeto não são alterados — e
+o LLM e a busca web são substituídos por stubs com latência configurável.
+
+Uso:
+    python benchmark.py all                                    # todos os cenários (falha se algum falhar)
+    python benchmark.py suite                                  # todos os endpoints
+    python benchmark.py suite --investments 1000000 --years 2018 2020 2022 2024
+    python benchmark.py suite --endpoints cities chat --requests 500 --concurrency 50
+    python benchmark.py suite --save-baseline bench_baseline.json
+    python benchmark.py suite --baseline bench_baseline.json   # falha se houver regressão
+    python benchmark.py suite --url http://localhost:8082      # servidor externo
+    python benchmark.py campaign_update --requests 2000 --concurrency 20
+    python benchmark.py state_stress --requests 2000 --concurrency 4
+    python benchmark.py startup
+    python benchmark.py chat_cache --requests 500 --concurrency 20
+    DOSSIER_WORKERS=8 python benchmark.py dossiers --investments 200000
+"""
+
+import argparse
+import asyncio
+import collections
+import ipaddress
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_FILES = ["cidades_pr.json", "dados_eleitorais.json", "votos_data.json", "investments_data.json", "campaign_data.json",
+              "mapa_pr.svg", "ibge_regioes.json"]
+
+AREAS = ["Saúde", "Educação", "Infraestrutura", "Assistência Social", "Agricultura", "Esporte", "Cultura"]
+ASGI_CLIENT_HOST = "127.0.0.1"  # endereço da "conexão" do cliente em processo
+TIPOS = ["Impositiva - Individual", "Impositiva - Bancada", "Transferência Especial", "Convênio"]
+CHAT_QUESTIONS = [
+    "Quais as melhores cidades para investir?",
+    "Como está a campanha em Londrina?",
+    "Qual o perfil do eleitorado de Maringá?",
+    "Quais cidades têm melhor conversão de votos?",
+    "Onde o PSD tem mais prefeitos?",
+]
+
+# Digitação no autocomplete: prefixos, acentos ausentes e erros de digitação
+SEARCH_QUERIES = ["lo", "lond", "londirna", "sao jo", "curitb", "maringaense", "psd", "ponta gr", "cascavle", "foz"]
+
+
+def prepare_workdir():
+    """Copia os dados para um diretório temporário e muda o cwd para ele."""
+    workdir = tempfile.mkdtemp(prefix="bench_mapa_pr_")
+    for name in DATA_FILES:
+        src = os.path.join(PROJECT_DIR, name)
+        if os.path.exists(src):
+            shutil.copy2(src, workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, PROJECT_DIR)
+    return workdir
+
+
+def generate_synthetic_data(n_investments, years, seed=42):
+    """Gera votos (cidade × ano) e investimentos sintéticos para as 399 cidades no diretório atual."""
+    rng = random.Random(seed)
+    with open("cidades_pr.json", "r", encoding="utf-8") as f:
+        cities = json.load(f)
+    slugs = list(cities.keys())
+
+    votos = {
+        slug: [{"ano": ano, "votos": rng.randint(0, 50000)} for ano in years]
+        for slug in slugs if rng.random() < 0.9
+    }
+    investments = []
+    for _ in range(n_investments):
+        slug = rng.choice(slugs)
+        area = rng.choice(AREAS)
+        investments.append({
+            "cityId": slug,
+            "cityName": cities[slug]["nome"],
+            "ano": rng.choice(years),
+            "valor": round(rng.uniform(10000, 2000000), 2),
+            "area": area,
+            "tipo": rng.choice(TIPOS),
+            "descricao": f"Emenda para {area.lower()} em {cities[slug]['nome']}",
+        })
+
+    with open("votos_data.json", "w", encoding="utf-8") as f:
+        json.dump(votos, f, ensure_ascii=False)
+    with open("investments_data.json", "w", encoding="utf-8") as f:
+        json.dump(investments, f, ensure_ascii=False)
+    print(f"Dados sintéticos: {len(slugs)} cidades | {len(votos)} com votos em {len(years)} anos | "
+          f"{len(investments):,} investimentos")
+    return slugs
+
+
+# --- Stubs do LLM e da busca web ---
+
+class _Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class RateLimitError(Exception):
+    """Mesmo nome e status do erro de rate limit do SDK (tratado como transitório pelo servidor)."""
+
+    status_code = 429
+
+
+class StubOpenAI:
+    """Imita openai.OpenAI: chat.completions.create() com latência fixa e contagem aproximada de tokens."""
+
+    latency = 0.05
+    failure_rate = 0.0  # fração das chamadas que falham com RateLimitError
+    calls = 0
+    in_flight = 0
+    max_in_flight = 0
+    _lock = threading.Lock()
+    _rng = random.Random(0)
+    answer = "**Resposta simulada** com base nos dados do sistema."
+    prompt_log = []  # (modelo, tokens de prompt) de cada chamada
+
+    def __init__(self, **kwargs):
+        self.chat = _Obj(completions=self)
+
+    # Chamadas de ferramenta "reproduzidas" por pergunta: {mensagem: [(nome, argumentos), ...]}
+    tool_script = {}
+    tool_errors = 0
+
+    def create(self, model=None, messages=(), tools=None, tool_choice=None, **kwargs):
+        with StubOpenAI._lock:
+            StubOpenAI.calls += 1
+            StubOpenAI.in_flight += 1
+            StubOpenAI.max_in_flight = max(StubOpenAI.max_in_flight, StubOpenAI.in_flight)
+            fail = StubOpenAI._rng.random() < self.failure_rate
+        try:
+            time.sleep(self.latency)
+        finally:
+            with StubOpenAI._lock:
+                StubOpenAI.in_flight -= 1
+        if fail:
+            raise RateLimitError("Rate limit reached (simulado)")
+        # Aproximação de ~4 caracteres por token, contando também as definições das ferramentas
+        prompt_chars = sum(len(m.get("content") or "") + len(json.dumps(m.get("tool_calls", "")))
+                           for m in messages if isinstance(m, dict))
+        if tools:
+            prompt_chars += len(json.dumps(tools, ensure_ascii=False))
+        StubOpenAI.tool_errors += sum(1 for m in messages if m.get("role") == "tool" and '"erro"' in m["content"])
+
+        script = self.tool_script.get(messages[-1].get("content")) if messages[-1].get("role") == "user" else None
+        if tools and tool_choice != "none" and script:
+            content, finish_reason = None, "tool_calls"
+            tool_calls = [_Obj(id=f"call_{i}", type="function",
+                               function=_Obj(name=name, arguments=json.dumps(arguments, ensure_ascii=False)))
+                          for i, (name, arguments) in enumerate(script)]
+        else:
+            content, finish_reason, tool_calls = self.answer, "stop", None
+        completion_chars = len(content or json.dumps(script, ensure_ascii=False))
+        StubOpenAI.prompt_log.append((model, prompt_chars // 4))
+        return _Obj(
+            choices=[_Obj(message=_Obj(content=content, tool_calls=tool_calls), finish_reason=finish_reason)],
+            usage=_Obj(prompt_tokens=prompt_chars // 4, completion_tokens=completion_chars // 4,
+                       total_tokens=(prompt_chars + completion_chars) // 4),
+        )
+
+
+class StubDDGS:
+    latency = 0.05
+
+    def text(self, query, max_results=3):
+        time.sleep(self.latency)
+        return [{"title": f"Resultado {i}", "body": f"Conteúdo simulado para {query[:40]}",
+                 "href": f"https://www.ibge.gov.br/{i}"} for i in range(max_results)]
+
+
+def install_stubs(server, llm_latency, search_latency):
+    StubOpenAI.latency = llm_latency
+    StubDDGS.latency = search_latency
+    server.API_KEY = server.API_KEY or "stub"
+    server.get_openai_client = StubOpenAI
+    server.new_search_session = StubDDGS
+
+
+@asynccontextmanager
+async def open_client(args):
+    """Cliente HTTP para o servidor em processo (com lifespan) ou para --url."""
+    import httpx
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=120) as client:
+            yield client, None
+        return
+
+    import server
+    install_stubs(server, args.llm_latency, args.search_latency)
+    # O cliente ASGI faz o papel do proxy reverso: X-Forwarded-For identifica o usuário simulado
+    server.TRUSTED_PROXIES = [ipaddress.ip_network(ASGI_CLIENT_HOST)]
+    transport = httpx.ASGITransport(app=server.app, client=(ASGI_CLIENT_HOST, 123))
+    async with server.lifespan(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            yield client, server
+
+
+def simulated_ip(user):
+    return f"10.0.{user // 250}.{user % 250 + 1}"
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+async def run_requests(send, total, concurrency, users=False):
+    """
+    Dispara `total` chamadas de send(i) com no máximo `concurrency` simultâneas.
+    Com users=True cada worker é um usuário simulado e a chamada é send(i, usuário).
+    """
+    latencies = []
+    counter = iter(range(total))
+
+    async def worker(user):
+        for i in counter:
+            start = time.perf_counter()
+            await (send(i, user) if users else send(i))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(user) for user in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def report(name, latencies, elapsed):
+    result = {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+    print(f"{name}: {result['requests']} req em {elapsed:.2f}s | {result['throughput_rps']:.0f} req/s | "
+          f"p50 {result['p50_ms']:.2f}ms | p95 {result['p95_ms']:.2f}ms | p99 {result['p99_ms']:.2f}ms")
+    return result
+
+
+# --- Cargas por endpoint ---
+# (nome, método, caminho, corpo(i, ctx) ou None, fração de --requests)
+# ctx: {"slugs": [...], "votos": {...}, "investments": [...]} com os dados de referência.
+
+def _export_items(i, ctx):
+    return {"items": [{"city": slug, "votes": 1000 + j, "investment": 50000.0, "conversion": 1.5,
+                       "cost_per_vote": 50.0, "cost_per_pop": 2.0, "share": 0.25}
+                      for j, slug in enumerate(ctx["slugs"])]}
+
+
+WORKLOADS = [
+    ("cities", "GET", "/api/cities", None, 1.0),
+    ("search", "GET", lambda i, ctx: f"/api/search?q={quote(SEARCH_QUERIES[i % len(SEARCH_QUERIES)])}&limit=10",
+     None, 1.0),
+    ("similar", "GET", lambda i, ctx: f"/api/cities/{ctx['slugs'][i % len(ctx['slugs'])]}/similar?k=10", None, 1.0),
+    ("similar_all", "GET", "/api/cities/similar?k=5", None, 0.1),
+    ("bootstrap", "GET", "/api/bootstrap", None, 1.0),
+    ("neighbors", "GET", lambda i, ctx: f"/api/cities/{ctx['slugs'][i % len(ctx['slugs'])]}/neighbors?depth=2",
+     None, 1.0),
+    ("campaign_data", "GET", "/api/campaign/data", None, 1.0),
+    ("campaign_update", "POST", "/api/campaign/update",
+     lambda i, ctx: {"city_slug": ctx["slugs"][i % len(ctx["slugs"])], "votes": i, "money": float(i)}, 1.0),
+    ("campaign_update_bulk", "POST", "/api/campaign/update_bulk",
+     lambda i, ctx: {"items": [{"city_slug": s, "votes": i, "money": float(i)} for s in ctx["slugs"]]}, 0.25),
+    ("investments_data", "GET", "/api/investments/data", None, 0.1),
+    ("investments_by_city", "GET", lambda i, ctx: f"/api/investments/data?city={ctx['slugs'][i % len(ctx['slugs'])]}",
+     None, 0.5),
+    ("investments_save", "POST", "/api/investments/save", lambda i, ctx: {"investments": ctx["investments"]}, 0.02),
+    ("votos_data", "GET", "/api/votos/data", None, 0.5),
+    ("votos_save", "POST", "/api/votos/save", lambda i, ctx: {"votos": ctx["votos"]}, 0.1),
+    ("export_excel", "POST", "/api/export_excel", _export_items, 0.1),
+    ("chat", "POST", "/api/chat", lambda i, ctx: {"message": CHAT_QUESTIONS[i % len(CHAT_QUESTIONS)]}, 0.25),
+]
+
+
+async def run_workload(client, workload, ctx, args):
+    name, method, path, body, weight = workload
+    total = max(int(args.requests * weight), 1)
+
+    async def send(i, user):
+        url = path(i, ctx) if callable(path) else path
+        payload = body(i, ctx) if body else None
+        # Um IP por usuário simulado: o limite por cliente do /api/chat vale por pessoa, não pela carga toda
+        r = await client.request(method, url, json=payload, headers={"X-Forwarded-For": simulated_ip(user)})
+        if r.status_code >= 400:
+            raise RuntimeError(f"{name}: HTTP {r.status_code} {r.text[:200]}")
+
+    latencies, elapsed = await run_requests(send, total, args.concurrency, users=True)
+    return report(name, latencies, elapsed)
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Lista as regressões: p95 acima de (1+tol)× ou vazão abaixo de (1-tol)× da linha de base."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']:.2f}ms > base {base['p95_ms']:.2f}ms")
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: vazão {result['throughput_rps']:.0f} req/s < base {base['throughput_rps']:.0f} req/s")
+    return regressions
+
+
+# --- Cenários ---
+
+async def bench_suite(args):
+    """Carga concorrente em todos os endpoints da API, com relatório e comparação com a linha de base."""
+    if not args.url:
+        generate_synthetic_data(args.investments, args.years, args.seed)
+
+    with open(os.path.join(PROJECT_DIR, "cidades_pr.json"), "r", encoding="utf-8") as f:
+        slugs = list(json.load(f).keys())
+    rng = random.Random(args.seed)
+    ctx = {
+        "slugs": slugs,
+        "votos": {slug: [{"ano": ano, "votos": rng.randint(0, 50000)} for ano in args.years] for slug in slugs},
+        "investments": [{"cityId": rng.choice(slugs), "cityName": "", "ano": rng.choice(args.years),
+                         "valor": 1000.0, "area": rng.choice(AREAS), "tipo": "", "descricao": ""}
+                        for _ in range(args.save_size)],
+    }
+
+    selected = [w for w in WORKLOADS if not args.endpoints or w[0] in args.endpoints]
+    results = {}
+    async with open_client(args) as (client, _):
+        for workload in selected:
+            results[workload[0]] = await run_workload(client, workload, ctx, args)
+
+    if args.output:
+        with open(os.path.join(PROJECT_DIR, args.output), "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(os.path.join(PROJECT_DIR, args.save_baseline), "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Linha de base salva em {args.save_baseline}")
+    if args.baseline:
+        with open(os.path.join(PROJECT_DIR, args.baseline), "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("REGRESSÕES DETECTADAS:")
+            for r in regressions:
+                print(f"  - {r}")
+            sys.exit(1)
+        print(f"Sem regressões em relação a {args.baseline} (tolerância {args.tolerance:.0%}).")
+    return results
+
+
+async def bench_campaign_update(args):
+    """Edições em rajada no mapa: uma chamada /api/campaign/update por cidade."""
+    async with open_client(args) as (client, server):
+        slugs = list(server.CITIES_DATA.keys())
+
+        async def send(i):
+            r = await client.post("/api/campaign/update", json={
+                "city_slug": slugs[i % len(slugs)], "votes": i, "money": float(i),
+            })
+            r.raise_for_status()
+
+        latencies, elapsed = await run_requests(send, args.requests, args.concurrency)
+        result = report("campaign_update", latencies, elapsed)
+        writes_during_burst = server.PERSISTENCE.write_count
+    print(f"  gravações durante a rajada: {writes_during_burst} | após desligamento: {server.PERSISTENCE.write_count}")
+    return result
+
+
+async def bench_state_stress(args):
+    """
+    Teste de estresse do estado versionado: escritores em threads substituem
+    votos/investimentos e incrementam a campanha enquanto leitores geram o
+    relatório estratégico e conferem a consistência de cada snapshot.
+    """
+    import server
+    from storage import aggregate_campaign
+
+    server.load_all()
+    slugs = list(server.CITIES_DATA.keys())
+    stop = threading.Event()
+    errors = []
+    reads = [0]
+    increments_per_writer = max(args.requests // 10, 1)
+
+    def reader():
+        while not stop.is_set():
+            try:
+                snap = server.STATE.current
+                server.build_strategic_report("quais as melhores cidades?", snap)
+                expected = aggregate_campaign(snap.votos, snap.investments)
+                for slug, entry in expected.items():
+                    if snap.campaign.get(slug) != entry:
+                        raise AssertionError(f"snapshot v{snap.version} inconsistente em {slug}")
+                reads[0] += 1
+            except Exception as e:
+                errors.append(repr(e))
+                return
+
+    def votos_writer():
+        rng = random.Random(1)
+        while not stop.is_set():
+            votos = {slug: [{"ano": 2024, "votos": rng.randint(0, 5000)}] for slug in rng.sample(slugs, 50)}
+            server.replace_dataset("votos", votos)
+
+    def investments_writer():
+        rng = random.Random(2)
+        while not stop.is_set():
+            investments = [{"cityId": rng.choice(slugs), "cityName": "", "ano": 2024, "valor": float(rng.randint(1, 9000)),
+                            "area": "Saúde", "tipo": "", "descricao": ""} for _ in range(200)]
+            server.replace_dataset("investments", investments)
+
+    def counter_writer():
+        # Leitura-modificação-escrita concorrente: nenhum incremento pode se perder
+        for _ in range(increments_per_writer):
+            server.publish(lambda snap: {"stress_counter": getattr(snap, "stress_counter", 0) + 1}, [])
+
+    background = [threading.Thread(target=f) for f in [votos_writer, investments_writer] + [reader] * args.concurrency]
+    counters = [threading.Thread(target=counter_writer) for _ in range(4)]
+    start = time.perf_counter()
+    for t in background + counters:
+        t.start()
+    for t in counters:
+        t.join()
+    stop.set()
+    for t in background:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    counter = server.STATE.current.stress_counter
+    expected_counter = 4 * increments_per_writer
+    print(f"state_stress: {elapsed:.2f}s | {reads[0]} leituras consistentes | versão final {server.STATE.version} | "
+          f"contador {counter}/{expected_counter} | {len(errors)} erros")
+    if errors or counter != expected_counter:
+        for e in errors[:5]:
+            print(f"  ERRO: {e}")
+        sys.exit(1)
+    return {"reads": reads[0], "elapsed": elapsed}
+
+
+async def bench_chat_cache(args):
+    """
+    Cache + single-flight do /api/chat com LLM simulado: perguntas idênticas
+    simultâneas devem gerar uma única chamada ao modelo, repetições devem vir
+    do cache e uma alteração nos dados deve invalidar a resposta.
+    """
+    variants = ["Quais as melhores cidades?", "quais as melhores cidades", "  QUAIS as  melhores cidades?! "]
+    failures = []
+    async with open_client(args) as (client, server):
+        async def ask(i):
+            r = await client.post("/api/chat", json={"message": variants[i % len(variants)]})
+            r.raise_for_status()
+
+        StubOpenAI.calls = 0
+        latencies, elapsed = await run_requests(ask, args.concurrency, args.concurrency)
+        report("chat simultâneo (frio)", latencies, elapsed)
+        if StubOpenAI.calls != 1:
+            failures.append(f"{args.concurrency} perguntas simultâneas geraram {StubOpenAI.calls} chamadas ao modelo")
+
+        latencies, elapsed = await run_requests(ask, args.requests, args.concurrency)
+        report("chat repetido (cache)", latencies, elapsed)
+        if StubOpenAI.calls != 1:
+            failures.append(f"respostas em cache ainda chamaram o modelo ({StubOpenAI.calls} chamadas)")
+
+        await client.post("/api/campaign/update", json={"city_slug": "londrina", "votes": 1, "money": 1.0})
+        await ask(0)
+        if StubOpenAI.calls != 2:
+            failures.append("alteração nos dados não invalidou o cache")
+
+        counts = {result: server.metrics.CACHE_REQUESTS.value(cache="chat", result=result)
+                  for result in ("hit", "miss", "coalesced")}
+    print(f"  chamadas ao modelo: {StubOpenAI.calls} | contadores: {counts}")
+    if failures:
+        for f in failures:
+            print(f"  FALHA: {f}")
+        sys.exit(1)
+
+
+async def bench_chat_burst(args):
+    """
+    Rajada de perguntas distintas (sem cache) de vários clientes contra o LLM
+    simulado, com uma fração de erros de rate limit: o número de chamadas
+    simultâneas ao modelo não pode passar do limite do agendador, o excedente
+    deve ser recusado rápido (429/503 com Retry-After) e nenhuma requisição
+    pode terminar em 500.
+    """
+    StubOpenAI.failure_rate = args.llm_failure_rate
+    statuses = collections.Counter()
+    rejected_latencies = []
+    failures = []
+    async with open_client(args) as (client, server):
+        async def ask(i):
+            start = time.perf_counter()
+            r = await client.post("/api/chat", json={"message": f"Pergunta {i} sobre Londrina"},
+                                  headers={"X-Forwarded-For": f"10.0.0.{i % args.clients}"})
+            statuses[r.status_code] += 1
+            if r.status_code in (429, 503):
+                rejected_latencies.append(time.perf_counter() - start)
+                if "retry-after" not in r.headers:
+                    failures.append(f"{r.status_code} sem Retry-After")
+
+        latencies, elapsed = await run_requests(ask, args.requests, args.concurrency)
+        report("chat em rajada", latencies, elapsed)
+        limit = server.UPSTREAM.concurrency
+        retries = sum(v for (_,), v in server.metrics.UPSTREAM_RETRIES._values.items())
+
+    if rejected_latencies:
+        print(f"  recusadas: p50 {percentile(rejected_latencies, 50) * 1000:.1f}ms | "
+              f"p99 {percentile(rejected_latencies, 99) * 1000:.1f}ms")
+    print(f"  status: {dict(sorted(statuses.items()))} | chamadas ao modelo: {StubOpenAI.calls} "
+          f"(máx. simultâneas {StubOpenAI.max_in_flight}/{limit}) | novas tentativas: {retries}")
+    if StubOpenAI.max_in_flight > limit:
+        failures.append(f"{StubOpenAI.max_in_flight} chamadas simultâneas ao modelo (limite {limit})")
+    if statuses[500]:
+        failures.append(f"{statuses[500]} respostas 500")
+    if failures:
+        for f in sorted(set(failures)):
+            print(f"  FALHA: {f}")
+        sys.exit(1)
+
+
+TOOL_QUESTIONS = {
+    "Como está a campanha em Londrina?": [
+        ("get_city", {"city": "Londrina"}),
+        ("demographics", {"city": "Londrina", "dimensions": ["genero", "faixa_etaria"]}),
+    ],
+    "Quais as cidades com maior custo por voto?": [("rank_cities", {"metric": "custo_por_voto", "limit": 10})],
+    "Quanto investimos em saúde em cada ano?": [("investments_by", {"group_by": "ano", "area": "Saúde"})],
+    "Qual o perfil do eleitorado de Maringá?": [("demographics", {"city": "Maringá"})],
+    "Quais prefeitos do PSD governam as maiores cidades?": [
+        ("rank_cities", {"metric": "habitantes", "partido": "PSD", "limit": 10}),
+    ],
+}
+
+# Preço de tabela do gpt-4o (US$ por milhão de tokens), só para estimar o custo por resposta
+PRICE_PROMPT, PRICE_COMPLETION = 2.50, 10.00
+
+
+async def bench_chat_tools(args):
+    """
+    Tokens e custo por resposta nos modos "prompt" (contexto completo) e
+    "tools" (function calling), com um modelo simulado que reproduz as
+    chamadas de ferramenta previstas para cada pergunta.
+    """
+    generate_synthetic_data(args.investments, args.years, args.seed)
+    StubOpenAI.tool_script = TOOL_QUESTIONS
+    results = {}
+    async with open_client(args) as (client, server):
+        tokens = server.metrics.LLM_TOKENS
+        for mode in ("prompt", "tools"):
+            StubOpenAI.calls = 0
+            prompt_before, completion_before = tokens.value(type="prompt"), tokens.value(type="completion")
+            latencies = []
+            for question in TOOL_QUESTIONS:
+                start = time.perf_counter()
+                r = await client.post("/api/chat", json={"message": question, "mode": mode})
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            n = len(TOOL_QUESTIONS)
+            prompt = (tokens.value(type="prompt") - prompt_before) / n
+            completion = (tokens.value(type="completion") - completion_before) / n
+            cost = (prompt * PRICE_PROMPT + completion * PRICE_COMPLETION) / 1e6
+            results[mode] = prompt
+            print(f"modo {mode:6}: {prompt:8.0f} tokens de prompt/resposta | {completion:5.0f} de saída | "
+                  f"{StubOpenAI.calls / n:.1f} chamadas ao modelo | US$ {cost:.4f}/resposta | "
+                  f"p50 {percentile(latencies, 50) * 1000:.0f}ms")
+
+    print(f"  redução de tokens de prompt: {(1 - results['tools'] / results['prompt']) * 100:.0f}%")
+    if StubOpenAI.tool_errors:
+        print(f"  FALHA: {StubOpenAI.tool_errors} chamadas de ferramenta devolveram erro")
+        sys.exit(1)
+
+
+async def bench_chat_session(args):
+    """
+    Conversa longa (--requests / 25 turnos) com respostas do tamanho das do
+    modelo real: tokens de prompt e latência por turno colando o histórico na
+    mensagem (como os clientes faziam) e com sessão no servidor, onde os turnos
+    antigos viram resumo e o prompt deve ficar estável.
+    """
+    turns = max(args.requests // 25, 10)
+    StubOpenAI.answer = ("**Resposta simulada.** " + "Análise com números de votos, investimentos e eleitorado. " * 25)
+    questions = [f"Pergunta {i}: como melhorar a conversão em Londrina no cenário {i}?" for i in range(turns)]
+    async with open_client(args) as (client, server):
+        for label in ("histórico colado", "sessão no servidor"):
+            session_id, pasted = None, ""
+            prompts, latencies = [], []
+            for question in questions:
+                message = f"{pasted}\n{question}" if label == "histórico colado" else f"{question} (sessão)"
+                StubOpenAI.prompt_log.clear()
+                start = time.perf_counter()
+                r = await client.post("/api/chat", json={"message": message, "session_id": session_id})
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+                data = r.json()
+                session_id = data["session_id"] if label == "sessão no servidor" else None
+                pasted += f"\nUsuário: {question}\nAssistente: {data['response']}"
+                prompts.append(sum(tokens for model, tokens in StubOpenAI.prompt_log if model == "gpt-4o"))
+                await asyncio.sleep(0)  # deixa o resumo em segundo plano andar entre os turnos
+            marks = " | ".join(f"turno {i + 1}: {prompts[i]:,}" for i in (0, 4, turns // 2 - 1, turns - 1))
+            print(f"{label:18}: tokens de prompt {marks}")
+            print(f"{'':18}  latência p50 primeiros 5 {percentile(latencies[:5], 50) * 1000:.0f}ms | "
+                  f"últimos 5 {percentile(latencies[-5:], 50) * 1000:.0f}ms")
+        session = server.CHAT_SESSIONS.get(session_id)
+        compactions = {m: server.metrics.CHAT_COMPACTIONS.value(method=m) for m in ("llm", "extractive")}
+        print(f"  sessão: {len(session.turns)} turnos na íntegra + resumo de {len(session.summary)} caracteres "
+              f"({session.history_tokens():,} tokens de histórico) | resumos: {compactions}")
+
+
+RETRIEVAL_QUESTIONS = [
+    "cidades com turismo rural",
+    "emendas para hospitais em Londrina",
+    "investimentos em infraestrutura e pavimentação",
+    "municípios da região metropolitana de Maringá",
+    "economia baseada na agricultura",
+    "cidades com colonização japonesa",
+    "quanto foi investido em esporte",
+    "municípios dos Campos Gerais",
+]
+
+
+def bench_retrieval(args):
+    """
+    Índice BM25 local: tempo de construção, latência das consultas, custo da
+    atualização incremental (vs. reconstrução completa) e quantas perguntas
+    dispensariam a busca web.
+    """
+    from retrieval import BM25Index, city_items, describe_city, describe_investment, investment_items
+
+    generate_synthetic_data(args.investments, args.years, args.seed)
+    import server
+    server.load_all()
+    snapshot = server.STATE.current
+
+    start = time.perf_counter()
+    index = BM25Index()
+    index.sync("city", city_items(server.CITIES_DATA), describe_city)
+    index.sync("inv", investment_items(snapshot.investments), describe_investment)
+    build = time.perf_counter() - start
+    print(f"construção: {len(index):,} documentos em {build * 1000:.0f}ms")
+
+    latencies, skipped = [], 0
+    for _ in range(max(args.requests // len(RETRIEVAL_QUESTIONS), 1)):
+        for question in RETRIEVAL_QUESTIONS:
+            t = time.perf_counter()
+            hits, coverage = index.search(question, k=server.RETRIEVAL_TOP_K)
+            latencies.append(time.perf_counter() - t)
+    for question in RETRIEVAL_QUESTIONS:
+        hits, coverage = index.search(question, k=server.RETRIEVAL_TOP_K)
+        local = bool(hits) and coverage >= server.RETRIEVAL_SKIP_COVERAGE
+        skipped += local
+        print(f"  {'local' if local else 'web  '} cobertura {coverage:.2f} | {question}")
+    print(f"consultas: p50 {percentile(latencies, 50) * 1000:.2f}ms | p99 {percentile(latencies, 99) * 1000:.2f}ms | "
+          f"busca web dispensada em {skipped}/{len(RETRIEVAL_QUESTIONS)} perguntas")
+
+    rng = random.Random(args.seed)
+    investments = list(snapshot.investments)
+    slug = rng.choice(list(server.CITIES_DATA))
+    investments[:100] = [{"cityId": slug, "cityName": server.CITIES_DATA[slug]["nome"], "ano": 2024,
+                          "valor": float(i), "area": "Turismo", "tipo": "Individual",
+                          "descricao": f"Rota de turismo rural {i}"} for i in range(100)]
+    start = time.perf_counter()
+    added, removed = index.sync("inv", investment_items(investments), describe_investment)
+    incremental = time.perf_counter() - start
+    print(f"atualização incremental (+{added}/-{removed}): {incremental * 1000:.0f}ms "
+          f"(reconstrução completa: {build * 1000:.0f}ms)")
+
+
+def bench_allocation(args):
+    """
+    Simulador de alocação: votos sintéticos gerados a partir dos investimentos
+    com um β conhecido (para conferir o ajuste do modelo), tempo de ajuste e
+    de simulação, e ganho da alocação ótima sobre cenários aleatórios.
+    """
+    import numpy as np
+    from allocation import ELECTION_WINDOW_YEARS, ResponseModel, simulate
+
+    true_alpha, true_beta = 0.02, 0.08
+    generate_synthetic_data(args.investments, args.years, args.seed)
+    with open("dados_eleitorais.json", "r", encoding="utf-8") as f:
+        electorate = {slug: d.get("total_eleitores", 0) for slug, d in json.load(f).items()}
+    with open("investments_data.json", "r", encoding="utf-8") as f:
+        investments = json.load(f)
+    invested = collections.defaultdict(float)
+    for inv in investments:
+        invested[inv["cityId"], inv["ano"]] += inv["valor"]
+    rng = np.random.default_rng(args.seed)
+    votos = {}
+    for slug, eleitores in electorate.items():
+        if not eleitores:
+            continue
+        votos[slug] = []
+        for year in args.years:
+            window = sum(invested[slug, year - k] for k in range(ELECTION_WINDOW_YEARS))
+            conversion = true_alpha + true_beta * np.log1p(window / eleitores) + rng.normal(0, 0.005)
+            votos[slug].append({"ano": year, "votos": max(int(eleitores * conversion), 0)})
+    with open("votos_data.json", "w", encoding="utf-8") as f:
+        json.dump(votos, f)
+
+    import server
+    server.load_all()
+    snapshot = server.STATE.current
+    start = time.perf_counter()
+    model = ResponseModel.fit(snapshot.investments, snapshot.votos, electorate)
+    fit = time.perf_counter() - start
+    print(f"ajuste: {fit * 1000:.0f}ms | {model.samples} pares cidade/eleição | β {model.beta:.4f} "
+          f"(real {true_beta}) | α {model.alpha:.4f} (real {true_alpha}) | r² {model.r2:.3f}")
+
+    slugs = [s for s in electorate if electorate[s] and s in server.CITIES_DATA]
+    eleitores = np.array([electorate[s] for s in slugs], dtype=np.float64)
+    budget = 10_000_000.0
+    lower = np.zeros(len(slugs))
+    upper = np.full(len(slugs), 2_000_000.0)
+    for scenarios in (2000, 20000):
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            result = simulate(model, budget, eleitores, slugs, lower, upper, scenarios=scenarios, seed=args.seed)
+            timings.append(time.perf_counter() - start)
+        comparison = result["comparacao"]
+        print(f"simulação com {scenarios:,} cenários: p50 {percentile(timings, 50) * 1000:.0f}ms | ótimo "
+              f"{result['votos_esperados']:,.0f} votos | melhor aleatório {comparison['melhor_aleatorio']:,.0f} | "
+              f"proporcional {comparison['proporcional_ao_eleitorado']:,.0f} | {len(result['alocacao'])} cidades")
+    if result["votos_esperados"] + 1e-6 < comparison["melhor_aleatorio"]:
+        print("  FALHA: a alocação ótima perdeu para um cenário aleatório")
+        sys.exit(1)
+
+
+async def bench_first_paint(args):
+    """
+    Dados até o primeiro desenho do mapa: antes, cidades_pr.json + /api/campaign/data
+    em sequência; agora, só /api/bootstrap. Soma latência de rede simulada (--rtt) e
+    tempo de transferência (--bandwidth) aos tempos medidos do servidor.
+    """
+    generate_synthetic_data(args.investments, args.years, args.seed)
+    flows = {
+        "antes (cidades_pr.json + /api/campaign/data)": ["/cidades_pr.json", "/api/campaign/data"],
+        "agora (/api/bootstrap)": ["/api/bootstrap"],
+    }
+    async with open_client(args) as (client, _):
+        for label, urls in flows.items():
+            totals, wire = [], 0
+            for _ in range(max(args.requests // 50, 5)):
+                elapsed, wire = 0.0, 0
+                for url in urls:
+                    start = time.perf_counter()
+                    r = await client.get(url, headers={"Accept-Encoding": "gzip"})
+                    r.raise_for_status()
+                    wire += r.num_bytes_downloaded
+                    elapsed += time.perf_counter() - start + args.rtt + r.num_bytes_downloaded / args.bandwidth
+                totals.append(elapsed)
+            print(f"{label}: {len(urls)} requisição(ões) | {wire / 1024:.0f} KiB trafegados | "
+                  f"p50 {percentile(totals, 50) * 1000:.0f}ms até os dados do primeiro desenho")
+
+
+async def bench_reload(args):
+    """
+    Recarga dos dados de referência com o servidor atendendo: latência de
+    /api/cities e /api/search sem recarga e com recargas forçadas em sequência,
+    erros durante a troca e o relatório de tempos de cada recarga.
+    """
+    async with open_client(args) as (client, server):
+        urls = ["/api/cities", "/api/search?q=londrina", "/api/bootstrap"]
+
+        async def send(i):
+            r = await client.get(urls[i % len(urls)])
+            if r.status_code != 200:
+                errors.append(r.status_code)
+
+        errors = []
+        latencies, elapsed = await run_requests(send, args.requests, args.concurrency)
+        report("sem recarga", latencies, elapsed)
+
+        reports = []
+
+        async def reloader():
+            while not finished.is_set():
+                r = await client.post("/api/admin/reload?force=true")
+                reports.append(r.json())
+
+        finished = asyncio.Event()
+        task = asyncio.create_task(reloader())
+        latencies, elapsed = await run_requests(send, args.requests, args.concurrency)
+        finished.set()
+        await task
+        report(f"com {len(reports)} recargas", latencies, elapsed)
+        print(f"erros durante as recargas: {len(errors)}")
+        for step in reports[0]["timings_ms"]:
+            values = [r["timings_ms"][step] for r in reports]
+            print(f"  {step}: p50 {percentile(values, 50):.1f}ms | máx {max(values):.1f}ms")
+
+
+def bench_encoding(args):
+    """
+    Tamanho (cru e gzip) e tempo de decodificação das respostas grandes em
+    JSON e nos formatos binários, com layout de linhas e de colunas, sobre os
+    dados sintéticos (--investments, --years). A decodificação é medida em
+    Python (json.loads / msgpack.unpackb), como aproximação do cliente.
+    """
+    import gzip
+
+    import server
+    from negotiation import AVAILABLE, columns, decode, encode
+
+    generate_synthetic_data(args.investments, args.years, args.seed)
+    server.load_all()
+    snapshot = server.STATE.current
+    investments = {"investments": list(snapshot.investments), "count": len(snapshot.investments)}
+    votos = {"votos": dict(snapshot.votos), "count": len(snapshot.votos)}
+    payloads = {
+        "/api/investments/data": (investments, server.investments_columns),
+        "/api/votos/data": (votos, server.votos_columns),
+        "/api/campaign/data": (dict(snapshot.campaign), server.campaign_columns),
+        "/api/cities": (list(server.CITIES_DATA.summary), columns),
+    }
+    formats = {"json": (lambda p: json.dumps(p, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                        json.loads)}
+    for media in sorted(AVAILABLE):
+        formats[media.split("/")[1]] = (lambda p, m=media: encode(p, m), lambda b, m=media: decode(b, m))
+
+    for url, (payload, to_columns) in payloads.items():
+        print(url)
+        baseline = None
+        for layout, data in (("linhas", payload), ("colunas", to_columns(payload))):
+            for name, (dump, load) in formats.items():
+                body = dump(data)
+                n = max(args.requests // 100, 5)
+                start = time.perf_counter()
+                for _ in range(n):
+                    load(body)
+                decode_ms = (time.perf_counter() - start) / n * 1000
+                baseline = baseline or (len(body), decode_ms)
+                print(f"  {name:8} {layout:8} {len(body) / 1024:8.0f} KiB | gzip {len(gzip.compress(body, 6)) / 1024:6.0f} KiB"
+                      f" | {len(body) / baseline[0]:5.0%} do JSON | decodificação {decode_ms:7.2f}ms")
+
+
+PERFIL_VALUES = {
+    "DS_GENERO": ["MASCULINO", "FEMININO", "NÃO INFORMADO"],
+    "DS_FAIXA_ETARIA": ["16 anos", "17 anos", "18 anos", "19 anos", "20 anos", "21 a 24 anos"]
+                       + [f"{a} a {a + 4} anos" for a in range(25, 100, 5)] + ["100 anos ou mais", "Inválida"],
+    "DS_GRAU_ESCOLARIDADE": ["ANALFABETO", "LÊ E ESCREVE", "ENSINO FUNDAMENTAL INCOMPLETO",
+                             "ENSINO FUNDAMENTAL COMPLETO", "ENSINO MÉDIO INCOMPLETO", "ENSINO MÉDIO COMPLETO",
+                             "SUPERIOR INCOMPLETO", "SUPERIOR COMPLETO", "NÃO INFORMADO"],
+    "DS_ESTADO_CIVIL": ["SOLTEIRO", "CASADO", "DIVORCIADO", "VIÚVO", "SEPARADO JUDICIALMENTE"],
+    "DS_COR_RACA": ["BRANCA", "PARDA", "PRETA", "AMARELA", "INDÍGENA", "NÃO INFORMADO", "NÃO DIVULGÁVEL"],
+}
+
+
+def generate_perfil_csv(path, zones=2, combos=2500, seed=42):
+    """CSV sintético no formato do perfil do eleitorado do TSE: `combos` combinações por zona de cada cidade."""
+    rng = random.Random(seed)
+    with open("cidades_pr.json", "r", encoding="utf-8") as f:
+        names = [c["nome"].upper() for c in json.load(f).values()]
+    columns = list(PERFIL_VALUES)
+    rows = 0
+    with open(path, "w", encoding="latin-1", newline="") as f:
+        f.write(";".join(f'"{c}"' for c in ["ANO_ELEICAO", "SG_UF", "NM_MUNICIPIO", "NR_ZONA"] + columns
+                         + ["QT_ELEITORES_PERFIL"]) + "\n")
+        for uf in ("PR", "SC"):
+            for name in names if uf == "PR" else names[:50]:
+                for zone in range(zones):
+                    for _ in range(combos):
+                        values = [rng.choice(PERFIL_VALUES[c]) for c in columns]
+                        f.write(";".join(f'"{v}"' for v in ["2024", uf, name, zone] + values
+                                         + [rng.randint(1, 40)]) + "\n")
+                        rows += 1
+    return rows
+
+
+def bench_crosstab(args):
+    """
+    Cubo do perfil do eleitorado: montagem a partir de um CSV sintético no
+    formato do TSE, tamanho em disco e latência de cruzamentos em uma cidade,
+    em várias e no estado inteiro (cubo aberto com mmap).
+    """
+    import statistics
+    import tracemalloc
+
+    from voter_cube import CUBE_DIR, VoterCube, build_cube
+
+    rows = generate_perfil_csv("perfil_sintetico.csv")
+    print(f"CSV sintético: {rows:,} linhas, {os.path.getsize('perfil_sintetico.csv') / 1e6:.0f} MB")
+    build_cube("perfil_sintetico.csv")
+    cube_size = sum(os.path.getsize(os.path.join(CUBE_DIR, name)) for name in os.listdir(CUBE_DIR))
+    cube = VoterCube(CUBE_DIR)
+    queries = {
+        "mulheres 25-34 com superior em Maringá": dict(cities=["maringa"], ages=(25, 34),
+                                                      filters={"genero": ["feminino"], "grau_instrucao": ["superior"]}),
+        "gênero × faixa etária em 5 cidades": dict(cities=["curitiba", "londrina", "maringa", "cascavel", "toledo"],
+                                                   group_by=["genero", "faixa_etaria"]),
+        "instrução × cor/raça no estado": dict(group_by=["grau_instrucao", "cor_raca"]),
+        "jovens 16-24 por município no estado": dict(ages=(16, 24), group_by=["municipio"]),
+    }
+    for label, query in queries.items():
+        timings = []
+        for _ in range(max(args.requests // 20, 10)):
+            start = time.perf_counter()
+            result = cube.crosstab(**query)
+            timings.append(time.perf_counter() - start)
+        print(f"{label}: {result['total']:,} eleitores, {len(result['groups'])} grupos | "
+              f"mediana {statistics.median(timings) * 1000:.2f}ms | p95 {percentile(timings, 95) * 1000:.2f}ms")
+    tracemalloc.start()
+    for query in queries.values():
+        cube.crosstab(**query)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"pico de memória alocada nas consultas: {peak / 2**20:.1f} MiB (cubo em disco: {cube_size / 2**20:.1f} MiB)")
+
+
+def bench_reference(args):
+    """
+    Dados de referência das cidades: tempo de montagem, memória ocupada e CPU
+    por chamada dos caminhos quentes que os leem (lista de cidades, cidade
+    alvo do chat, contexto local e resumo estadual).
+    """
+    import pickle
+    import tracemalloc
+
+    import server
+
+    start = time.perf_counter()
+    data = server.build_reference_data()
+    build = time.perf_counter() - start
+    print(f"montagem dos dados de referência: {build * 1000:.0f}ms | snapshot {len(pickle.dumps(data)) / 1024:.0f} KiB")
+
+    blob = pickle.dumps(data["cities"])
+    tracemalloc.start()
+    cities = pickle.loads(blob)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"memória das {len(cities)} cidades: {size / 1024:.0f} KiB")
+
+    from starlette.requests import Request
+
+    server.load_all()
+    slug = "londrina"
+    city = server.CITIES_DATA[slug]
+    plain_json = Request({"type": "http", "method": "GET", "path": "/api/cities", "headers": [], "query_string": b""})
+    calls = {
+        "/api/cities": lambda: asyncio.run(server.get_cities_list(plain_json)),
+        "get_target_city (sem cidade)": lambda: server.get_target_city("qual o melhor partido do estado?", None),
+        "build_local_data_context": lambda: server.build_local_data_context(city, slug),
+        "build_global_stats": lambda: server.build_global_stats(server.CITIES_DATA, server.ELECTORAL_DATA),
+    }
+    for name, call in calls.items():
+        n = max(args.requests // 10, 20)
+        start = time.perf_counter()
+        for _ in range(n):
+            call()
+        print(f"{name}: {(time.perf_counter() - start) / n * 1e6:.0f}µs por chamada")
+
+
+def bench_dossiers(args):
+    """
+    Dossiês por município em lote: geração do estado inteiro sem cache (pool
+    de processos), com o cache cheio, e depois de alterar os votos de algumas
+    cidades (só elas são regeradas), em HTML e XLSX sobre os dados sintéticos.
+    """
+    import dossier
+    import server
+
+    generate_synthetic_data(args.investments, args.years, args.seed)
+    server.load_all()
+
+    def run(label, fmt):
+        start = time.perf_counter()
+        snapshot = server.STATE.current
+        slugs = server.select_dossier_cities(snapshot)
+        batch = dossier.DossierBatch(server.dossier_jobs(snapshot, slugs, fmt), fmt)
+        size = sum(len(chunk) for chunk in dossier.iter_zip(batch.results(), fmt, batch.render))
+        print(f"{fmt:4} {label:22} {len(batch.pending):3} gerados / {len(batch.cached):3} do cache | "
+              f"{time.perf_counter() - start:6.2f}s | ZIP {size / 1024:,.0f} KiB")
+
+    print(f"{dossier.DOSSIER_WORKERS} processos")
+    for fmt in dossier.FORMATS:
+        run("frio", fmt)
+        run("cache cheio", fmt)
+    changed = {slug: [{"ano": 2026, "votos": 100}] for slug in list(server.CITIES_DATA)[:10]}
+    server.publish(lambda snap: {"votos": {**snap.votos, **changed}}, [])
+    for fmt in dossier.FORMATS:
+        run("10 cidades alteradas", fmt)
+    dossier.shutdown_pool()
+
+
+async def bench_history(args):
+    """
+    Histórico versionado: merges pequenos de investimentos e edições da
+    campanha (--requests no total), um DELETE e a restauração da revisão
+    anterior. Mostra o espaço de deltas x checkpoints e o tempo para
+    reconstruir revisões a distâncias diferentes do último checkpoint.
+    """
+    generate_synthetic_data(args.investments, args.years, args.seed)
+    rng = random.Random(args.seed)
+    async with open_client(args) as (client, server):
+        history = server.HISTORY
+        slugs = list(server.CITIES_DATA)
+        start = time.perf_counter()
+        for i in range(args.requests):
+            if i % 2:
+                await client.post("/api/campaign/update", json={"city_slug": rng.choice(slugs),
+                                                               "votes": rng.randint(0, 5000), "money": float(i)})
+            else:
+                items = [{"cityId": slug, "cityName": slug, "ano": 2026, "valor": float(rng.randint(1, 10**6)),
+                          "area": rng.choice(AREAS), "tipo": rng.choice(TIPOS), "descricao": f"Lote {i}"}
+                         for slug in rng.sample(slugs, 20)]
+                await client.post("/api/investments/merge", json={"investments": items})
+        await asyncio.to_thread(history.sync)
+        elapsed = time.perf_counter() - start
+        before_delete = (await client.get("/api/history?limit=1")).json()["revisions"][0]["revision"]
+        await client.delete("/api/investments")
+        start = time.perf_counter()
+        r = await client.post(f"/api/history/{before_delete}/restore")
+        restore = time.perf_counter() - start
+        await asyncio.to_thread(history.sync)
+
+        totals = (await client.get("/api/history?limit=1")).json()["totals"]
+        print(f"{args.requests} edições + DELETE + restauração: {totals['revisions']} revisões "
+              f"({elapsed / args.requests * 1000:.1f}ms por edição, gravação incluída)")
+        for dataset, kinds in sorted(totals["datasets"].items()):
+            parts = [f"{kind} {v['count']} ({v['bytes'] / 1024:,.0f} KiB, {v['bytes'] / v['count'] / 1024:,.1f} KiB cada)"
+                     for kind, v in sorted(kinds.items())]
+            print(f"  {dataset:12} " + " | ".join(parts))
+        print(f"  restauração de {r.json()['investments']:,} investimentos: {restore * 1000:.0f}ms")
+
+        latest = (await client.get("/api/history?limit=1")).json()["revisions"][0]["revision"]
+        for revision in (1, before_delete // 2, before_delete, latest):
+            timings = []
+            for _ in range(3):
+                start = time.perf_counter()
+                await asyncio.to_thread(history.state_at, "investments", revision)
+                timings.append(time.perf_counter() - start)
+            print(f"  reconstrução dos investimentos na revisão {revision}: {min(timings) * 1000:.0f}ms")
+        start = time.perf_counter()
+        r = await client.get(f"/api/history/diff?dataset=investments&from=1&to={before_delete}")
+        print(f"  diff revisão 1 -> {before_delete}: {r.json()['stats']} em {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+STARTUP_PROBE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {project!r})
+import server
+imported = time.perf_counter()
+
+async def main():
+    async with server.lifespan(server.app):
+        return time.perf_counter()
+
+ready = asyncio.run(main())
+print("STARTUP " + json.dumps({{"import_ms": (imported - start) * 1000, "ready_ms": (ready - start) * 1000}}))
+"""
+
+
+def bench_startup(args):
+    """Tempo até o servidor estar pronto (import + lifespan), sem snapshot (frio) e com snapshot (quente)."""
+    import statistics
+    import subprocess
+
+    from startup_snapshot import SNAPSHOT_PATH
+
+    probe = STARTUP_PROBE.format(project=PROJECT_DIR)
+    runs = max(args.requests // 200, 3)
+    for label, keep_snapshot in (("frio (sem snapshot)", False), ("quente (com snapshot)", True)):
+        timings = []
+        for _ in range(runs):
+            if not keep_snapshot and os.path.exists(SNAPSHOT_PATH):
+                os.remove(SNAPSHOT_PATH)
+            out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout
+            line = next(l for l in out.splitlines() if l.startswith("STARTUP "))
+            timings.append(json.loads(line[len("STARTUP "):]))
+        print(f"startup {label}: import {statistics.median(t['import_ms'] for t in timings):.0f}ms | "
+              f"pronto {statistics.median(t['ready_ms'] for t in timings):.0f}ms (mediana de {runs})")
+
+
+def bench_all(args):
+    """
+    Todos os cenários, cada um no seu processo (dados temporários e estado do
+    servidor limpos), com os mesmos argumentos; falha se algum falhar. É o
+    portão antes de integrar: os cenários com verificação saem com código 1.
+    """
+    import subprocess
+
+    forwarded = sys.argv[2:]
+    failed = []
+    for name in SCENARIOS:
+        if name == "all":
+            continue
+        print(f"\n=== {name} ===", flush=True)
+        start = time.perf_counter()
+        code = subprocess.run([sys.executable, os.path.abspath(__file__), name, *forwarded], cwd=PROJECT_DIR).returncode
+        print(f"=== {name}: {'ok' if code == 0 else f'FALHOU (código {code})'} em {time.perf_counter() - start:.1f}s",
+              flush=True)
+        if code != 0:
+            failed.append(name)
+    if failed:
+        print(f"\nCenários com falha: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"\nTodos os {len(SCENARIOS) - 1} cenários passaram.")
+
+
+SCENARIOS = {
+    "all": bench_all,
+    "suite": bench_suite,
+    "startup": bench_startup,
+    "chat_cache": bench_chat_cache,
+    "chat_burst": bench_chat_burst,
+    "chat_tools": bench_chat_tools,
+    "chat_session": bench_chat_session,
+    "retrieval": bench_retrieval,
+    "allocation": bench_allocation,
+    "reference": bench_reference,
+    "reload": bench_reload,
+    "encoding": bench_encoding,
+    "crosstab": bench_crosstab,
+    "history": bench_history,
+    "dossiers": bench_dossiers,
+    "first_paint": bench_first_paint,
+    "campaign_update": bench_campaign_update,
+    "state_stress": bench_state_stress,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do servidor do Mapa Paraná")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=1000, help="requisições por endpoint (ajustadas pelo peso)")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--url", help="servidor externo (ex.: http://localhost:8082); padrão: em processo")
+    parser.add_argument("--endpoints", nargs="*", help=f"subconjunto de: {' '.join(w[0] for w in WORKLOADS)}")
+    parser.add_argument("--investments", type=int, default=20000, help="investimentos sintéticos carregados")
+    parser.add_argument("--years", type=int, nargs="+", default=[2018, 2020, 2022, 2024])
+    parser.add_argument("--save-size", type=int, default=5000, help="investimentos enviados por /api/investments/save")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="latência do LLM simulado (s)")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.1,
+                        help="fração de chamadas ao LLM simulado que falham com rate limit (chat_burst)")
+    parser.add_argument("--clients", type=int, default=8, help="clientes distintos simulados (chat_burst)")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="latência da busca simulada (s)")
+    parser.add_argument("--rtt", type=float, default=0.15, help="latência de rede simulada por requisição (first_paint)")
+    parser.add_argument("--bandwidth", type=float, default=190_000, help="banda simulada em bytes/s (first_paint)")
+    parser.add_argument("--output", help="grava os resultados em JSON")
+    parser.add_argument("--baseline", help="compara com uma linha de base e falha em caso de regressão")
+    parser.add_argument("--save-baseline", help="grava os resultados como nova linha de base")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="folga aceita em relação à linha de base")
+    args = parser.parse_args()
+
+    workdir = prepare_workdir()
+    try:
+        scenario = SCENARIOS[args.scenario]
+        if asyncio.iscoroutinefunction(scenario):
+            asyncio.run(scenario(args))
+        else:
+            scenario(args)
+    finally:
+        os.chdir(PROJECT_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
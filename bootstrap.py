@@ -0,0 +1,98 @@
+"""
+Carga inicial do app (/api/bootstrap): tudo o que o mapa precisa para o
+primeiro desenho numa única resposta compacta.
+
+- cidades em colunas (uma lista por campo, na mesma ordem dos ids), só com
+  os campos que o mapa e a barra lateral usam;
+- métricas de campanha por cidade (votos e investimento) alinhadas aos ids;
+- quebras de classe do coroplético de cada camada, calculadas no servidor:
+  quantis para população e PIB (escala por posição, como o mapa já fazia) e
+  quebras naturais de Jenks para votos e investimento (distribuições muito
+  assimétricas). Cidades com valor 0 ficam fora: o mapa as pinta de cinza.
+"""
+
+import numpy as np
+
+CITY_COLUMNS = ("nome", "partido", "prefeito", "habitantes", "area_km2", "densidade", "pib_per_capita", "idhm",
+                "gentilico", "aniversario", "economia", "descricao")
+CLASSES = 7  # uma classe por trecho da escala de cores do mapa
+LAYERS = {
+    "habitantes": "quantile",
+    "pib_per_capita": "quantile",
+    "votes": "jenks",
+    "money": "jenks",
+}
+
+
+def quantile_breaks(values, k=CLASSES):
+    return np.quantile(values, np.linspace(0, 1, k + 1)).tolist()
+
+
+def jenks_breaks(values, k=CLASSES):
+    """
+    Quebras naturais (Fisher-Jenks): partição ótima dos valores ordenados em k
+    classes minimizando a soma das variâncias internas. Programação dinâmica
+    vetorizada: custo de cada intervalo por somas acumuladas, O(k·n²) em NumPy.
+    """
+    x = np.sort(np.asarray(values, dtype=np.float64))
+    n = len(x)
+    k = min(k, len(np.unique(x)))
+    if k <= 1:
+        return [float(x[0]), float(x[-1])]
+    s1 = np.concatenate(([0.0], np.cumsum(x)))
+    s2 = np.concatenate(([0.0], np.cumsum(x * x)))
+    # cost[i, j]: soma dos quadrados dos desvios de x[i:j + 1]
+    i = np.arange(n)[:, None]
+    j = np.arange(n)[None, :]
+    count = np.maximum(j - i + 1, 1)
+    total = s1[j + 1] - s1[i]
+    cost = np.where(j >= i, (s2[j + 1] - s2[i]) - total * total / count, np.inf)
+
+    best = cost[0].copy()  # best[j]: menor custo para x[:j + 1] em c classes
+    starts = []
+    for _ in range(1, k):
+        # a última classe começa em i + 1: best_anterior[i] + cost[i + 1, j]
+        candidates = best[:-1, None] + cost[1:, :]
+        start = np.argmin(candidates, axis=0)
+        best = candidates[start, np.arange(n)]
+        starts.append(start + 1)
+    breaks = [float(x[-1])]
+    end = n - 1
+    for start in reversed(starts):
+        first = int(start[end])
+        breaks.append(float(x[first - 1]))
+        end = first - 1
+    breaks.append(float(x[0]))
+    return breaks[::-1]
+
+
+def class_breaks(values, method, k=CLASSES):
+    positive = [v for v in values if v and v > 0]
+    if not positive:
+        return None
+    breaks = jenks_breaks(positive, k) if method == "jenks" else quantile_breaks(positive, k)
+    return {"method": method, "breaks": [round(b, 4) for b in breaks]}
+
+
+def build_bootstrap(cities, electoral, campaign, data_version):
+    """Monta o payload (dict) da carga inicial para uma versão dos dados."""
+    ids = list(cities)
+    columns = {"id": ids}
+    for field in CITY_COLUMNS:
+        columns[field] = [cities[slug].get(field) for slug in ids]
+    columns["eleitores"] = [(electoral.get(slug) or {}).get("total_eleitores") for slug in ids]
+
+    votes = [(campaign.get(slug) or {}).get("votes", 0) for slug in ids]
+    money = [round((campaign.get(slug) or {}).get("money", 0), 2) for slug in ids]
+    layer_values = {"habitantes": columns["habitantes"], "pib_per_capita": columns["pib_per_capita"],
+                    "votes": votes, "money": money}
+    return {
+        "data_version": data_version,
+        "cities": columns,
+        "campaign": {"votes": votes, "money": money},
+        "totals": {
+            "votes": sum(c.get("votes", 0) for c in campaign.values()),
+            "money": round(sum(c.get("money", 0) for c in campaign.values()), 2),
+        },
+        "layers": {name: class_breaks(layer_values[name], method) for name, method in LAYERS.items()},
+    }
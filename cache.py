@@ -0,0 +1,90 @@
+"""
+Cache em memória com TTL + LRU e coalescência de chamadas concorrentes
+(single-flight) para operações caras como o /api/chat.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    """Dicionário limitado: entradas expiram após `ttl` segundos e a menos usada sai primeiro."""
+
+    def __init__(self, maxsize=256, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        entry = self._data.get(key, MISSING)
+        if entry is MISSING:
+            return MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        entry = self._data.pop(key, MISSING)
+        return MISSING if entry is MISSING else entry[1]
+
+    def purge_expired(self):
+        """Remove as entradas vencidas que ninguém consultou desde então."""
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._data.items() if expires_at < now]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+
+class SingleFlight:
+    """Garante uma única execução por chave em andamento; as demais chamadas aguardam o mesmo resultado."""
+
+    def __init__(self):
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def run(self, key, factory):
+        """
+        Executa `await factory()` se não houver chamada em andamento para `key`.
+        Devolve (resultado, lider) — lider=False quando o resultado foi compartilhado.
+        Exceções também são repassadas a todos os que aguardam.
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future), False
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evita aviso de "exception never retrieved" quando ninguém estava aguardando
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, True
+        finally:
+            self._inflight.pop(key, None)
@@ -0,0 +1,155 @@
+"""
+Sessões de conversa do /api/chat: perguntas de acompanhamento ("e em
+Maringá?", "compare com o ano anterior") sem o cliente colar o histórico na
+mensagem.
+
+- Cada turno guarda só a pergunta e a resposta, com espaços compactados; os
+  blocos de contexto (dados locais, relatório, busca web) não entram no
+  histórico e são montados de novo a cada turno, exceto o contexto local da
+  cidade, reaproveitado enquanto a cidade e a versão dos dados não mudarem.
+- A cidade resolvida num turno vale para os seguintes até outra ser citada.
+- Quando o histórico passa de HISTORY_TOKENS, os turnos mais antigos (todos
+  menos os KEEP_TURNS últimos) são resumidos em segundo plano, depois da
+  resposta, e o resumo substitui esses turnos. O prompt de cada turno fica
+  limitado a resumo + últimos turnos, não importa o tamanho da conversa.
+- Sessões ociosas por SESSION_TTL segundos expiram; acima de MAX_SESSIONS, a
+  menos usada sai primeiro.
+"""
+
+import asyncio
+import os
+import re
+import secrets
+
+from cache import MISSING, TTLCache
+
+SESSION_TTL = float(os.getenv("CHAT_SESSION_TTL", "1800"))
+MAX_SESSIONS = int(os.getenv("CHAT_SESSIONS_MAX", "1000"))
+HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "2000"))  # orçamento do histórico no prompt
+SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+KEEP_TURNS = int(os.getenv("CHAT_KEEP_TURNS", "2"))  # turnos mais recentes sempre mantidos na íntegra
+
+_SPACES = re.compile(r"[ \t]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def compact(text):
+    """Colapsa espaços e linhas em branco repetidas (mantém as quebras de linha do Markdown)."""
+    return _BLANK_LINES.sub("\n\n", _SPACES.sub(" ", text or "")).strip()
+
+
+def estimate_tokens(text):
+    """Aproximação de ~4 caracteres por token (suficiente para o orçamento do histórico)."""
+    return len(text) // 4 + 1
+
+
+class Turn:
+    __slots__ = ("question", "answer", "tokens")
+
+    def __init__(self, question, answer):
+        self.question = compact(question)
+        self.answer = compact(answer)
+        self.tokens = estimate_tokens(self.question) + estimate_tokens(self.answer)
+
+
+class ChatSession:
+    __slots__ = ("id", "turns", "summary", "city_slug", "lock", "compacting", "_context")
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.turns = []
+        self.summary = ""
+        self.city_slug = None
+        self.lock = asyncio.Lock()  # um turno por vez na mesma sessão
+        self.compacting = False
+        self._context = None  # (chave, bloco) do último contexto local montado
+
+    def history_tokens(self):
+        summary = estimate_tokens(self.summary) if self.summary else 0
+        return summary + sum(turn.tokens for turn in self.turns)
+
+    def messages(self):
+        """Histórico no formato de mensagens do modelo: resumo (se houver) e turnos recentes."""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Resumo da conversa até aqui:\n{self.summary}"})
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn.question})
+            messages.append({"role": "assistant", "content": turn.answer})
+        return messages
+
+    def add_turn(self, question, answer):
+        self.turns.append(Turn(question, answer))
+
+    def context_block(self, key, build):
+        """Bloco de contexto reaproveitado entre turnos enquanto a chave (cidade, versão dos dados) não mudar."""
+        if self._context is None or self._context[0] != key:
+            self._context = (key, build())
+        return self._context[1]
+
+    def needs_compaction(self):
+        return not self.compacting and len(self.turns) > KEEP_TURNS and self.history_tokens() > HISTORY_TOKENS
+
+    def fold(self, count, summary):
+        """Troca os `count` turnos mais antigos pelo resumo (turnos chegados durante o resumo ficam)."""
+        self.turns = self.turns[count:]
+        self.summary = compact(summary)
+
+    def to_dict(self):
+        return {
+            "session_id": self.id,
+            "city": self.city_slug,
+            "summary": self.summary,
+            "turns": [{"question": t.question, "answer": t.answer} for t in self.turns],
+            "history_tokens": self.history_tokens(),
+        }
+
+
+def extractive_summary(summary, turns, budget=SUMMARY_TOKENS):
+    """
+    Resumo sem o modelo (falha ou fila cheia): cada turno vira uma linha com a
+    pergunta e a primeira frase da resposta; as linhas mais antigas saem
+    primeiro quando o orçamento estoura.
+    """
+    lines = [line for line in summary.splitlines() if line.strip()]
+    for turn in turns:
+        first = _SENTENCE_END.split(turn.answer.replace("\n", " "), 1)[0]
+        lines.append(f"- P: {turn.question[:200]} | R: {first[:240]}")
+    limit = budget * 4
+    kept, size = [], 0
+    for line in reversed(lines):
+        size += len(line) + 1
+        if size > limit and kept:
+            break
+        kept.append(line)
+    return "\n".join(reversed(kept))
+
+
+class SessionStore:
+    """Sessões por id, com expiração por inatividade (o prazo renova a cada turno) e limite de quantidade."""
+
+    def __init__(self, maxsize=MAX_SESSIONS, ttl=SESSION_TTL):
+        self._sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id):
+        session = self._sessions.get(session_id) if session_id else MISSING
+        return None if session is MISSING else session
+
+    def open(self, session_id=None):
+        """Sessão existente ou uma nova (com id novo; ids expirados ou desconhecidos não são reaproveitados)."""
+        session = self.get(session_id)
+        if session is None:
+            self._sessions.purge_expired()
+            session = ChatSession(secrets.token_urlsafe(12))
+            self._sessions.set(session.id, session)
+        return session
+
+    def touch(self, session):
+        self._sessions.set(session.id, session)
+
+    def delete(self, session_id):
+        return self._sessions.pop(session_id) is not MISSING
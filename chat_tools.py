@@ -0,0 +1,234 @@
+"""
+Ferramentas (function calling) do modo "tools" do /api/chat.
+
+Em vez de despejar relatórios inteiros no prompt, o modelo recebe estas
+funções e pede só os dados de que precisa. Todas rodam em memória sobre os
+dados já carregados (cidades, eleitorado e um snapshot de campanha/
+investimentos) e devolvem JSON compacto.
+"""
+
+import json
+from collections import defaultdict
+
+from text_utils import fold_accents
+
+MAX_LIMIT = 25
+
+RANK_METRICS = {
+    "habitantes": "População",
+    "pib_per_capita": "PIB per capita",
+    "idhm": "IDHM",
+    "area_km2": "Área (km²)",
+    "densidade": "Densidade demográfica",
+    "eleitores": "Total de eleitores (TSE)",
+    "votos": "Votos recebidos pela campanha",
+    "investimento": "Total investido pela campanha",
+    "custo_por_voto": "Investimento / votos",
+    "conversao": "Votos / eleitores (%)",
+}
+
+DEMOGRAPHIC_DIMENSIONS = ["genero", "faixa_etaria", "grau_instrucao", "estado_civil", "cor_raca"]
+
+TOOLS = [
+    {"type": "function", "function": {
+        "name": "get_city",
+        "description": "Dados de uma cidade do Paraná: prefeito, partido, população, economia, eleitorado e resultado da campanha.",
+        "parameters": {"type": "object", "properties": {
+            "city": {"type": "string", "description": "Nome ou slug da cidade"},
+        }, "required": ["city"]},
+    }},
+    {"type": "function", "function": {
+        "name": "rank_cities",
+        "description": "Ranking de cidades por uma métrica, opcionalmente filtrado por partido do prefeito.",
+        "parameters": {"type": "object", "properties": {
+            "metric": {"type": "string", "enum": list(RANK_METRICS)},
+            "order": {"type": "string", "enum": ["desc", "asc"]},
+            "limit": {"type": "integer", "minimum": 1, "maximum": MAX_LIMIT},
+            "partido": {"type": "string", "description": "Sigla do partido do prefeito"},
+        }, "required": ["metric"]},
+    }},
+    {"type": "function", "function": {
+        "name": "investments_by",
+        "description": "Totais dos investimentos/emendas agrupados por área, ano, cidade ou tipo, com filtros opcionais.",
+        "parameters": {"type": "object", "properties": {
+            "group_by": {"type": "string", "enum": ["area", "ano", "cidade", "tipo"]},
+            "city": {"type": "string"},
+            "ano": {"type": "integer"},
+            "area": {"type": "string"},
+            "limit": {"type": "integer", "minimum": 1, "maximum": MAX_LIMIT},
+        }, "required": ["group_by"]},
+    }},
+    {"type": "function", "function": {
+        "name": "similar_cities",
+        "description": "Cidades mais parecidas com uma cidade em população, economia e perfil do eleitorado.",
+        "parameters": {"type": "object", "properties": {
+            "city": {"type": "string"},
+            "limit": {"type": "integer", "minimum": 1, "maximum": MAX_LIMIT},
+        }, "required": ["city"]},
+    }},
+    {"type": "function", "function": {
+        "name": "demographics",
+        "description": "Perfil do eleitorado (TSE) de uma cidade, em % do total de eleitores.",
+        "parameters": {"type": "object", "properties": {
+            "city": {"type": "string"},
+            "dimensions": {"type": "array", "items": {"type": "string", "enum": DEMOGRAPHIC_DIMENSIONS}},
+        }, "required": ["city"]},
+    }},
+]
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) else None
+
+
+class ChatTools:
+    """Executa as ferramentas sobre uma versão fixa dos dados (a mesma durante toda a conversa)."""
+
+    def __init__(self, cities, electoral, snapshot, similarity=None):
+        self.cities = cities
+        self.electoral = electoral  # {slug do catálogo: registro do TSE} (ReferenceData.electoral_by_city)
+        self.snapshot = snapshot
+        self.similarity = similarity  # função que devolve o SimilarityEngine (montado sob demanda)
+        self._by_name = None
+
+    def call(self, name, arguments):
+        """Executa a ferramenta `name` com os argumentos JSON do modelo; erros viram {"erro": ...}."""
+        handler = getattr(self, f"tool_{name}", None)
+        if handler is None:
+            return {"erro": f"ferramenta desconhecida: {name}"}
+        try:
+            kwargs = json.loads(arguments or "{}")
+            return handler(**kwargs)
+        except (TypeError, ValueError) as e:
+            return {"erro": f"argumentos inválidos: {e}"}
+
+    # --- Resolução de cidades ---
+    def resolve(self, city):
+        if not city:
+            return None
+        if city in self.cities:
+            return city
+        if self._by_name is None:
+            self._by_name = {fold_accents(c.get("nome", "")): slug for slug, c in self.cities.items()}
+        key = fold_accents(city).strip()
+        return self._by_name.get(key) or self._by_name.get(key.replace("_", " ").replace("-", " "))
+
+    def _eleitores(self, slug):
+        return (self.electoral.get(slug) or {}).get("total_eleitores", 0)
+
+    def _campaign(self, slug):
+        camp = self.snapshot.campaign.get(slug)
+        if not camp:
+            return None
+        votes, money = camp.get("votes", 0), camp.get("money", 0)
+        eleitores = self._eleitores(slug)
+        return {
+            "votos": votes,
+            "investimento": round(money, 2),
+            "custo_por_voto": round(money / votes, 2) if votes else None,
+            "conversao": round(votes / eleitores * 100, 2) if eleitores else None,
+        }
+
+    def _metric(self, slug, metric):
+        city = self.cities[slug]
+        if metric == "eleitores":
+            return self._eleitores(slug) or None
+        if metric in ("votos", "investimento", "custo_por_voto", "conversao"):
+            return (self._campaign(slug) or {}).get(metric)
+        return _number(city.get(metric))
+
+    # --- Ferramentas ---
+    def tool_get_city(self, city):
+        slug = self.resolve(city)
+        if slug is None:
+            return {"erro": f"cidade não encontrada: {city}"}
+        c = self.cities[slug]
+        result = {
+            "slug": slug,
+            "nome": c.get("nome"),
+            "prefeito": c.get("prefeito"),
+            "partido": c.get("partido"),
+            "habitantes": c.get("habitantes"),
+            "area_km2": c.get("area_km2"),
+            "pib_per_capita": c.get("pib_per_capita"),
+            "idhm": c.get("idhm"),
+            "eleitores": self._eleitores(slug) or None,
+        }
+        campaign = self._campaign(slug)
+        if campaign:
+            result["campanha"] = campaign
+        return result
+
+    def tool_rank_cities(self, metric, order="desc", limit=10, partido=None):
+        if metric not in RANK_METRICS:
+            return {"erro": f"métrica inválida: {metric}"}
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        rows = []
+        for slug, c in self.cities.items():
+            if partido and (c.get("partido") or "").upper() != partido.upper():
+                continue
+            value = self._metric(slug, metric)
+            if value is not None:
+                rows.append((value, c.get("nome")))
+        rows.sort(reverse=(order != "asc"))
+        return {"metrica": metric, "total_cidades": len(rows),
+                "ranking": [{"nome": nome, metric: value} for value, nome in rows[:limit]]}
+
+    def tool_investments_by(self, group_by, city=None, ano=None, area=None, limit=10):
+        keys = {"area": "area", "ano": "ano", "cidade": "cityName", "tipo": "tipo"}
+        if group_by not in keys:
+            return {"erro": f"agrupamento inválido: {group_by}"}
+        slug = None
+        if city:
+            slug = self.resolve(city)
+            if slug is None:
+                return {"erro": f"cidade não encontrada: {city}"}
+        ano = int(ano) if ano is not None else None
+        area_key = fold_accents(area) if area else None
+        limit = max(1, min(int(limit), MAX_LIMIT))
+
+        totals = defaultdict(lambda: [0.0, 0])
+        for inv in self.snapshot.investments:
+            if slug is not None and inv.get("cityId") != slug:
+                continue
+            if ano is not None and inv.get("ano") != ano:
+                continue
+            if area_key is not None and fold_accents(inv.get("area")) != area_key:
+                continue
+            entry = totals[inv.get(keys[group_by])]
+            entry[0] += inv.get("valor", 0)
+            entry[1] += 1
+
+        groups = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            "total": round(sum(v for v, _ in totals.values()), 2),
+            "quantidade": sum(n for _, n in totals.values()),
+            "grupos": [{group_by: key, "valor": round(v, 2), "quantidade": n} for key, (v, n) in groups[:limit]],
+        }
+
+    def tool_similar_cities(self, city, limit=5):
+        slug = self.resolve(city)
+        if slug is None:
+            return {"erro": f"cidade não encontrada: {city}"}
+        if self.similarity is None:
+            return {"erro": "similaridade indisponível"}
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        return {"nome": self.cities[slug].get("nome"),
+                "semelhantes": [{"nome": c["nome"], "similaridade": c["similarity"]}
+                                for c in self.similarity().similar(slug, limit)]}
+
+    def tool_demographics(self, city, dimensions=None):
+        slug = self.resolve(city)
+        data = self.electoral.get(slug) if slug else None
+        if not data:
+            return {"erro": f"sem dados do TSE para: {city}"}
+        result = {"nome": self.cities[slug].get("nome"), "total_eleitores": data.get("total_eleitores")}
+        for dim in dimensions or DEMOGRAPHIC_DIMENSIONS:
+            values = data.get(dim)
+            if not values:
+                continue
+            if dim == "faixa_etaria":
+                # {"30 a 34 anos": {"M": .., "F": .., "N": ..}} -> total por faixa
+                values = {faixa: round(sum(v.values()), 2) for faixa, v in values.items() if sum(v.values())}
+            result[dim] = values
+        return result
@@ -0,0 +1,146 @@
+"""
+Modelo tipado das cidades (cidades_pr.json), montado uma vez na carga.
+
+O JSON mistura números como texto ("4100103.0", "PIB per Capita: R$
+41,039.39") com marcadores "Não informado". Aqui cada cidade vira um
+objeto com __slots__, números já convertidos, None no lugar dos marcadores
+e o código IBGE inteiro. O catálogo guarda também o que antes era refeito a
+cada requisição: rankings, contagem de partidos, cidades por partido, nomes
+em minúscula para achar cidades na mensagem e a lista de /api/cities já
+serializada.
+"""
+
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+NOT_INFORMED = "Não informado"
+
+TEXT_FIELDS = ("nome", "prefeito", "partido", "gentilico", "descricao", "clima", "economia", "fundacao", "aniversario")
+INT_FIELDS = ("habitantes", "eleitores")
+FLOAT_FIELDS = ("area_km2", "densidade", "pib_per_capita", "idhm", "altitude_m", "distancia_capital_km")
+FIELDS = ("slug", "ibge_id") + TEXT_FIELDS + INT_FIELDS + FLOAT_FIELDS
+RANKED_FIELDS = ("habitantes", "pib_per_capita", "area_km2", "densidade", "idhm")
+_FIELD_SET = frozenset(FIELDS)
+
+_NUMBER = re.compile(r"-?\d[\d.,]*")
+
+
+def parse_number(value):
+    """
+    Número de um valor do JSON: int/float passam direto; em texto, pega o
+    primeiro número, aceitando "41,039.39" e "41.039,39". None se não houver.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return None if isinstance(value, float) and math.isnan(value) else value
+    if not isinstance(value, str):
+        return None
+    match = _NUMBER.search(value)
+    if not match:
+        return None
+    text = match.group().rstrip(".,")
+    if "," in text and "." in text:
+        decimal = "," if text.rfind(",") > text.rfind(".") else "."
+        text = text.replace("." if decimal == "," else ",", "").replace(decimal, ".")
+    elif "," in text:
+        # Vírgula seguida de exatamente 3 dígitos é separador de milhar ("41,039")
+        text = text.replace(",", "") if len(text.rpartition(",")[2]) == 3 else text.replace(",", ".")
+    elif text.count(".") > 1:
+        text = text.replace(".", "")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _text(value):
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return None if not value or value == NOT_INFORMED else value
+
+
+class City:
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for name in FIELDS:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_raw(cls, slug, raw):
+        fields = {name: _text(raw.get(name)) for name in TEXT_FIELDS}
+        for name in INT_FIELDS:
+            number = parse_number(raw.get(name))
+            fields[name] = int(number) if number is not None else None
+        for name in FLOAT_FIELDS:
+            number = parse_number(raw.get(name))
+            fields[name] = float(number) if number is not None else None
+        if fields["pib_per_capita"] is None:
+            fields["pib_per_capita"] = parse_number(fields["economia"])
+        code = parse_number(raw.get("ibge_id"))
+        return cls(slug=slug, ibge_id=int(code) if code is not None else None, **fields)
+
+    def get(self, field, default=None):
+        """Acesso no estilo dict, para quem lê cidades como mapeamentos; None vira `default`."""
+        value = getattr(self, field) if field in _FIELD_SET else None
+        return default if value is None else value
+
+    def __getitem__(self, field):
+        if field not in _FIELD_SET:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in FIELDS if getattr(self, name) is not None}
+
+    def __repr__(self):
+        return f"City({self.slug!r}, {self.nome!r})"
+
+
+class CityCatalog(dict):
+    """{slug: City} com as estruturas derivadas pré-calculadas."""
+
+    @classmethod
+    def from_raw(cls, raw_cities):
+        catalog = cls((slug, City.from_raw(slug, raw)) for slug, raw in raw_cities.items())
+        catalog._derive()
+        return catalog
+
+    def _derive(self):
+        cities = list(self.values())
+        self.rankings = {
+            field: tuple(c.slug for c in sorted((c for c in cities if getattr(c, field) is not None),
+                                                key=lambda c: getattr(c, field), reverse=True))
+            for field in RANKED_FIELDS
+        }
+        by_population = [self[slug] for slug in self.rankings["habitantes"]]
+        by_population += [c for c in cities if c.habitantes is None]
+        self.party_counts = Counter(c.partido or "Outros" for c in cities).most_common()
+        by_party = defaultdict(list)
+        for c in by_population:
+            if c.partido:
+                by_party[c.partido].append(c.slug)
+        self.by_party = {party: tuple(slugs) for party, slugs in by_party.items()}
+        self.names_lower = tuple((c.nome.lower(), c.slug) for c in cities if c.nome)
+        self.summary = tuple(sorted(({"id": c.slug, "nome": c.nome, "habitantes": c.habitantes, "partido": c.partido}
+                                     for c in cities), key=lambda item: item["nome"] or ""))
+        self.summary_json = json.dumps(self.summary, ensure_ascii=False).encode("utf-8")
+
+    def top(self, field, n=10):
+        return [self[slug] for slug in self.rankings[field][:n]]
+
+    def party(self, party):
+        """Cidades do partido, da mais populosa para a menos."""
+        return [self[slug] for slug in self.by_party.get(party, ())]
+
+    def find_in_text(self, text):
+        """Primeira cidade cujo nome aparece no texto (comparação em minúsculas)."""
+        text = text.lower()
+        for name, slug in self.names_lower:
+            if name in text:
+                return self[slug]
+        return None
@@ -0,0 +1,163 @@
+"""
+Busca de cidades para autocomplete (/api/search).
+
+Índice montado uma vez sobre os dados de referência:
+- trie de termos sem acento (nome, gentílico, prefeito e partido), em que
+  cada nó guarda as cidades que têm algum termo com aquele prefixo;
+- tolerância a erros de digitação: a mesma trie é percorrida com a linha da
+  distância de Levenshtein, podando ramos acima da distância máxima.
+
+Cada termo da consulta precisa casar com a cidade (E lógico); o score soma
+o peso do campo × a qualidade do casamento (exato > prefixo > aproximado).
+"""
+
+import re
+
+from text_utils import fold_accents
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+FIELD_WEIGHTS = {"nome": 3.0, "partido": 2.0, "gentilico": 1.5, "prefeito": 1.0}
+EXACT, PREFIX, FUZZY = 1.0, 0.7, 0.4
+# Como no "prefix_length" do Lucene: a primeira letra precisa estar certa, o que limita a busca aproximada
+# a um ramo da trie e a mantém abaixo de 1ms
+FUZZY_PREFIX_LENGTH = 1
+MAX_LIMIT = 50
+
+
+def tokens(text):
+    return _TOKEN.findall(fold_accents(text)) if isinstance(text, str) else []
+
+
+def max_distance(term):
+    """Erros aceitos por tamanho do termo: nenhum até 3 letras, 1 até 8 e 2 a partir daí."""
+    if len(term) <= 3:
+        return 0
+    return 1 if len(term) <= 8 else 2
+
+
+class _Node:
+    __slots__ = ("children", "prefix_docs", "exact_docs")
+
+    def __init__(self):
+        self.children = {}
+        self.prefix_docs = {}  # cidade -> maior peso entre os termos abaixo deste nó
+        self.exact_docs = {}  # cidade -> maior peso entre os termos que terminam aqui
+
+
+def _keep_max(docs, doc, weight):
+    if weight > docs.get(doc, 0.0):
+        docs[doc] = weight
+
+
+class CitySearchIndex:
+    def __init__(self, cities):
+        self.root = _Node()
+        self.cities = cities
+        # Desempate: cidades maiores primeiro
+        self._population = {slug: c.get("habitantes") if isinstance(c.get("habitantes"), (int, float)) else 0
+                            for slug, c in cities.items()}
+        for slug, city in cities.items():
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in tokens(city.get(field)):
+                    self._insert(term, slug, weight)
+
+    def _insert(self, term, doc, weight):
+        node = self.root
+        for ch in term:
+            node = node.children.setdefault(ch, _Node())
+            _keep_max(node.prefix_docs, doc, weight)
+        _keep_max(node.exact_docs, doc, weight)
+
+    def _find(self, term):
+        node = self.root
+        for ch in term:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def _fuzzy(self, term, max_dist):
+        """
+        Cidades com um termo que começa com algo a até `max_dist` edições de
+        `term`. Distância de Damerau-Levenshtein (troca de letras vizinhas conta
+        como 1 erro) calculada linha a linha sobre a trie, podando os ramos em
+        que a linha inteira passa do limite.
+        """
+        matches = {}
+        fixed = term[:FUZZY_PREFIX_LENGTH]
+        start = self._find(fixed)
+        if start is None:
+            return matches
+        term = term[len(fixed):]
+        first_row = list(range(len(term) + 1))
+        if first_row[-1] <= max_dist:
+            return dict(start.prefix_docs)
+        stack = [(child, ch, first_row, None, None) for ch, child in start.children.items()]
+        while stack:
+            node, ch, prev, prev2, prev_ch = stack.pop()
+            row = [prev[0] + 1]
+            for i in range(1, len(term) + 1):
+                cost = min(row[i - 1] + 1, prev[i] + 1, prev[i - 1] + (term[i - 1] != ch))
+                if i > 1 and prev2 is not None and term[i - 1] == prev_ch and term[i - 2] == ch:
+                    cost = min(cost, prev2[i - 2] + 1)
+                row.append(cost)
+            if row[-1] <= max_dist:
+                # O prefixo deste nó já está perto o bastante: vale para tudo abaixo dele
+                for doc, weight in node.prefix_docs.items():
+                    _keep_max(matches, doc, weight)
+                continue
+            if min(row) <= max_dist:
+                stack.extend((child, c, row, prev, ch) for c, child in node.children.items())
+        return matches
+
+    def _match_term(self, term):
+        """
+        Devolve {cidade: score} para um termo da consulta. Todo termo vale
+        como prefixo, para "sao jo" já achar "São José dos Pinhais".
+        """
+        scores = {}
+        node = self._find(term)
+        if node is not None:
+            for doc, weight in node.exact_docs.items():
+                scores[doc] = weight * EXACT
+            for doc, weight in node.prefix_docs.items():
+                _keep_max(scores, doc, weight * PREFIX)
+        if not scores:
+            max_dist = max_distance(term)
+            if max_dist:
+                for doc, weight in self._fuzzy(term, max_dist).items():
+                    scores[doc] = weight * FUZZY
+        return scores
+
+    def search(self, query, limit=10, offset=0):
+        """Devolve (total, resultados da página) ordenados por score e população."""
+        terms = tokens(query)
+        if not terms:
+            return 0, []
+        candidates = None
+        for term in terms:
+            term_scores = self._match_term(term)
+            if candidates is None:
+                candidates = term_scores
+            else:
+                candidates = {doc: score + term_scores[doc] for doc, score in candidates.items() if doc in term_scores}
+            if not candidates:
+                return 0, []
+
+        ranked = sorted(candidates.items(), key=lambda item: (-item[1], -self._population[item[0]], item[0]))
+        limit = max(1, min(limit, MAX_LIMIT))
+        offset = max(0, offset)
+        page = []
+        for slug, score in ranked[offset:offset + limit]:
+            city = self.cities[slug]
+            page.append({
+                "id": slug,
+                "nome": city.get("nome"),
+                "prefeito": city.get("prefeito"),
+                "partido": city.get("partido"),
+                "gentilico": city.get("gentilico"),
+                "habitantes": city.get("habitantes"),
+                "score": round(score, 3),
+            })
+        return len(ranked), page
@@ -0,0 +1,411 @@
+"""
+Dossiês estratégicos por município (HTML ou XLSX) gerados em lote.
+
+Cada dossiê junta numa peça só o que a equipe copiava do chat cidade por
+cidade: dados gerais (os mesmos de build_local_data_context), perfil do
+eleitorado, métricas de campanha, histórico de votos e investimentos.
+
+- As entradas de cada cidade são só dados dela (nada de rankings ou totais
+  do estado): a chave do dossiê é um hash dessas entradas + formato + versão
+  do layout, então mudar votos ou investimentos de uma cidade invalida só o
+  dossiê dela.
+- Os arquivos prontos ficam em DOSSIER_DIR (<slug>.<chave>.<formato>); um
+  lote só renderiza as cidades cuja chave não está lá.
+- As cidades a renderizar são distribuídas num pool de processos (o XLSX do
+  openpyxl é CPU puro e custa dezenas de ms por arquivo); cada processo
+  grava o arquivo no cache e devolve só o caminho.
+- O ZIP é montado em fluxo (zipfile sobre um buffer sem seek): os dossiês
+  do cache saem primeiro e os renderizados entram à medida que ficam prontos.
+
+Uso em lote (servidor parado ou em outra máquina, lê o armazenamento local):
+    python dossier.py                                  # 399 cidades, HTML
+    python dossier.py --format xlsx --cities londrina maringa -o dossies.zip
+"""
+
+import hashlib
+import html
+import json
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DOSSIER_DIR = os.getenv("DOSSIER_CACHE_DIR", "dossies_cache")
+DOSSIER_WORKERS = int(os.getenv("DOSSIER_WORKERS", "0")) or os.cpu_count() or 1
+# Abaixo disso renderiza no próprio processo: subir o pool custa mais que o trabalho
+POOL_MIN_JOBS = int(os.getenv("DOSSIER_POOL_MIN_JOBS", "8"))
+FORMATS = ("html", "xlsx")
+LAYOUT_VERSION = 2  # aumentar quando o conteúdo/layout dos dossiês mudar
+
+CITY_FIELDS = (("prefeito", "Prefeito"), ("partido", "Partido"), ("habitantes", "Habitantes"),
+               ("area_km2", "Área (km²)"), ("densidade", "Densidade (hab/km²)"),
+               ("pib_per_capita", "PIB per capita (R$)"), ("idhm", "IDHM"), ("gentilico", "Gentílico"),
+               ("economia", "Economia"), ("descricao", "Descrição"))
+ELECTORAL_SECTIONS = (("genero", "Gênero (%)"), ("grau_instrucao", "Grau de instrução (%)"),
+                      ("estado_civil", "Estado civil (%)"))
+
+
+def group_investments(investments):
+    """{cityId: [investimentos]} numa passada só, para montar as entradas de todas as cidades."""
+    by_city = {}
+    for inv in investments:
+        by_city.setdefault(inv.get("cityId"), []).append(inv)
+    return by_city
+
+
+def city_inputs(city, electoral, campaign, votos, investments):
+    """Entradas (só dados da cidade, serializáveis) de um dossiê."""
+    camp = campaign or {}
+    votes, money = camp.get("votes", 0) or 0, camp.get("money", 0) or 0
+    eleitores = (electoral or {}).get("total_eleitores") or 0
+    habitantes = city.habitantes or 0
+    return {
+        "slug": city.slug,
+        "city": city.to_dict(),
+        "electoral": dict(electoral) if electoral else None,
+        "campaign": {
+            "votes": votes,
+            "money": round(money, 2),
+            "cost_per_vote": round(money / votes, 2) if votes > 0 else 0,
+            "cost_per_pop": round(money / habitantes, 2) if habitantes > 0 else 0,
+            "conversion": round(votes / eleitores * 100, 2) if eleitores > 0 else 0,
+        },
+        "votos": sorted(({"ano": e.get("ano"), "votos": e.get("votos", 0)} for e in votos or ()),
+                        key=lambda e: e["ano"] or 0),
+        "investments": sorted(({field: inv.get(field) for field in ("ano", "valor", "area", "tipo", "descricao")}
+                               for inv in investments or ()),
+                              key=lambda inv: (-(inv["ano"] or 0), -(inv["valor"] or 0))),
+    }
+
+
+def dossier_key(inputs, fmt):
+    raw = json.dumps([LAYOUT_VERSION, fmt, inputs], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=10).hexdigest()
+
+
+def cache_path(slug, key, fmt, directory=DOSSIER_DIR):
+    return os.path.join(directory, f"{slug}.{key}.{fmt}")
+
+
+def _totals(items, field):
+    totals = {}
+    for item in items:
+        group = item.get(field) or "Não informado"
+        totals[group] = totals.get(group, 0) + (item.get("valor") or 0)
+    return sorted(totals.items(), key=lambda kv: (-kv[1], str(kv[0])))
+
+
+def _age_groups(electoral):
+    """[(faixa, % homens, % mulheres)] sem as faixas vazias, da mais nova à mais velha."""
+    from voter_cube import age_range
+    rows = []
+    for faixa, counts in (electoral.get("faixa_etaria") or {}).items():
+        m, f = counts.get("M", 0) or 0, counts.get("F", 0) or 0
+        if m or f:
+            rows.append((faixa, m, f))
+    # Pela idade mínima ("95 a 99 anos" antes de "100 anos ou mais"); rótulos sem faixa ("Inválida") no fim
+    return sorted(rows, key=lambda row: age_range(row[0]) or (float("inf"), row[0]))
+
+
+def money(value):
+    return f"R$ {value or 0:,.2f}"
+
+
+# --- Renderização ---
+HTML_STYLE = """
+body{font-family:system-ui,sans-serif;margin:2rem auto;max-width:60rem;color:#222}
+h1{margin-bottom:0}h2{border-bottom:2px solid #1d4e89;padding-bottom:.2rem;margin-top:2rem}
+table{border-collapse:collapse;width:100%;margin:.5rem 0}th,td{border:1px solid #ddd;padding:.3rem .5rem;text-align:left}
+th{background:#eef3f9}td.n{text-align:right}.kpi{display:flex;gap:1rem;flex-wrap:wrap}
+.kpi div{background:#eef3f9;padding:.6rem 1rem;border-radius:6px}.kpi b{display:block;font-size:1.2rem}
+"""
+
+
+def _table(headers, rows, numeric=()):
+    head = "".join(f"<th>{html.escape(h)}</th>" for h in headers)
+    body = "".join(
+        "<tr>" + "".join(f'<td class="n">{html.escape(str(v))}</td>' if i in numeric else f"<td>{html.escape(str(v))}</td>"
+                         for i, v in enumerate(row)) + "</tr>"
+        for row in rows)
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+def render_html(inputs):
+    city, electoral, camp = inputs["city"], inputs["electoral"], inputs["campaign"]
+    name = city.get("nome") or inputs["slug"]
+    parts = [f"<!DOCTYPE html><html lang=\"pt-BR\"><head><meta charset=\"utf-8\"><title>Dossiê - {html.escape(name)}</title>"
+             f"<style>{HTML_STYLE}</style></head><body><h1>{html.escape(name)}</h1><p>Dossiê estratégico do município</p>"]
+
+    parts.append("<h2>Campanha</h2><div class=\"kpi\">")
+    for label, value in (("Votos", f"{camp['votes']:,}"), ("Investimento", money(camp["money"])),
+                         ("Custo por voto", money(camp["cost_per_vote"])),
+                         ("Custo por habitante", money(camp["cost_per_pop"])),
+                         ("Conversão (votos/eleitorado)", f"{camp['conversion']:.2f}%")):
+        parts.append(f"<div>{html.escape(label)}<b>{html.escape(value)}</b></div>")
+    parts.append("</div>")
+
+    parts.append("<h2>Dados gerais</h2>")
+    parts.append(_table(("Campo", "Valor"), [(label, city[field]) for field, label in CITY_FIELDS if field in city]))
+
+    parts.append("<h2>Eleitorado (TSE)</h2>")
+    if electoral:
+        parts.append(f"<p>Total de eleitores: <b>{electoral.get('total_eleitores') or 0:,}</b></p>")
+        for field, label in ELECTORAL_SECTIONS:
+            values = electoral.get(field) or {}
+            if values:
+                parts.append(f"<h3>{html.escape(label)}</h3>")
+                parts.append(_table(("Categoria", "%"), sorted(values.items(), key=lambda kv: -(kv[1] or 0)), (1,)))
+        ages = _age_groups(electoral)
+        if ages:
+            parts.append("<h3>Faixa etária (% do eleitorado)</h3>")
+            parts.append(_table(("Faixa", "Homens", "Mulheres"), ages, (1, 2)))
+    else:
+        parts.append("<p>Dados eleitorais não disponíveis.</p>")
+
+    parts.append("<h2>Histórico de votos</h2>")
+    if inputs["votos"]:
+        parts.append(_table(("Ano", "Votos"), [(e["ano"], f"{e['votos']:,}") for e in inputs["votos"]], (1,)))
+    else:
+        parts.append("<p>Sem votos registrados.</p>")
+
+    investments = inputs["investments"]
+    parts.append("<h2>Investimentos</h2>")
+    if investments:
+        parts.append("<h3>Por ano</h3>")
+        parts.append(_table(("Ano", "Valor"), [(k, money(v)) for k, v in _totals(investments, "ano")], (1,)))
+        parts.append("<h3>Por área</h3>")
+        parts.append(_table(("Área", "Valor"), [(k, money(v)) for k, v in _totals(investments, "area")], (1,)))
+        parts.append("<h3>Lançamentos</h3>")
+        parts.append(_table(("Ano", "Área", "Tipo", "Descrição", "Valor"),
+                            [(inv["ano"], inv["area"] or "", inv["tipo"] or "", inv["descricao"] or "",
+                              money(inv["valor"])) for inv in investments], (4,)))
+    else:
+        parts.append("<p>Sem investimentos registrados.</p>")
+    parts.append("</body></html>")
+    return "".join(parts).encode("utf-8")
+
+
+def render_xlsx(inputs):
+    from io import BytesIO
+    from openpyxl import Workbook  # import tardio: só os processos que renderizam XLSX pagam o import
+    city, electoral, camp = inputs["city"], inputs["electoral"], inputs["campaign"]
+    wb = Workbook(write_only=True)  # modo streaming: bem mais rápido para planilhas só de escrita
+
+    ws = wb.create_sheet("Resumo")
+    ws.append(["Município", city.get("nome") or inputs["slug"]])
+    for field, label in CITY_FIELDS:
+        if field in city:
+            ws.append([label, city[field]])
+    ws.append([])
+    ws.append(["Votos", camp["votes"]])
+    ws.append(["Investimento (R$)", camp["money"]])
+    ws.append(["R$/Voto", camp["cost_per_vote"]])
+    ws.append(["R$/Habitante", camp["cost_per_pop"]])
+    ws.append(["Conversão (%)", camp["conversion"]])
+
+    ws = wb.create_sheet("Eleitorado")
+    if electoral:
+        ws.append(["Total de eleitores", electoral.get("total_eleitores") or 0])
+        for field, label in ELECTORAL_SECTIONS:
+            ws.append([])
+            ws.append([label, "%"])
+            for category, value in sorted((electoral.get(field) or {}).items(), key=lambda kv: -(kv[1] or 0)):
+                ws.append([category, value])
+        ws.append([])
+        ws.append(["Faixa etária", "Homens (%)", "Mulheres (%)"])
+        for row in _age_groups(electoral):
+            ws.append(list(row))
+    else:
+        ws.append(["Dados eleitorais não disponíveis."])
+
+    ws = wb.create_sheet("Votos")
+    ws.append(["Ano", "Votos"])
+    for e in inputs["votos"]:
+        ws.append([e["ano"], e["votos"]])
+
+    ws = wb.create_sheet("Investimentos")
+    ws.append(["Ano", "Área", "Tipo", "Descrição", "Valor (R$)"])
+    for inv in inputs["investments"]:
+        ws.append([inv["ano"], inv["area"], inv["tipo"], inv["descricao"], inv["valor"]])
+
+    out = BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+RENDERERS = {"html": render_html, "xlsx": render_xlsx}
+
+
+def render_to_cache(job):
+    """Executado nos processos do pool: renderiza e grava o dossiê no cache (gravação atômica)."""
+    slug, key, fmt, inputs, directory = job
+    path = cache_path(slug, key, fmt, directory)
+    body = RENDERERS[fmt](inputs)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(body)
+    os.replace(tmp, path)
+    # Versões antigas do dossiê desta cidade não servem mais. Um lote concorrente
+    # pode ter listado uma delas no cache: iter_zip renderiza de novo se sumir.
+    prefix, suffix = f"{slug}.", f".{fmt}"
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(suffix) and name != os.path.basename(path) \
+                and name.count(".") == 2:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return slug, path
+
+
+# --- Pool de processos (criado na primeira geração grande e reaproveitado) ---
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            import multiprocessing
+            # spawn: o servidor tem threads; fork copiaria locks em estado indefinido
+            _POOL = ProcessPoolExecutor(max_workers=DOSSIER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+
+def shutdown_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = None
+
+
+class DossierBatch:
+    """
+    Um lote: separa as cidades já em cache das que precisam ser renderizadas
+    (na criação, para o chamador saber as contagens antes de começar a enviar).
+    """
+
+    def __init__(self, jobs, fmt, directory=DOSSIER_DIR):
+        """`jobs`: [(slug, chave, entradas)] das cidades pedidas."""
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato inválido: {fmt}")
+        os.makedirs(directory, exist_ok=True)
+        self.fmt = fmt
+        self.directory = directory
+        self.cached, self.pending = [], []
+        self._inputs = {}
+        for slug, key, inputs in jobs:
+            path = cache_path(slug, key, fmt, directory)
+            self._inputs[slug] = inputs
+            if os.path.exists(path):
+                self.cached.append((slug, path))
+            else:
+                self.pending.append((slug, key, fmt, inputs, directory))
+
+    def render(self, slug):
+        """Dossiê da cidade em memória, sem cache (quando o arquivo listado foi removido por outro lote)."""
+        return RENDERERS[self.fmt](self._inputs[slug])
+
+    def results(self):
+        """(slug, caminho) de cada dossiê: primeiro os do cache, depois os renderizados conforme ficam prontos."""
+        yield from self.cached
+        if len(self.pending) < POOL_MIN_JOBS or DOSSIER_WORKERS == 1:
+            for job in self.pending:
+                yield render_to_cache(job)
+            return
+        pool = get_pool()
+        chunk = max(1, len(self.pending) // (DOSSIER_WORKERS * 4))  # lotes por processo: menos idas e voltas
+        batches = [self.pending[i:i + chunk] for i in range(0, len(self.pending), chunk)]
+        futures = [pool.submit(_render_many, batch) for batch in batches]
+        for future in as_completed(futures):
+            yield from future.result()
+
+    def run(self):
+        return list(self.results())
+
+
+def _render_many(jobs):
+    return [render_to_cache(job) for job in jobs]
+
+
+class _ZipSink:
+    """Destino sem seek para o zipfile: acumula os bytes escritos até o próximo drain()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(entries, fmt, render=None):
+    """
+    Bytes de um ZIP com os dossiês, gerados à medida que as entradas (slug,
+    caminho) chegam. Se o arquivo de uma entrada sumiu do cache (substituído
+    por uma versão nova em outro lote), render(slug) gera os bytes de novo.
+    """
+    sink = _ZipSink()
+    # HTML comprime bem; XLSX já é um ZIP
+    compression = zipfile.ZIP_DEFLATED if fmt == "html" else zipfile.ZIP_STORED
+    with zipfile.ZipFile(sink, "w", compression=compression) as archive:
+        for slug, path in entries:
+            try:
+                # write() abre o arquivo antes de gravar qualquer byte no ZIP
+                archive.write(path, f"{slug}.{fmt}")
+            except FileNotFoundError:
+                if render is None:
+                    raise
+                archive.writestr(f"{slug}.{fmt}", render(slug))
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Gera dossiês por município em lote (ZIP).")
+    parser.add_argument("--format", choices=FORMATS, default="html")
+    parser.add_argument("--cities", nargs="*", help="slugs (padrão: todas)")
+    parser.add_argument("--partido", help="só cidades governadas pelo partido")
+    parser.add_argument("-o", "--output", default="dossies.zip")
+    args = parser.parse_args()
+
+    import server  # mesmos dados e mesma montagem das entradas do endpoint
+    server.load_all()
+    snapshot = server.STATE.current
+    try:
+        slugs = server.select_dossier_cities(snapshot, args.cities, args.partido)
+    except KeyError as e:
+        raise SystemExit(str(e))
+    start = time.perf_counter()
+    batch = DossierBatch(server.dossier_jobs(snapshot, slugs, args.format), args.format)
+    print(f"{len(slugs)} cidades: {len(batch.cached)} em cache, {len(batch.pending)} a gerar "
+          f"({DOSSIER_WORKERS} processos)")
+    with open(args.output, "wb") as f:
+        for chunk in iter_zip(batch.results(), args.format, batch.render):
+            f.write(chunk)
+    shutdown_pool()
+    print(f"{args.output}: {os.path.getsize(args.output) / 1024:,.0f} KiB em {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
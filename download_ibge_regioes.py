@@ -0,0 +1,47 @@
+"""
+Script para baixar a divisão regional do IBGE (meso e microrregiões) dos
+municípios do Paraná e gravar em ibge_regioes.json, indexado pelo código
+IBGE do município (o mesmo `ibge_id` de cidades_pr.json).
+
+O arquivo gerado é lido pelo índice geográfico (geo.py); sem ele, os
+vizinhos continuam funcionando, mas os agregados por região ficam indisponíveis.
+"""
+
+import json
+import urllib.request
+
+from reference import REGIONS_PATH
+
+MUNICIPIOS_URL = "https://servicodados.ibge.gov.br/api/v1/localidades/estados/41/municipios"
+
+
+def fetch_municipios(url=MUNICIPIOS_URL):
+    print(f"Baixando municípios de: {url}")
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return json.load(response)
+
+
+def build_regions(municipios):
+    """{código IBGE: {"nome", "mesorregiao": {"id", "nome"}, "microrregiao": {"id", "nome"}}}."""
+    regions = {}
+    for m in municipios:
+        micro = m.get("microrregiao") or {}
+        meso = micro.get("mesorregiao") or {}
+        regions[str(m["id"])] = {
+            "nome": m.get("nome"),
+            "mesorregiao": {"id": meso["id"], "nome": meso["nome"]} if meso else None,
+            "microrregiao": {"id": micro["id"], "nome": micro["nome"]} if micro else None,
+        }
+    return regions
+
+
+def main():
+    regions = build_regions(fetch_municipios())
+    sem_regiao = sum(1 for r in regions.values() if not r["microrregiao"])
+    with open(REGIONS_PATH, "w", encoding="utf-8") as f:
+        json.dump(regions, f, ensure_ascii=False, indent=1)
+    print(f"{len(regions)} municípios gravados em {REGIONS_PATH} ({sem_regiao} sem microrregião).")
+
+
+if __name__ == "__main__":
+    main()
@@ -301,6 +301,11 @@ def main():
         json.dump(cidades, f, ensure_ascii=False, indent=2)
     
     print(f"\n✓ Dados salvos em: {OUTPUT_FILE}")
+
+    # Distribuição conjunta completa (cruzamentos entre dimensões), em disco
+    from voter_cube import CUBE_DIR, build_cube
+    build_cube(csv_file)
+    print(f"✓ Cubo do perfil salvo em: {CUBE_DIR}/")
     
     # Exibe algumas estatísticas
     print("\n" + "="*60)
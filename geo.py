@@ -0,0 +1,234 @@
+"""
+Índice geográfico dos municípios, derivado de mapa_pr.svg.
+
+Os contornos do SVG são lidos uma vez (no build dos dados de referência,
+guardado no snapshot de inicialização) e viram arrays compactos:
+- centroide, retângulo envolvente e área de cada município (fórmula do laço);
+- vizinhança por fronteira compartilhada: municípios vizinhos têm arestas
+  idênticas no SVG, então basta casar as arestas. A lista de adjacência fica
+  em formato CSR (offsets + índices), com o comprimento da fronteira;
+- meso e microrregião do IBGE (ibge_regioes.json, gerado por
+  download_ibge_regioes.py), como códigos inteiros por município.
+
+Distâncias saem em km: a escala do mapa é calibrada comparando a área dos
+contornos com a área oficial (area_km2) das cidades.
+"""
+
+import json
+import math
+import os
+import re
+from collections import defaultdict, deque
+
+import numpy as np
+
+from reference import REGION_LEVELS, REGIONS_PATH, SVG_PATH
+
+_PATH = re.compile(r'<path\b[^>]*\bid="([^"]+)"[^>]*\bd="([^"]*)"')
+_POINT = re.compile(r"(-?[\d.]+)[ ,]+(-?[\d.]+)")
+_SUBPATH = re.compile(r"[Mm][^Mm]*")
+
+
+def parse_svg(path=SVG_PATH):
+    """{slug: [anéis (n, 2)]} com os contornos de cada município."""
+    with open(path, "r", encoding="utf-8") as f:
+        svg = f.read()
+    shapes = {}
+    for slug, d in _PATH.findall(svg):
+        rings = [np.array(_POINT.findall(sub), dtype=np.float64) for sub in _SUBPATH.findall(d)]
+        shapes[slug] = [ring for ring in rings if len(ring) >= 3]
+    return shapes
+
+
+def _ring_metrics(ring):
+    """Área (com sinal) e centroide de um anel fechado."""
+    x, y = ring[:, 0], ring[:, 1]
+    xn, yn = np.roll(x, -1), np.roll(y, -1)
+    cross = x * yn - xn * y
+    area = cross.sum() / 2
+    if abs(area) < 1e-12:
+        return 0.0, ring.mean(axis=0)
+    return area, np.array([((x + xn) * cross).sum(), ((y + yn) * cross).sum()]) / (6 * area)
+
+
+def _edges(ring):
+    """Arestas não orientadas do anel, como pares de vértices ordenados."""
+    points = [tuple(p) for p in ring.tolist()]
+    for a, b in zip(points, points[1:] + points[:1]):
+        if a != b:
+            yield (a, b) if a < b else (b, a)
+
+
+def load_regions(path=REGIONS_PATH):
+    """{código IBGE: {"mesorregiao": {...}, "microrregiao": {...}}}; vazio se o arquivo não existe."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def ibge_code(city):
+    try:
+        return str(int(float(city.get("ibge_id"))))
+    except (TypeError, ValueError):
+        return None
+
+
+class GeoIndex:
+    def __init__(self, slugs, centroids, bboxes, areas, offsets, neighbors, borders, km_per_unit, regions):
+        self.slugs = slugs
+        self.position = {slug: i for i, slug in enumerate(slugs)}
+        self.centroids = centroids  # (n, 2), coordenadas do SVG
+        self.bboxes = bboxes  # (n, 4): x_min, y_min, x_max, y_max
+        self.areas = areas  # (n,), unidades do SVG²
+        self.offsets = offsets  # (n + 1,): vizinhos de i em neighbors[offsets[i]:offsets[i + 1]]
+        self.neighbors = neighbors
+        self.borders = borders  # comprimento da fronteira com cada vizinho, em km
+        self.km_per_unit = km_per_unit
+        self.regions = regions  # {nível: (códigos (n,) com -1 = sem região, [{"id", "nome"}])}
+
+    @classmethod
+    def build(cls, cities, svg_path=SVG_PATH, regions=None):
+        shapes = parse_svg(svg_path)
+        slugs = [slug for slug in cities if shapes.get(slug)]
+        n = len(slugs)
+        centroids = np.zeros((n, 2))
+        bboxes = np.zeros((n, 4))
+        areas = np.zeros(n)
+        edge_owners = defaultdict(list)
+        for i, slug in enumerate(slugs):
+            weighted, total = np.zeros(2), 0.0
+            for ring in shapes[slug]:
+                area, centroid = _ring_metrics(ring)
+                weighted += abs(area) * centroid
+                total += abs(area)
+                for edge in _edges(ring):
+                    edge_owners[edge].append(i)
+            points = np.vstack(shapes[slug])
+            centroids[i] = weighted / total if total else points.mean(axis=0)
+            bboxes[i] = (*points.min(axis=0), *points.max(axis=0))
+            areas[i] = total
+
+        # Escala: área oficial (km²) / área do contorno, nas cidades com área conhecida
+        known = [(i, cities[s].get("area_km2")) for i, s in enumerate(slugs)]
+        known = [(i, a) for i, a in known if isinstance(a, (int, float)) and a > 0 and areas[i] > 0]
+        km_per_unit = math.sqrt(sum(a for _, a in known) / sum(areas[i] for i, _ in known)) if known else 1.0
+
+        shared = defaultdict(float)  # (i, j) -> comprimento da fronteira (unidades do SVG)
+        for (a, b), owners in edge_owners.items():
+            owners = sorted(set(owners))
+            if len(owners) < 2:
+                continue
+            length = math.dist(a, b)
+            for k, i in enumerate(owners):
+                for j in owners[k + 1:]:
+                    shared[i, j] += length
+        adjacency = defaultdict(list)
+        for (i, j), length in shared.items():
+            adjacency[i].append((j, length))
+            adjacency[j].append((i, length))
+        offsets = np.zeros(n + 1, dtype=np.int32)
+        neighbors, borders = [], []
+        for i in range(n):
+            for j, length in sorted(adjacency[i], key=lambda item: -item[1]):
+                neighbors.append(j)
+                borders.append(length * km_per_unit)
+            offsets[i + 1] = len(neighbors)
+
+        region_index = {}
+        if regions:
+            codes = [ibge_code(cities[slug]) for slug in slugs]
+            for level in REGION_LEVELS:
+                labels, ids, assigned = [], {}, np.full(n, -1, dtype=np.int32)
+                for i, code in enumerate(codes):
+                    region = (regions.get(code) or {}).get(level)
+                    if not region:
+                        continue
+                    if region["id"] not in ids:
+                        ids[region["id"]] = len(labels)
+                        labels.append({"id": region["id"], "nome": region["nome"]})
+                    assigned[i] = ids[region["id"]]
+                region_index[level] = (assigned, labels)
+
+        return cls(slugs, centroids, bboxes, areas, offsets, np.array(neighbors, dtype=np.int32),
+                   np.array(borders), km_per_unit, region_index)
+
+    def __contains__(self, slug):
+        return slug in self.position
+
+    def adjacent(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.neighbors[start:end], self.borders[start:end]
+
+    def distances_km(self, index):
+        return np.linalg.norm(self.centroids - self.centroids[index], axis=1) * self.km_per_unit
+
+    def region_of(self, slug, level):
+        if level not in self.regions:
+            return None
+        codes, labels = self.regions[level]
+        code = codes[self.position[slug]]
+        return labels[code] if code >= 0 else None
+
+    def find_region(self, key):
+        """(nível, código) de uma região pelo id IBGE ou nome (sem diferenciar maiúsculas)."""
+        key = str(key).strip().lower()
+        for level, (_, labels) in self.regions.items():
+            for code, label in enumerate(labels):
+                if str(label["id"]) == key or label["nome"].lower() == key:
+                    return level, code
+        return None
+
+    def members(self, level, code):
+        return np.flatnonzero(self.regions[level][0] == code)
+
+    def rings(self, slug, depth=1):
+        """
+        Vizinhos até `depth` fronteiras de distância (busca em largura sobre a
+        adjacência): lista de (índice, anel, fronteira_km ou None).
+        """
+        origin = self.position[slug]
+        seen = {origin: 0}
+        queue = deque([origin])
+        result = []
+        while queue:
+            i = queue.popleft()
+            if seen[i] >= depth:
+                continue
+            neighbors, borders = self.adjacent(i)
+            for j, border in zip(neighbors.tolist(), borders.tolist()):
+                if j in seen:
+                    continue
+                seen[j] = seen[i] + 1
+                result.append((j, seen[j], border if i == origin else None))
+                queue.append(j)
+        return result
+
+    def rollup(self, level, columns):
+        """
+        Somas por região de cada coluna ({nome: array (n,)}), mais centroide
+        (ponderado pela área) e retângulo envolvente de cada região.
+        """
+        codes, labels = self.regions[level]
+        valid = codes >= 0
+        k = len(labels)
+        counts = np.bincount(codes[valid], minlength=k)
+        sums = {name: np.bincount(codes[valid], weights=values[valid], minlength=k) for name, values in columns.items()}
+        weight = np.bincount(codes[valid], weights=self.areas[valid], minlength=k)
+        cx = np.bincount(codes[valid], weights=(self.centroids[:, 0] * self.areas)[valid], minlength=k)
+        cy = np.bincount(codes[valid], weights=(self.centroids[:, 1] * self.areas)[valid], minlength=k)
+        bbox = np.tile([np.inf, np.inf, -np.inf, -np.inf], (k, 1))
+        np.minimum.at(bbox[:, 0], codes[valid], self.bboxes[valid, 0])
+        np.minimum.at(bbox[:, 1], codes[valid], self.bboxes[valid, 1])
+        np.maximum.at(bbox[:, 2], codes[valid], self.bboxes[valid, 2])
+        np.maximum.at(bbox[:, 3], codes[valid], self.bboxes[valid, 3])
+        rows = []
+        for code, label in enumerate(labels):
+            rows.append({
+                **label,
+                "cidades": int(counts[code]),
+                **{name: round(float(total[code]), 2) for name, total in sums.items()},
+                "centroide": [round(float(cx[code] / weight[code]), 2), round(float(cy[code] / weight[code]), 2)],
+                "bbox": [round(float(v), 2) for v in bbox[code]],
+            })
+        return rows
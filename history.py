@@ -0,0 +1,317 @@
+"""
+Histórico versionado dos dados de campanha (votos, investimentos e métricas
+por cidade), para consultar ou restaurar qualquer estado anterior depois de
+um save que sobrescreveu tudo ou de um DELETE.
+
+Cada versão publicada no VersionedState vira uma revisão do histórico
+(numeração própria, contínua entre reinícios), gravada em SQLite
+(HISTORY_DB) por uma thread em segundo plano — o escritor só enfileira o
+snapshot, que é imutável:
+- por dataset alterado, um delta em relação à revisão anterior: chaves
+  definidas/removidas nos mapeamentos (votos e campanha, por cidade) e
+  registros incluídos/removidos nos investimentos (multiconjunto; registros
+  inalterados são reconhecidos por identidade, sem serializar a lista);
+- um checkpoint (estado completo) quando as operações acumuladas desde o
+  último passam do tamanho do dataset, ou a cada CHECKPOINT_EVERY deltas.
+  O espaço gasto fica proporcional às mudanças e a reconstrução de uma
+  revisão é um checkpoint + no máximo CHECKPOINT_EVERY deltas.
+
+Reconstruir investimentos não preserva a ordem original da lista quando um
+save a reordena (a lista é tratada como multiconjunto).
+
+Na subida, o estado carregado dos arquivos/banco é comparado com a última
+revisão: edições feitas com o servidor parado entram como uma revisão.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+HISTORY_PATH = os.getenv("HISTORY_DB", "historico.db")
+CHECKPOINT_EVERY = int(os.getenv("HISTORY_CHECKPOINT_EVERY", "256"))
+# Tipo de cada dataset versionado: mapeamento {chave: valor} ou lista de registros (dicts)
+DATASETS = {"votos": "mapping", "investments": "records", "campaign": "mapping"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS revisions (
+    revision INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    data_version INTEGER,
+    stats TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    dataset TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    ops INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (dataset, revision)
+);
+"""
+
+
+def _encode(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _decode(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+def record_key(record):
+    return tuple(sorted(record.items()))
+
+
+# --- Deltas ---
+def diff_mapping(old, new):
+    """{"set": {chave: valor novo}, "del": [chaves]} entre dois mapeamentos."""
+    changed = {key: value for key, value in new.items()
+               if (previous := old.get(key, _ABSENT)) is not value and previous != value}
+    removed = [key for key in old if key not in new]
+    return {"set": changed, "del": removed}
+
+
+def diff_records(old, new):
+    """
+    {"add": [registros], "del": [registros]} entre duas listas (como
+    multiconjuntos). Registros presentes nas duas pelo mesmo objeto — o caso
+    comum num merge copy-on-write — nem chegam a ser comparados.
+    """
+    old_ids, new_ids = {id(r) for r in old}, {id(r) for r in new}
+    added = [r for r in new if id(r) not in old_ids]
+    removed = [r for r in old if id(r) not in new_ids]
+    if not added or not removed:
+        return {"add": [dict(r) for r in added], "del": [dict(r) for r in removed]}
+    # Objetos novos com o mesmo conteúdo (ex.: save da mesma planilha) não são mudança
+    pending = {}
+    for r in removed:
+        pending.setdefault(record_key(r), []).append(r)
+    really_added = []
+    for r in added:
+        same = pending.get(record_key(r))
+        if same:
+            same.pop()
+        else:
+            really_added.append(dict(r))
+    return {"add": really_added, "del": [dict(r) for group in pending.values() for r in group]}
+
+
+def delta_ops(delta):
+    return sum(len(part) for part in delta.values())
+
+
+def delta_stats(delta):
+    return {name: len(part) for name, part in delta.items()}
+
+
+class RecordBag:
+    """Lista de registros como {chave: quantidade} em ordem de inserção: aplicar um delta custa o tamanho do delta."""
+
+    def __init__(self, records=()):
+        self.counts = {}
+        for record in records:
+            key = record_key(record)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def apply(self, delta):
+        for record in delta["del"]:
+            key = record_key(record)
+            count = self.counts.get(key, 0)
+            if count <= 1:
+                self.counts.pop(key, None)
+            else:
+                self.counts[key] = count - 1
+        for record in delta["add"]:
+            key = record_key(record)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def to_list(self):
+        return [dict(key) for key, count in self.counts.items() for _ in range(count)]
+
+
+def replay(kind, checkpoint, deltas):
+    """Estado de um dataset: checkpoint + deltas, na ordem."""
+    deltas = list(deltas)
+    if kind == "records":
+        if not deltas:
+            return checkpoint
+        bag = RecordBag(checkpoint)
+        for delta in deltas:
+            bag.apply(delta)
+        return bag.to_list()
+    state = dict(checkpoint)
+    for delta in deltas:
+        for key in delta["del"]:
+            state.pop(key, None)
+        state.update(delta["set"])
+    return state
+
+
+def diff(kind, old, new):
+    return diff_records(old, new) if kind == "records" else diff_mapping(old, new)
+
+
+_ABSENT = object()
+_STOP = object()
+
+
+class HistoryLog:
+    def __init__(self, path=HISTORY_PATH, checkpoint_every=CHECKPOINT_EVERY):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self._conn = None
+        self._lock = threading.Lock()  # uma conexão, usada pela thread de gravação e pelas consultas
+        self._queue = queue.Queue()
+        self._thread = None
+        self._last = {}  # dataset -> valor da última revisão gravada
+        self._chain = {}  # dataset -> [deltas desde o checkpoint, operações desde o checkpoint]
+
+    # --- Ciclo de vida ---
+    def start(self, state):
+        """Abre o banco, agenda a comparação do estado carregado com a última revisão e passa a gravar cada versão."""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        for name in DATASETS:
+            row = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(ops), 0) FROM entries WHERE dataset = ? AND revision > "
+                "COALESCE((SELECT MAX(revision) FROM entries WHERE dataset = ? AND kind = 'checkpoint'), 0)",
+                (name, name)).fetchone()
+            self._chain[name] = [row[0], row[1]]
+        self._thread = threading.Thread(target=self._run, name="history", daemon=True)
+        self._thread.start()
+        self._queue.put(("baseline", state.current))
+        state.subscribe(self.record)
+
+    def record(self, snapshot):
+        """Listener do VersionedState (roda sob o lock de escrita): só enfileira."""
+        if self._thread is not None:
+            self._queue.put(("snapshot", snapshot))
+
+    def sync(self):
+        """Espera a gravação das versões já publicadas (antes de consultar o histórico)."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+
+    # --- Gravação (thread própria) ---
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                kind, snapshot = job
+                if kind == "baseline":
+                    self._load_last()
+                self._write(snapshot)
+            except Exception as e:
+                print(f"Erro ao gravar o histórico: {type(e).__name__}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _load_last(self):
+        latest = self.latest_revision()
+        for name in DATASETS:
+            try:
+                self._last[name] = self.state_at(name, latest) if latest else None
+            except KeyError:
+                self._last[name] = None
+
+    def _write(self, snapshot):
+        entries, stats = [], {}
+        for name, kind in DATASETS.items():
+            value = getattr(snapshot, name)
+            last = self._last.get(name)
+            if value is last:
+                continue
+            deltas_since, ops_since = self._chain[name]
+            if last is None:
+                delta, ops = None, len(value)
+            else:
+                delta = diff(kind, last, value)
+                ops = delta_ops(delta)
+                if not ops:
+                    self._last[name] = value
+                    continue
+            if delta is None or ops_since + ops >= max(len(value), 1) or deltas_since + 1 >= self.checkpoint_every:
+                state = [dict(r) for r in value] if kind == "records" else dict(value)
+                entries.append((name, "checkpoint", ops, _encode(state)))
+                self._chain[name] = [0, 0]
+            else:
+                entries.append((name, "delta", ops, _encode(delta)))
+                self._chain[name] = [deltas_since + 1, ops_since + ops]
+            stats[name] = delta_stats(delta) if delta is not None else {"checkpoint": ops}
+            self._last[name] = value
+        if not entries:
+            return
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute("INSERT INTO revisions (created_at, data_version, stats) VALUES (?, ?, ?)",
+                                            (time.time(), snapshot.version, json.dumps(stats)))
+                revision = cursor.lastrowid
+                self._conn.executemany("INSERT INTO entries (dataset, revision, kind, ops, payload) VALUES (?, ?, ?, ?, ?)",
+                                       [(name, revision, kind, ops, payload) for name, kind, ops, payload in entries])
+
+    # --- Consultas ---
+    def latest_revision(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(revision), 0) FROM revisions").fetchone()[0]
+
+    def revisions(self, limit=50, before=None):
+        """Revisões mais recentes primeiro: datasets alterados, contagens e bytes gravados."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT r.revision, r.created_at, r.data_version, r.stats, "
+                "GROUP_CONCAT(CASE WHEN e.kind = 'checkpoint' THEN e.dataset END), SUM(LENGTH(e.payload)) "
+                "FROM revisions r JOIN entries e ON e.revision = r.revision "
+                "WHERE r.revision < ? GROUP BY r.revision ORDER BY r.revision DESC LIMIT ?",
+                (before or 2**62, limit)).fetchall()
+        return [{"revision": revision, "created_at": created_at, "data_version": data_version,
+                 "changes": json.loads(stats), "checkpoints": checkpoints.split(",") if checkpoints else [],
+                 "bytes": size}
+                for revision, created_at, data_version, stats, checkpoints, size in rows]
+
+    def totals(self):
+        with self._lock:
+            revisions, = self._conn.execute("SELECT COUNT(*) FROM revisions").fetchone()
+            rows = self._conn.execute("SELECT dataset, kind, COUNT(*), SUM(LENGTH(payload)) FROM entries "
+                                      "GROUP BY dataset, kind").fetchall()
+        by_dataset = {}
+        for dataset, kind, count, size in rows:
+            by_dataset.setdefault(dataset, {})[kind] = {"count": count, "bytes": size}
+        return {"revisions": revisions, "datasets": by_dataset}
+
+    def state_at(self, dataset, revision):
+        """Valor do dataset na revisão; KeyError se a revisão não existir (ou for anterior ao histórico)."""
+        kind = DATASETS[dataset]
+        with self._lock:
+            if not self._conn.execute("SELECT 1 FROM revisions WHERE revision = ?", (revision,)).fetchone():
+                raise KeyError(revision)
+            checkpoint = self._conn.execute(
+                "SELECT revision, payload FROM entries WHERE dataset = ? AND kind = 'checkpoint' AND revision <= ? "
+                "ORDER BY revision DESC LIMIT 1", (dataset, revision)).fetchone()
+            if checkpoint is None:
+                raise KeyError(revision)
+            deltas = self._conn.execute(
+                "SELECT payload FROM entries WHERE dataset = ? AND kind = 'delta' AND revision > ? AND revision <= ? "
+                "ORDER BY revision", (dataset, checkpoint[0], revision)).fetchall()
+        return replay(kind, _decode(checkpoint[1]), [_decode(payload) for payload, in deltas])
+
+    def diff(self, dataset, start, end):
+        """Delta líquido de `dataset` entre duas revisões."""
+        delta = diff(DATASETS[dataset], self.state_at(dataset, start), self.state_at(dataset, end))
+        return {"delta": delta, "stats": delta_stats(delta)}
@@ -0,0 +1,225 @@
+"""
+Importa votos de um candidato a partir dos resultados do TSE
+(votacao_candidato_munzona_<ano>.zip, um CSV por UF ou o _BRASIL).
+
+Os arquivos têm vários GB descompactados, então nada é extraído nem
+carregado inteiro: cada CSV é lido linha a linha direto do ZIP, as linhas
+de outras UFs / outros candidatos são descartadas por um teste de texto
+antes do parse, e só os totais por (município, ano) ficam em memória.
+As zonas eleitorais são somadas por município, o nome do município vira
+slug com normalize_key e o resultado é mesclado ao armazenamento de votos
+(cada ano importado substitui o mesmo ano da cidade; os demais ficam).
+
+Uso:
+    python import_tse_votos.py votacao_candidato_munzona_2022.zip --numero 1234
+    python import_tse_votos.py *.zip --nome "fulano de tal" --cargo "deputado estadual"
+    python import_tse_votos.py arquivo.zip --numero 1234 --url http://localhost:8000
+
+Sem --url, grava no armazenamento local (votos_data.json ou SQLite, conforme
+STORAGE_BACKEND) e recalcula a campanha; com o servidor no ar, prefira --url,
+que mescla pelo endpoint /api/votos/merge.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import time
+import urllib.request
+import zipfile
+from collections import defaultdict
+
+from download_tse_data import normalize_key
+from storage import STORAGE_BACKEND, SQLITE_PATH, SQLiteStore, aggregate_campaign, merge_votos, write_json_atomic
+
+CIDADES_FILE = "cidades_pr.json"
+VOTOS_FILE = "votos_data.json"
+CAMPAIGN_FILE = "campaign_data.json"
+INVESTMENTS_FILE = "investments_data.json"
+ENCODING = "latin-1"
+PROGRESS_EVERY = 1_000_000  # linhas
+
+COLUMNS = ("ANO_ELEICAO", "NR_TURNO", "SG_UF", "NM_MUNICIPIO", "DS_CARGO", "SQ_CANDIDATO", "NR_CANDIDATO",
+           "NM_CANDIDATO", "NM_URNA_CANDIDATO", "QT_VOTOS_NOMINAIS")
+
+
+def csv_sources(paths, uf):
+    """
+    (nome, arquivo de texto, bytes descompactados) de cada CSV. Em ZIPs com um
+    CSV por UF, lê só o da UF pedida (ou o _BRASIL, se não houver o da UF).
+    """
+    for path in paths:
+        if not zipfile.is_zipfile(path):
+            yield path, open(path, "r", encoding=ENCODING, newline=""), os.path.getsize(path)
+            continue
+        archive = zipfile.ZipFile(path)
+        members = [m for m in archive.infolist() if m.filename.lower().endswith(".csv")]
+        by_uf = [m for m in members if m.filename.upper().endswith(f"_{uf}.CSV")]
+        national = [m for m in members if m.filename.upper().endswith("_BRASIL.CSV")]
+        for member in by_uf or national or members:
+            raw = archive.open(member)
+            yield f"{path}:{member.filename}", io.TextIOWrapper(raw, encoding=ENCODING, newline=""), member.file_size
+
+
+class MunzonaReader:
+    """Soma votos nominais por (slug, ano) das linhas que passam nos filtros."""
+
+    def __init__(self, uf="PR", numero=None, nome=None, cargo=None, turno=1):
+        self.uf = uf.upper()
+        self.numero = str(numero) if numero is not None else None
+        self.nome = normalize_key(nome) if nome else None
+        self.cargo = normalize_key(cargo) if cargo else None
+        self.turno = str(turno) if turno else None
+        self.totals = defaultdict(int)  # (nome do município normalizado, ano) -> votos
+        self.candidates = {}  # SQ_CANDIDATO -> (ano, número, nome de urna, cargo)
+        self.rows = 0
+        self.matched = 0
+        self.bytes = 0
+
+    def _prefilter(self, lines):
+        # Teste de substring na linha crua: descarta a maior parte do arquivo sem parse de CSV
+        uf_token = f'"{self.uf}"'
+        numero_token = f'"{self.numero}"' if self.numero else None
+        for line in lines:
+            self.rows += 1
+            if self.rows % PROGRESS_EVERY == 0:
+                print(f"  {self.rows:,} linhas...")
+            if uf_token in line and (numero_token is None or numero_token in line):
+                yield line
+
+    def read(self, stream):
+        header = next(csv.reader([stream.readline()], delimiter=";"))
+        try:
+            idx = {name: header.index(name) for name in COLUMNS}
+        except ValueError as e:
+            raise ValueError(f"Coluna ausente no CSV do TSE: {e}")
+        for row in csv.reader(self._prefilter(stream), delimiter=";"):
+            if row[idx["SG_UF"]] != self.uf:
+                continue
+            if self.numero and row[idx["NR_CANDIDATO"]] != self.numero:
+                continue
+            if self.turno and row[idx["NR_TURNO"]] != self.turno:
+                continue
+            if self.cargo and normalize_key(row[idx["DS_CARGO"]]) != self.cargo:
+                continue
+            if self.nome and self.nome not in normalize_key(row[idx["NM_CANDIDATO"]]) \
+                    and self.nome not in normalize_key(row[idx["NM_URNA_CANDIDATO"]]):
+                continue
+            ano = int(row[idx["ANO_ELEICAO"]])
+            self.matched += 1
+            self.totals[normalize_key(row[idx["NM_MUNICIPIO"]]), ano] += int(row[idx["QT_VOTOS_NOMINAIS"]] or 0)
+            self.candidates.setdefault(row[idx["SQ_CANDIDATO"]],
+                                       (ano, row[idx["NR_CANDIDATO"]], row[idx["NM_URNA_CANDIDATO"]],
+                                        row[idx["DS_CARGO"]]))
+
+
+def to_votos(totals, slugs, aliases):
+    """{slug: [{ano, votos}]} e a lista de municípios do TSE sem cidade correspondente."""
+    by_name = {normalize_key(slug): slug for slug in slugs}
+    by_name.update({normalize_key(name): slug for name, slug in aliases.items()})
+    summed, unmatched = defaultdict(int), set()
+    for (name, ano), total in totals.items():
+        slug = by_name.get(name)
+        if slug is None:
+            unmatched.add(name)
+            continue
+        summed[slug, ano] += total  # um alias pode apontar para uma cidade que já casou pelo nome
+    votos = defaultdict(list)
+    for (slug, ano), total in sorted(summed.items()):
+        votos[slug].append({"ano": ano, "votos": total})
+    return dict(votos), sorted(unmatched)
+
+
+def merge_local(votos):
+    """Mescla no armazenamento local e recalcula a campanha (servidor parado)."""
+    if STORAGE_BACKEND == "sqlite":
+        store = SQLiteStore(SQLITE_PATH)
+        merged, counts = merge_votos(store.load_votos(), votos)
+        store.replace_votos(merged)
+        store.refresh_campaign()
+        store.close()
+        return counts
+
+    def read(path, default):
+        if not os.path.exists(path):
+            return default
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    merged, counts = merge_votos(read(VOTOS_FILE, {}), votos)
+    write_json_atomic(VOTOS_FILE, merged, indent=2, ensure_ascii=False)
+    write_json_atomic(CAMPAIGN_FILE, aggregate_campaign(merged, read(INVESTMENTS_FILE, [])), indent=2)
+    return counts
+
+
+def merge_remote(votos, url):
+    request = urllib.request.Request(f"{url.rstrip('/')}/api/votos/merge",
+                                     data=json.dumps({"votos": votos}).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.load(response)
+
+
+def parse_aliases(values):
+    aliases = {}
+    for value in values or []:
+        name, sep, slug = value.partition("=")
+        if not sep:
+            raise SystemExit(f"Alias inválido (use NOME=slug): {value}")
+        aliases[name] = slug.strip()
+    return aliases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa votos de candidato do TSE (votacao_candidato_munzona).")
+    parser.add_argument("arquivos", nargs="+", help="ZIPs ou CSVs do TSE")
+    parser.add_argument("--numero", help="número do candidato (NR_CANDIDATO)")
+    parser.add_argument("--nome", help="parte do nome ou nome de urna, sem diferenciar acentos")
+    parser.add_argument("--uf", default="PR")
+    parser.add_argument("--cargo", help='ex.: "deputado estadual"')
+    parser.add_argument("--turno", type=int, default=1, help="0 = todos os turnos")
+    parser.add_argument("--alias", action="append", metavar="NOME=slug",
+                        help="município do TSE com nome diferente do cadastro (repetível)")
+    parser.add_argument("--url", help="servidor no ar (ex.: http://localhost:8000); mescla via API")
+    parser.add_argument("--dry-run", action="store_true", help="só agrega e mostra o resumo")
+    args = parser.parse_args()
+    if not args.numero and not args.nome:
+        parser.error("informe --numero e/ou --nome")
+
+    reader = MunzonaReader(uf=args.uf, numero=args.numero, nome=args.nome, cargo=args.cargo, turno=args.turno)
+    start = time.perf_counter()
+    for name, stream, size in csv_sources(args.arquivos, reader.uf):
+        print(f"Lendo {name} ({size / 1e6:,.0f} MB)")
+        with stream:
+            reader.read(stream)
+        reader.bytes += size
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"{reader.rows:,} linhas em {elapsed:.1f}s ({reader.rows / elapsed:,.0f} linhas/s, "
+          f"{reader.bytes / 1e6 / elapsed:,.1f} MB/s); {reader.matched:,} linhas do candidato")
+
+    if not reader.matched:
+        print("Nenhuma linha encontrada para os filtros informados.")
+        return
+    if len(reader.candidates) > len({c[0] for c in reader.candidates.values()}):
+        print("AVISO: mais de um candidato atende aos filtros (votos somados):")
+        for sq, (ano, numero, urna, cargo) in sorted(reader.candidates.items()):
+            print(f"  {ano} {numero} {urna} ({cargo}) [SQ {sq}]")
+
+    with open(CIDADES_FILE, "r", encoding="utf-8") as f:
+        slugs = list(json.load(f))
+    votos, unmatched = to_votos(reader.totals, slugs, parse_aliases(args.alias))
+    total = sum(e["votos"] for entries in votos.values() for e in entries)
+    print(f"{len(votos)} cidades, {total:,} votos")
+    if unmatched:
+        print(f"AVISO: {len(unmatched)} municípios sem cidade correspondente (use --alias NOME=slug): "
+              f"{', '.join(unmatched)}")
+
+    if args.dry_run:
+        return
+    result = merge_remote(votos, args.url) if args.url else merge_local(votos)
+    print(f"Mesclado: {result}")
+
+
+if __name__ == "__main__":
+    main()
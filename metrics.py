@@ -0,0 +1,215 @@
+"""
+Métricas do servidor no formato texto do Prometheus (exportadas em /metrics).
+
+Contadores e histogramas simples, com lock próprio e custo de poucos
+microssegundos por observação, para ficarem sempre ligados em produção.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+# Log estruturado das requisições /api (uma linha JSON cada). Nível e destino
+# configuráveis pelo logging; sem configuração, vai para o stderr em INFO.
+REQUEST_LOG = logging.getLogger("mapa_pr.requests")
+if not REQUEST_LOG.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    REQUEST_LOG.addHandler(_handler)
+    REQUEST_LOG.propagate = False
+REQUEST_LOG.setLevel(os.getenv("REQUEST_LOG_LEVEL", "INFO").upper())
+
+# Tempos por etapa da requisição atual (para o log estruturado)
+_REQUEST_TIMINGS = ContextVar("request_timings", default=None)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, c in zip(self.buckets, counts):
+            cumulative += c
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+def render_all():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Métricas da aplicação ---
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Latência das requisições por endpoint.",
+                                 ["method", "route", "status"])
+CHAT_STAGE_SECONDS = Histogram("chat_stage_duration_seconds", "Tempo de cada etapa do pipeline do /api/chat.",
+                               ["stage"])
+ENDPOINT_STAGE_SECONDS = Histogram("endpoint_stage_duration_seconds",
+                                   "Tempo das etapas pesadas dos demais endpoints (carga inicial, cubo, dossiês...).",
+                                   ["stage"])
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens consumidos nas chamadas ao modelo.", ["type"])
+CACHE_REQUESTS = Counter("cache_requests_total", "Consultas a caches internos por resultado (hit/miss).",
+                         ["cache", "result"])
+UPSTREAM_QUEUE_SECONDS = Histogram("upstream_queue_wait_seconds",
+                                   "Tempo de espera na fila antes de chamar o provedor externo.")
+UPSTREAM_IN_FLIGHT = Gauge("upstream_in_flight", "Chamadas ao provedor externo em execução.")
+UPSTREAM_QUEUE_DEPTH = Gauge("upstream_queue_depth", "Chamadas aguardando vaga na fila do provedor externo.")
+UPSTREAM_REJECTED = Counter("upstream_rejected_total", "Requisições recusadas pelo controle de admissão.",
+                            ["reason"])
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Novas tentativas após erro transitório do provedor.",
+                           ["error"])
+CHAT_WEB_SEARCHES = Counter("chat_web_search_decisions_total",
+                            "Perguntas do chat que usaram a busca web ou foram respondidas só com a base local.",
+                            ["decision"])
+REFERENCE_RELOAD_SECONDS = Histogram("reference_reload_duration_seconds",
+                                     "Tempo de cada etapa da recarga dos dados de referência.", ["step"])
+CHAT_SESSIONS_ACTIVE = Gauge("chat_sessions_active", "Sessões de conversa do chat em memória.")
+CHAT_COMPACTIONS = Counter("chat_history_compactions_total",
+                           "Históricos de sessão resumidos, pelo modelo ou pelo resumo extrativo.", ["method"])
+PERSISTENCE_PENDING = Gauge("persistence_pending_changes", "Alterações ainda não gravadas em disco (write-behind).")
+
+
+@contextmanager
+def stage(name, histogram=CHAT_STAGE_SECONDS):
+    """
+    Mede uma etapa: alimenta o histograma (o do chat, por padrão; os demais
+    endpoints usam ENDPOINT_STAGE_SECONDS) e o log da requisição atual.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, stage=name)
+        record = _REQUEST_TIMINGS.get()
+        if record is not None:
+            stages = record["stages_ms"]
+            stages[name] = stages.get(name, 0.0) + elapsed * 1000
+
+
+def record_cache(cache, hit):
+    result = "hit" if hit else "miss"
+    CACHE_REQUESTS.inc(cache=cache, result=result)
+    record = _REQUEST_TIMINGS.get()
+    if record is not None:
+        record["cache"][cache] = result
+
+
+def record_tokens(prompt_tokens, completion_tokens):
+    LLM_TOKENS.inc(prompt_tokens, type="prompt")
+    LLM_TOKENS.inc(completion_tokens, type="completion")
+    record = _REQUEST_TIMINGS.get()
+    if record is not None:
+        record["tokens"] = {"prompt": prompt_tokens, "completion": completion_tokens}
+
+
+def begin_request():
+    """Abre o registro de tempos da requisição; devolve o token para end_request()."""
+    return _REQUEST_TIMINGS.set({"stages_ms": {}, "cache": {}})
+
+
+def end_request(token, method, route, status, duration, log=True):
+    record = _REQUEST_TIMINGS.get() or {}
+    _REQUEST_TIMINGS.reset(token)
+    HTTP_REQUEST_SECONDS.observe(duration, method=method, route=route, status=status)
+    if log and REQUEST_LOG.isEnabledFor(logging.INFO):
+        entry = {"event": "request", "method": method, "route": route, "status": status,
+                 "duration_ms": round(duration * 1000, 2)}
+        for key, value in record.items():
+            if value:
+                entry[key] = {k: round(v, 2) for k, v in value.items()} if key == "stages_ms" else value
+        REQUEST_LOG.info(json.dumps(entry, ensure_ascii=False))
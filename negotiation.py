@@ -0,0 +1,78 @@
+"""
+Formato das respostas da API escolhido pelo cabeçalho Accept.
+
+Clientes móveis podem pedir `application/msgpack` (ou `application/cbor`,
+se o pacote cbor2 estiver instalado) em vez de JSON. As listas grandes
+(investimentos, votos, campanha, cidades) saem então em colunas ("struct of
+arrays": {"count": n, "columns": {campo: [valores]}}) em vez de uma lista de
+objetos que repete os nomes dos campos a cada registro. O parâmetro
+`?layout=rows|columns` escolhe o layout explicitamente (também vale para JSON).
+
+Sem Accept binário nada muda: JSON com o layout original.
+"""
+
+import importlib.util
+
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+JSON = "application/json"
+
+# Tipos aceitos no Accept -> formato; os sem biblioteca instalada são ignorados
+_ALIASES = {
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    "application/cbor": CBOR,
+}
+AVAILABLE = {media for media, module in ((MSGPACK, "msgpack"), (CBOR, "cbor2")) if importlib.util.find_spec(module)}
+LAYOUTS = ("rows", "columns")
+
+
+def negotiate(accept):
+    """
+    Formato binário preferido no Accept (pela qualidade q, empate fica com o
+    primeiro listado), ou None quando JSON é preferido ou nada binário foi pedido.
+    """
+    if not accept:
+        return None
+    best, best_q, json_q = None, 0.0, 0.0
+    for part in accept.split(","):
+        media, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        media = media.lower()
+        binary = _ALIASES.get(media)
+        if binary in AVAILABLE and q > best_q:
+            best, best_q = binary, q
+        elif media in (JSON, "application/*", "*/*"):
+            json_q = max(json_q, q)
+    return best if best and best_q >= json_q else None
+
+
+def encode(payload, media):
+    if media == MSGPACK:
+        import msgpack
+        return msgpack.packb(payload, use_bin_type=True)
+    import cbor2
+    return cbor2.dumps(payload)
+
+
+def decode(body, media):
+    if media == MSGPACK:
+        import msgpack
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    import cbor2
+    return cbor2.loads(body)
+
+
+def columns(rows, fields=None):
+    """Lista de dicts -> {"count": n, "columns": {campo: [valores]}}; campos ausentes viram None."""
+    if fields is None:
+        fields = list(dict.fromkeys(key for row in rows for key in row))
+    return {"count": len(rows), "columns": {field: [row.get(field) for row in rows] for field in fields}}
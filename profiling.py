@@ -0,0 +1,194 @@
+"""
+Captura opcional de perfis por requisição.
+
+- Requisições com o cabeçalho `X-Debug-Profile: 1` são perfiladas de forma
+  determinística (cProfile, exportável como pstats) e também amostradas.
+- Captura automática de lentas (opcional, desligada por padrão): com
+  PROFILE_SLOW_THRESHOLD > 0, uma fração PROFILE_SAMPLE_RATE das demais
+  requisições é amostrada por uma thread leve e, se passar do limiar, o
+  perfil amostrado é guardado.
+
+Custo da captura automática: enquanto houver requisição amostrada em
+andamento, a thread lê sys._current_frames() a cada PROFILE_SAMPLE_INTERVAL
+(5 ms) e monta a pilha, disputando o GIL com o event loop. Em produção,
+prefira um limiar alto e PROFILE_SAMPLE_RATE baixo (ex.: 0.05).
+
+Os últimos PROFILE_RING_SIZE perfis ficam em memória (ring buffer) e podem
+ser baixados como "collapsed stacks" (flamegraph.pl / speedscope) ou pstats.
+
+Observação: os endpoints são async e dividem a mesma thread do event loop,
+então as amostras de requisições simultâneas incluem o trabalho das outras.
+"""
+
+import collections
+import cProfile
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+PROFILE_HEADER = "x-debug-profile"
+PROFILE_SLOW_THRESHOLD = float(os.getenv("PROFILE_SLOW_THRESHOLD", "0"))  # 0 desliga a captura automática
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "1.0"))  # fração das requisições amostradas
+PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "20"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+MAX_STACK_DEPTH = 64
+
+
+def _collapse(frame):
+    """Converte a pilha de um frame em "raiz;...;folha"."""
+    parts = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class _Capture:
+    __slots__ = ("thread_id", "samples")
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.samples = collections.Counter()
+
+
+class StackSampler:
+    """Thread que amostra a pilha das threads com capturas ativas (dorme quando não há nenhuma)."""
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._captures = set()
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def begin(self):
+        capture = _Capture(threading.get_ident())
+        with self._lock:
+            self._captures.add(capture)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        self._active.set()
+        return capture
+
+    def end(self, capture):
+        with self._lock:
+            self._captures.discard(capture)
+            if not self._captures:
+                self._active.clear()
+        return capture.samples
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                captures = list(self._captures)
+            if not captures:
+                continue
+            frames = sys._current_frames()
+            stacks = {}
+            for capture in captures:
+                frame = frames.get(capture.thread_id)
+                if frame is None:
+                    continue
+                if capture.thread_id not in stacks:
+                    stacks[capture.thread_id] = _collapse(frame)
+                capture.samples[stacks[capture.thread_id]] += 1
+
+
+class RequestProfiler:
+    def __init__(self, threshold=PROFILE_SLOW_THRESHOLD, ring_size=PROFILE_RING_SIZE, sample_rate=PROFILE_SAMPLE_RATE):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.profiles = collections.deque(maxlen=ring_size)
+        self.sampler = StackSampler()
+        self._ids = itertools.count(1)
+        self._deterministic_lock = threading.Lock()
+
+    async def handle(self, request, call_next, forced=False):
+        """Executa a requisição capturando o perfil quando pedido (forced) ou quando ela for lenta."""
+        if not forced and (self.threshold <= 0 or self.sample_rate <= 0
+                           or (self.sample_rate < 1 and random.random() >= self.sample_rate)):
+            return await call_next(request)
+
+        profiler = None
+        # Só um cProfile por vez; se já houver outro ativo, fica apenas a amostragem
+        if forced and self._deterministic_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        capture = self.sampler.begin()
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            duration = time.perf_counter() - start
+            samples = self.sampler.end(capture)
+            stats = None
+            if profiler is not None:
+                profiler.disable()
+                self._deterministic_lock.release()
+                stats = pstats.Stats(profiler)
+            if forced or duration >= self.threshold:
+                self._store(request, status, duration, "header" if forced else "slow", samples, stats)
+
+    def _store(self, request, status, duration, trigger, samples, stats):
+        profile = {
+            "id": next(self._ids),
+            "method": request.method,
+            "path": request.url.path,
+            "status": status,
+            "duration_ms": round(duration * 1000, 2),
+            "trigger": trigger,
+            "captured_at": time.time(),
+            "samples": samples,
+            "pstats": marshal.dumps(stats.stats) if stats is not None else None,
+        }
+        self.profiles.append(profile)
+        print(f"Perfil #{profile['id']} capturado ({trigger}): {request.method} {request.url.path} "
+              f"em {profile['duration_ms']:.0f}ms")
+
+    def list(self):
+        return [
+            {k: v for k, v in p.items() if k not in ("samples", "pstats")}
+            | {"sample_count": sum(p["samples"].values()), "has_pstats": p["pstats"] is not None}
+            for p in reversed(self.profiles)
+        ]
+
+    def get(self, profile_id):
+        for p in self.profiles:
+            if p["id"] == profile_id:
+                return p
+        return None
+
+    @staticmethod
+    def collapsed(profile):
+        return "".join(f"{stack} {count}\n" for stack, count in profile["samples"].most_common())
+
+    @staticmethod
+    def pstats_text(profile, limit=40):
+        """Resumo legível do pstats (ordenado por tempo acumulado)."""
+        stats = pstats.Stats(_RawStats(marshal.loads(profile["pstats"])), stream=io.StringIO())
+        stats.sort_stats("cumulative").print_stats(limit)
+        return stats.stream.getvalue()
+
+
+class _RawStats:
+    """Adaptador para reconstruir pstats.Stats a partir do dicionário serializado."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
@@ -1,6 +1,8 @@
 import json
 import os
 
+from storage import aggregate_campaign, write_json_atomic
+
 print("Reconstruindo campaign_data.json...")
 
 votos_data = {}
@@ -22,31 +24,11 @@ if os.path.exists("investments_data.json"):
     except Exception as e:
         print(f"Erro ao ler investimentos: {e}")
 
-new_campaign_data = {}
-
-# Processa votos
-print(f"Processando votos de {len(votos_data)} cidades...")
-for slug, entries in votos_data.items():
-    if slug not in new_campaign_data:
-        new_campaign_data[slug] = {"votes": 0, "money": 0}
-    
-    total_votos = sum(e["votos"] for e in entries)
-    new_campaign_data[slug]["votes"] = total_votos
-
-# Processa investimentos
-print(f"Processando {len(investments_data)} investimentos...")
-for inv in investments_data:
-    slug = inv.get("cityId")
-    if not slug: continue
-    
-    if slug not in new_campaign_data:
-        new_campaign_data[slug] = {"votes": 0, "money": 0}
-    
-    new_campaign_data[slug]["money"] += inv.get("valor", 0)
+print(f"Processando votos de {len(votos_data)} cidades e {len(investments_data)} investimentos...")
+new_campaign_data = aggregate_campaign(votos_data, investments_data)
 
 # Salva novo arquivo limpo
-with open("campaign_data.json", "w", encoding="utf-8") as f:
-    json.dump(new_campaign_data, f, indent=2)
+write_json_atomic("campaign_data.json", new_campaign_data, indent=2)
 
 print(f"Sucesso! {len(new_campaign_data)} cidades processadas.")
 print("Verificando se Curitiba e Cascavel foram removidas...")
@@ -0,0 +1,116 @@
+"""
+Dados de referência (cidades, eleitorado, índice geográfico e estruturas
+derivadas) como um único objeto imutável por carga.
+
+Uma recarga monta um ReferenceData novo inteiro fora do caminho das
+requisições (parse, rankings, índices) e a troca é só a publicação desse
+objeto no estado versionado: requisições em andamento continuam com o
+snapshot que pegaram, as novas já veem a carga nova, e os caches chaveados
+pela versão do snapshot (chat, carga inicial, regiões, modelo de alocação)
+deixam de valer sozinhos.
+
+A recarga é disparada por POST /api/admin/reload ou pelo ReferenceWatcher,
+que observa o mtime dos arquivos e só recarrega quando eles param de mudar
+(um arquivo ainda sendo gravado pelo ETL não é lido pela metade).
+"""
+
+import difflib
+import os
+import re
+import time
+
+from cities import CityCatalog
+from city_search import CitySearchIndex
+from text_utils import fold_accents
+
+# Arquivos do índice geográfico (lido por geo.py) e níveis de região do IBGE; ficam aqui,
+# longe do numpy, para o servidor conhecê-los sem pagar o import de geo.py
+SVG_PATH = "mapa_pr.svg"
+REGIONS_PATH = os.getenv("IBGE_REGIONS_FILE", "ibge_regioes.json")
+REGION_LEVELS = ("mesorregiao", "microrregiao")
+
+def _electoral_key(text):
+    """Chave só com letras e dígitos: "diamante_d'oeste" e "diamante_doeste" coincidem."""
+    return re.sub(r"[^a-z0-9]", "", fold_accents(text or ""))
+
+
+def electoral_by_city(cities, electoral):
+    """
+    {slug do catálogo: registro do TSE}. As chaves do arquivo eleitoral nem
+    sempre batem com os slugs (apóstrofos, grafia): tenta o slug normalizado,
+    a chave sem pontuação e o nome do município; o que sobrar é pareado com
+    o registro ainda livre de grafia mais próxima ("Munhoz de Melo" x
+    "MUNHOZ DE MELLO").
+    """
+    by_key = {_electoral_key(key): data for key, data in electoral.items()}
+    by_name = {_electoral_key(data.get("nome")): data for data in electoral.values() if data.get("nome")}
+    index, missing = {}, []
+    for slug, city in cities.items():
+        data = (electoral.get(slug.lower().replace("-", "_")) or by_key.get(_electoral_key(slug))
+                or by_name.get(_electoral_key(city.get("nome"))))
+        if data:
+            index[slug] = data
+        else:
+            missing.append(slug)
+    if missing:
+        used = {id(data) for data in index.values()}
+        free = {key: data for key, data in by_key.items() if id(data) not in used}
+        for slug in missing:
+            match = difflib.get_close_matches(_electoral_key(slug), list(free), n=1, cutoff=0.9)
+            if match:
+                index[slug] = free.pop(match[0])
+    return index
+
+
+class ReferenceData:
+    """Uma carga dos dados de referência. Nada aqui é alterado depois de montado."""
+
+    __slots__ = ("cities", "electoral", "electoral_by_city", "global_stats", "geo", "city_search", "digests", "loaded_at",
+                 "similarity")
+
+    def __init__(self, cities, electoral, global_stats, geo=None, digests=None):
+        self.cities = cities
+        self.electoral = electoral
+        self.electoral_by_city = electoral_by_city(cities, electoral)  # use este para buscar por slug
+        self.global_stats = global_stats
+        self.geo = geo
+        self.city_search = CitySearchIndex(cities)
+        self.digests = digests or {}
+        self.loaded_at = time.time()
+        self.similarity = None  # motor de semelhança (NumPy), montado sob demanda para esta carga
+
+    @classmethod
+    def from_build(cls, data, digests=None):
+        return cls(data["cities"], data["electoral"], data["global_stats"], data.get("geo"), digests)
+
+    @classmethod
+    def empty(cls, global_stats):
+        return cls(CityCatalog(), {}, global_stats)
+
+
+def source_mtimes(sources):
+    return {src: os.path.getmtime(src) if os.path.exists(src) else None for src in sources}
+
+
+class ReferenceWatcher:
+    """
+    Detecta mudança nos arquivos de referência por mtime. poll() devolve True
+    quando houve mudança e os arquivos ficaram estáveis por uma verificação
+    inteira (o mtime não mudou desde a anterior).
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+        self._seen = source_mtimes(sources)
+        self._pending = None
+
+    def poll(self):
+        current = source_mtimes(self.sources)
+        if current == self._seen:
+            self._pending = None
+            return False
+        if current != self._pending:
+            self._pending = current  # mudou agora: espera a próxima verificação
+            return False
+        self._seen, self._pending = current, None
+        return True
@@ -0,0 +1,188 @@
+"""
+Índice de busca local (BM25) sobre as descrições das cidades e dos
+investimentos, usado para fundamentar o chat sem depender da busca web.
+
+- Tokenização em português: sem acentos, minúscula, sem stopwords e com
+  redução simples de plural ("escolas" -> "escola", "hospitais" -> "hospital").
+- Índice invertido esparso (termo -> {documento: frequência}); os pesos do
+  BM25 são calculados na consulta, então incluir/remover documentos é barato
+  e o índice de investimentos é atualizado de forma incremental.
+"""
+
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from cities import NOT_INFORMED
+from text_utils import fold_accents
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = set("""
+a ao aos as com como da das de do dos e em entre era essa esse esta este eu foi for ha isso isto ja
+la lhe mais mas me mesmo na nas nem no nos o os ou para pela pelas pelo pelos por qual quais quando
+que quem se sem ser seu sua sao tem ter um uma umas uns voce muito muita muitos muitas onde sobre
+tambem ate apos cada outro outra todos todas
+cidade cidades municipio municipios parana brasileiro brasileira estado localizado localizada
+quanto quantos investimento investimentos investido investida emenda emendas recurso recursos
+""".split())
+
+INVESTMENT_FIELDS = ("cityId", "ano", "valor", "area", "tipo", "descricao", "cityName")
+
+
+@lru_cache(maxsize=65536)
+def _stem(token):
+    """Reduz plurais comuns do português à forma singular."""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    for suffix, replacement in (("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("ois", "ol"),
+                                ("ns", "m"), ("res", "r"), ("zes", "z")):
+        if token.endswith(suffix) and len(token) > len(suffix) + 2:
+            return token[:-len(suffix)] + replacement
+    if token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [_stem(t) for t in _TOKEN.findall(fold_accents(text)) if len(t) > 1 and t not in STOPWORDS]
+
+
+@lru_cache(maxsize=8192)
+def _term_counts(text):
+    # Descrições se repetem muito entre investimentos ("Custeio em Saúde"): tokeniza cada texto uma vez
+    counts = Counter(tokenize(text))
+    return tuple(counts.items()), sum(counts.values())
+
+
+class BM25Index:
+    # Termos presentes em mais que esta fração dos documentos quase não discriminam e são ignorados no score
+    COMMON_TERM_RATIO = 0.5
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)  # termo -> {doc_id: tf}
+        self._docs = {}  # doc_id -> (comprimento, termos distintos, payload)
+        self._sources = defaultdict(set)  # fonte -> doc_ids
+        self._total_length = 0
+        self._versions = {}  # fonte -> última versão sincronizada
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _add(self, doc_id, text, payload):
+        counts, length = _term_counts(text)
+        for term, tf in counts:
+            self._postings[term][doc_id] = tf
+        self._docs[doc_id] = (length, tuple(term for term, _ in counts), payload)
+        self._total_length += length
+
+    def _remove(self, doc_id):
+        length, terms, _ = self._docs.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= length
+
+    def sync(self, source, items, describe, version=None):
+        """
+        Deixa no índice exatamente os documentos de `items` ({chave: objeto})
+        da fonte `source`: inclui as chaves novas (describe(objeto) -> (texto,
+        payload) só é chamado para elas) e remove as que saíram. Versões mais
+        antigas que a última sincronizada são ignoradas. Devolve (incluídos, removidos).
+        """
+        with self._lock:
+            if version is not None and version < self._versions.get(source, -1):
+                return 0, 0
+            current = self._sources[source]
+            wanted = {(source, key) for key in items}
+            removed = current - wanted
+            for doc_id in removed:
+                self._remove(doc_id)
+            added = 0
+            for key, obj in items.items():
+                doc_id = (source, key)
+                if doc_id not in current:
+                    self._add(doc_id, *describe(obj))
+                    added += 1
+            self._sources[source] = wanted
+            if version is not None:
+                self._versions[source] = version
+        return added, len(removed)
+
+    def search(self, query, k=5):
+        """
+        Devolve (resultados, cobertura): os k documentos de maior BM25, como
+        dicts {"score", "payload"}, e a fração dos termos da consulta presentes
+        em pelo menos um deles.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return [], 0.0
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs:
+                return [], 0.0
+            avg_length = self._total_length / n_docs
+            present = {term: self._postings[term] for term in terms if term in self._postings}
+            selective = {t: p for t, p in present.items() if len(p) <= n_docs * self.COMMON_TERM_RATIO} or present
+            scores = defaultdict(float)
+            for term, postings in selective.items():
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    length = self._docs[doc_id][0]
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            hits = [{"score": round(score, 3), "payload": self._docs[doc_id][2]} for doc_id, score in top]
+            covered = {term for term, postings in present.items() if any(doc_id in postings for doc_id, _ in top)}
+        return hits, len(covered) / len(terms)
+
+
+# --- Documentos da aplicação ---
+
+CITY_TEXT_FIELDS = ("nome", "gentilico", "descricao", "clima", "economia")
+
+
+def describe_city(item):
+    slug, city = item
+    fields = [city.get(key) for key in CITY_TEXT_FIELDS]
+    text = " ".join(f for f in fields if isinstance(f, str) and f != NOT_INFORMED)
+    return text, {"tipo": "cidade", "slug": slug, "nome": city.get("nome"), "texto": city.get("descricao", "")}
+
+
+def describe_investment(inv):
+    text = f"{inv.get('area') or ''} {inv.get('tipo') or ''} {inv.get('descricao') or ''} {inv.get('cityName') or ''}"
+    return text, {"tipo": "investimento", "slug": inv.get("cityId"), "nome": inv.get("cityName"),
+                  "ano": inv.get("ano"), "valor": inv.get("valor"), "area": inv.get("area"),
+                  "texto": inv.get("descricao") or ""}
+
+
+def city_items(cities):
+    """Chave = slug + textos indexados, então uma cidade editada é reindexada na recarga dos dados."""
+    return {(slug, *map(city.get, CITY_TEXT_FIELDS)): (slug, city) for slug, city in cities.items()}
+
+
+def investment_items(investments):
+    """Chave = conteúdo do registro (+ ordinal para repetidos), então só os registros novos são indexados."""
+    items = {}
+    seen = {}
+    for inv in investments:
+        fields = tuple(map(inv.get, INVESTMENT_FIELDS))
+        n = seen[fields] = seen.get(fields, 0) + 1
+        items[fields, n] = inv
+    return items
+
+
+def format_passage(payload):
+    if payload["tipo"] == "cidade":
+        return f"- {payload['nome']}: {payload['texto']}"
+    valor = payload.get("valor") or 0
+    return f"- Investimento em {payload['nome']} ({payload.get('ano')}, {payload.get('area')}): " \
+           f"{payload['texto']} — R$ {valor:,.2f}"
@@ -0,0 +1,175 @@
+"""
+Controle de admissão para chamadas externas caras (modelo de IA, busca web).
+
+- No máximo UPSTREAM_CONCURRENCY chamadas rodam ao mesmo tempo; as demais
+  esperam numa fila limitada (UPSTREAM_QUEUE_SIZE).
+- A fila é justa por cliente: a vaga liberada vai para o próximo cliente em
+  rodízio, então quem dispara muitas perguntas não bloqueia os outros.
+- Fila cheia responde na hora com 503 e cliente acima do limite próprio com
+  429, ambos com Retry-After estimado pelo tempo médio de serviço.
+- Erros transitórios do provedor (rate limit, timeout, conexão, 5xx) são
+  repetidos com backoff exponencial com jitter.
+"""
+
+import asyncio
+import math
+import os
+import random
+import time
+from collections import OrderedDict, deque
+
+import metrics
+
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "4"))
+UPSTREAM_QUEUE_SIZE = int(os.getenv("UPSTREAM_QUEUE_SIZE", "32"))
+UPSTREAM_PER_CLIENT = int(os.getenv("UPSTREAM_PER_CLIENT", "4"))  # em execução + na fila, por cliente
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8.0"))
+
+# Nomes das exceções do SDK da OpenAI consideradas transitórias (sem importar o SDK aqui)
+TRANSIENT_ERRORS = {"RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError"}
+TRANSIENT_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class Overloaded(Exception):
+    """Requisição recusada sem chegar ao provedor (fila cheia ou cliente acima do limite)."""
+
+    def __init__(self, status_code, retry_after, reason):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def is_transient(error):
+    if type(error).__name__ in TRANSIENT_ERRORS:
+        return True
+    return getattr(error, "status_code", None) in TRANSIENT_STATUS
+
+
+def _retry_after_hint(error):
+    """Retry-After enviado pelo provedor, quando houver."""
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def call_with_retries(fn, retries=UPSTREAM_RETRIES, base=UPSTREAM_BACKOFF_BASE, cap=UPSTREAM_BACKOFF_MAX):
+    """
+    Executa fn() (bloqueante, em thread) repetindo erros transitórios com
+    backoff exponencial "full jitter"; o último erro é repassado.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= retries or not is_transient(e):
+                raise
+            delay = random.uniform(0, min(cap, base * 2 ** attempt))
+            hint = _retry_after_hint(e)
+            if hint is not None:
+                delay = min(cap, max(delay, hint))
+            metrics.UPSTREAM_RETRIES.inc(error=type(e).__name__)
+            print(f"Erro transitório no provedor ({type(e).__name__}), nova tentativa em {delay:.2f}s")
+            time.sleep(delay)
+
+
+class UpstreamScheduler:
+    def __init__(self, concurrency=UPSTREAM_CONCURRENCY, queue_size=UPSTREAM_QUEUE_SIZE,
+                 per_client=UPSTREAM_PER_CLIENT):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.per_client = per_client
+        self.running = 0
+        self.queued = 0
+        self._queues = OrderedDict()  # cliente -> deque de futures aguardando vaga (ordem = rodízio)
+        self._per_client = {}
+        self._service_time = 1.0  # média móvel do tempo de execução, para estimar o Retry-After
+
+    def retry_after(self):
+        """Segundos sugeridos para o cliente tentar de novo (filas restantes x tempo médio de serviço)."""
+        waves = (self.queued + 1) / max(self.concurrency, 1)
+        return max(1, math.ceil(waves * self._service_time))
+
+    def _reject(self, status_code, reason):
+        metrics.UPSTREAM_REJECTED.inc(reason=reason)
+        raise Overloaded(status_code, self.retry_after(), reason)
+
+    def _update_gauges(self):
+        metrics.UPSTREAM_IN_FLIGHT.set(self.running)
+        metrics.UPSTREAM_QUEUE_DEPTH.set(self.queued)
+
+    async def run(self, client_id, factory):
+        """Executa `await factory()` quando houver vaga; pode levantar Overloaded antes disso."""
+        if self._per_client.get(client_id, 0) >= self.per_client:
+            self._reject(429, "client_limit")
+        if self.running >= self.concurrency and self.queued >= self.queue_size:
+            self._reject(503, "queue_full")
+
+        self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+        enqueued_at = time.perf_counter()
+        try:
+            await self._acquire(client_id)
+            metrics.UPSTREAM_QUEUE_SECONDS.observe(time.perf_counter() - enqueued_at)
+            started = time.perf_counter()
+            try:
+                return await factory()
+            finally:
+                self._service_time = 0.8 * self._service_time + 0.2 * (time.perf_counter() - started)
+                self._release()
+        finally:
+            remaining = self._per_client[client_id] - 1
+            if remaining:
+                self._per_client[client_id] = remaining
+            else:
+                del self._per_client[client_id]
+
+    async def _acquire(self, client_id):
+        if self.running < self.concurrency and not self.queued:
+            self.running += 1
+            self._update_gauges()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client_id, deque()).append(future)
+        self.queued += 1
+        self._update_gauges()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # A vaga já tinha sido repassada para esta requisição: devolve
+                self._release()
+            else:
+                self._discard(client_id, future)
+            raise
+
+    def _discard(self, client_id, future):
+        queue = self._queues.get(client_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+            if not queue:
+                del self._queues[client_id]
+            self._update_gauges()
+
+    def _release(self):
+        """Passa a vaga ao próximo cliente do rodízio (ou a libera se ninguém estiver esperando)."""
+        while self._queues:
+            client_id, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self._queues.move_to_end(client_id)
+            else:
+                del self._queues[client_id]
+            if not future.done():
+                future.set_result(None)
+                self._update_gauges()
+                return
+        self.running -= 1
+        self._update_gauges()
@@ -44,6 +44,10 @@ document.addEventListener('DOMContentLoaded', async () => {
         party: 'all'
     };
     let currentVisMode = 'none';
+    // Quebras de classe do coroplético por camada, vindas do /api/bootstrap
+    let layerBreaks = {};
+    let bootstrapTotals = null;
+    let campaignFiltered = false;
 
     // Cores dos Partidos (Oficiais/Aproximadas)
     const PARTY_COLORS = {
@@ -109,10 +113,15 @@ document.addEventListener('DOMContentLoaded', async () => {
             mapGroup.style.transformBox = 'fill-box';
         }
 
-        // 3. Load Data
-        const jsonResponse = await fetch('cidades_pr.json?v=20260116');
-        if (!jsonResponse.ok) throw new Error(`Erro JSON: ${jsonResponse.status}`);
-        citiesData = await jsonResponse.json();
+        // 3. Load Data: carga inicial única do servidor; sem API (deploy estático), lê o JSON das cidades
+        try {
+            await loadBootstrap();
+        } catch (e) {
+            console.warn('Bootstrap indisponível, usando cidades_pr.json:', e);
+            const jsonResponse = await fetch('cidades_pr.json?v=20260116');
+            if (!jsonResponse.ok) throw new Error(`Erro JSON: ${jsonResponse.status}`);
+            citiesData = await jsonResponse.json();
+        }
 
         initApp();
     } catch (error) {
@@ -357,7 +366,42 @@ document.addEventListener('DOMContentLoaded', async () => {
         // Legado - Função mantida vazia
     }
 
+    // Cidades (em colunas), métricas de campanha e quebras do coroplético numa única requisição
+    async function loadBootstrap() {
+        const res = await fetch('/api/bootstrap');
+        if (!res.ok) throw new Error(`Erro bootstrap: ${res.status}`);
+        const data = await res.json();
+        const columns = data.cities;
+        const fields = Object.keys(columns).filter(f => f !== 'id');
+
+        citiesData = {};
+        columns.id.forEach((slug, i) => {
+            const city = {};
+            fields.forEach(field => {
+                if (columns[field][i] !== null) city[field] = columns[field][i];
+            });
+            citiesData[slug] = city;
+
+            const votes = data.campaign.votes[i];
+            const money = data.campaign.money[i];
+            if (votes || money) campaignData[slug] = { votes, money };
+        });
+        layerBreaks = data.layers || {};
+        bootstrapTotals = data.totals;
+    }
+
+    function renderGlobalStats(totalVotes, totalMoney) {
+        document.getElementById('global-votes').innerText = totalVotes.toLocaleString('pt-BR');
+        document.getElementById('global-money').innerText = totalMoney.toLocaleString('pt-BR', { style: 'currency', currency: 'BRL' });
+    }
+
     async function loadCampaignGlobalStats() {
+        // Primeira carga: os totais já vieram no bootstrap
+        if (bootstrapTotals) {
+            renderGlobalStats(bootstrapTotals.votes, bootstrapTotals.money);
+            bootstrapTotals = null;
+            return;
+        }
         try {
             const res = await fetch('/api/campaign/data');
             if (res.ok) {
@@ -371,8 +415,7 @@ document.addEventListener('DOMContentLoaded', async () => {
                     totalMoney += (c.money || 0);
                 });
 
-                document.getElementById('global-votes').innerText = totalVotes.toLocaleString('pt-BR');
-                document.getElementById('global-money').innerText = totalMoney.toLocaleString('pt-BR', { style: 'currency', currency: 'BRL' });
+                renderGlobalStats(totalVotes, totalMoney);
             }
         } catch (e) {
             console.warn("Erro ao carregar stats globais:", e);
@@ -416,8 +459,10 @@ document.addEventListener('DOMContentLoaded', async () => {
                 msg.style.color = 'green';
                 msg.innerText = "Salvo com sucesso!";
 
-                // Atualiza cache e totais
+                // Atualiza cache e totais (as quebras do servidor não valem mais para a campanha)
                 campaignData[activeCityId] = { votes, money };
+                layerBreaks.votes = null;
+                layerBreaks.money = null;
                 loadCampaignGlobalStats();
 
                 // Atualiza Insights e Mapa
@@ -591,7 +636,14 @@ document.addEventListener('DOMContentLoaded', async () => {
             campaignField = (type === 'votes') ? 'votes' : 'money';
         }
 
-        if (dataField || useCampaignData) {
+        // Escala por classes calculadas no servidor (quantis/Jenks); sem elas, escala calculada aqui
+        const breaks = useCampaignData ? (campaignFiltered ? null : layerBreaks[campaignField]) : layerBreaks[dataField];
+        window.mapLegendBreaks = breaks || null;
+
+        if (breaks) {
+            minVal = breaks[0];
+            maxVal = breaks[breaks.length - 1];
+        } else if (dataField || useCampaignData) {
             Object.keys(citiesData).forEach(slug => {
                 let val = 0;
                 if (useCampaignData) {
@@ -634,8 +686,10 @@ document.addEventListener('DOMContentLoaded', async () => {
                 } else {
                     let ratio = 0;
 
-                    // 2. Rank-Based Scaling for Pop/PIB (Guarantees distribution)
-                    if (dataField === 'habitantes' || dataField === 'pib_per_capita') {
+                    if (breaks) {
+                        ratio = breaksRatio(val, breaks);
+                    } else if (dataField === 'habitantes' || dataField === 'pib_per_capita') {
+                        // 2. Rank-Based Scaling for Pop/PIB (Guarantees distribution)
                         if (!window.mapSortedValues || window._sortedCacheKey !== dataField) {
                             // Create cache of sorted positive values
                             const values = Object.values(citiesData)
@@ -714,6 +768,24 @@ document.addEventListener('DOMContentLoaded', async () => {
         else mapContainer.classList.remove('filtering');
     }
 
+    // Posição (0–1) de um valor na escala de classes: classe do valor + interpolação dentro dela
+    function breaksRatio(val, breaks) {
+        const k = breaks.length - 1;
+        if (val <= breaks[0]) return 0;
+        if (val >= breaks[k]) return 1;
+        let c = 0;
+        while (c < k - 1 && val > breaks[c + 1]) c++;
+        const span = breaks[c + 1] - breaks[c];
+        return (c + (span > 0 ? (val - breaks[c]) / span : 1)) / k;
+    }
+
+    // Inverso de breaksRatio (régua da legenda)
+    function breaksValue(pct, breaks) {
+        const k = breaks.length - 1;
+        const c = Math.min(Math.floor(pct * k), k - 1);
+        return breaks[c] + (pct * k - c) * (breaks[c + 1] - breaks[c]);
+    }
+
     // Heatmap: "Turbo-like" Rainbow spectrum for high contrast
     function getHeatmapColor(t) {
         // 0.0 (Low) -> 1.0 (High)
@@ -862,7 +934,9 @@ document.addEventListener('DOMContentLoaded', async () => {
 
                 let val = 0;
                 // Reverse calculation Logic
-                if ((currentVisMode === 'heatmap-pop' || currentVisMode === 'heatmap-pib') && window.mapSortedValues) {
+                if (window.mapLegendBreaks) {
+                    val = breaksValue(pct, window.mapLegendBreaks);
+                } else if ((currentVisMode === 'heatmap-pop' || currentVisMode === 'heatmap-pib') && window.mapSortedValues) {
                     const idx = Math.floor(pct * (window.mapSortedValues.length - 1));
                     val = window.mapSortedValues[idx];
                 } else {
@@ -1698,6 +1772,9 @@ document.addEventListener('DOMContentLoaded', async () => {
 
         if (!chatToggle || !chatWindow) return;
 
+        // Sessão da conversa no servidor (o histórico fica lá; perguntas seguintes continuam o assunto)
+        let chatSessionId = null;
+
         // Toggle Open/Close
         const toggleChat = () => {
             const isOpen = chatWindow.classList.contains('open');
@@ -1865,12 +1942,20 @@ ${cityInvestments || ''}
                         city_context: cityContext,
                         mayor_context: mayorContext,
                         site_stats: siteStats,
-                        investment_context: investmentContext
+                        investment_context: investmentContext,
+                        session_id: chatSessionId
                     })
                 });
 
+                if (response.status === 429 || response.status === 503) {
+                    const err = await response.json().catch(() => ({}));
+                    removeMessage(loadingId);
+                    appendMessage(err.detail || "O assistente está ocupado. Tente novamente em instantes.", 'bot');
+                    return;
+                }
                 if (!response.ok) throw new Error("Erro na conexão com API");
                 const data = await response.json();
+                chatSessionId = data.session_id || chatSessionId;
 
                 // 4. Remove loading and show response
                 removeMessage(loadingId);
@@ -2473,23 +2558,50 @@ ${cityInvestments || ''}
         }
     }
 
-    // Save investments to server
-    async function saveInvestmentsToServer() {
+    // Merge investments into the server store (upsert by natural key); returns the counts or null
+    async function mergeInvestmentsToServer(investments) {
         try {
-            const response = await fetch('/api/investments/save', {
+            const response = await fetch('/api/investments/merge', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ investments: investmentsData })
+                body: JSON.stringify({ investments })
             });
-            if (response.ok) {
-                const data = await response.json();
-                console.log(`Investimentos salvos no servidor: ${data.count}`);
-                return true;
-            }
+            if (response.ok) return await response.json();
         } catch (error) {
-            console.error('Erro ao salvar investimentos no servidor:', error);
+            console.error('Erro ao mesclar investimentos no servidor:', error);
         }
-        return false;
+        return null;
+    }
+
+    // Same natural key as the server (storage.investment_key): one Map lookup per row instead of comparing every pair
+    function investmentKey(inv) {
+        const text = (s) => (s || '').toString().trim().toLowerCase();
+        return [inv.cityId, inv.ano, text(inv.tipo), text(inv.descricao), Math.round((inv.valor || 0) * 100)].join('\u0001');
+    }
+
+    function mergeInvestmentsLocally(existing, incoming) {
+        const merged = existing.slice();
+        const positions = new Map();
+        merged.forEach((inv, i) => {
+            const key = investmentKey(inv);
+            if (!positions.has(key)) positions.set(key, i);
+        });
+        const counts = { inserted: 0, updated: 0, duplicate: 0 };
+        incoming.forEach(inv => {
+            const key = investmentKey(inv);
+            const i = positions.get(key);
+            if (i === undefined) {
+                positions.set(key, merged.length);
+                merged.push(inv);
+                counts.inserted++;
+            } else if (JSON.stringify(merged[i]) === JSON.stringify(inv)) {
+                counts.duplicate++;
+            } else {
+                merged[i] = inv;
+                counts.updated++;
+            }
+        });
+        return { merged, counts };
     }
 
     // Load investments on init
@@ -2591,9 +2703,16 @@ ${cityInvestments || ''}
                 return parseFloat(str) || 0;
             };
 
-            // Clear existing data (overwrite mode)
+            // Rows from this spreadsheet; merged into the existing data (upsert) below
             const newInvestments = [];
 
+            // City lookup by normalized name, built once
+            const cityIdsByName = new Map();
+            Object.keys(citiesData).forEach(id => {
+                const key = normalizeStr(citiesData[id].nome || '');
+                if (!cityIdsByName.has(key)) cityIdsByName.set(key, id);
+            });
+
             // Parse investments
             let imported = 0;
             let notFound = [];
@@ -2631,10 +2750,7 @@ ${cityInvestments || ''}
                 }
 
                 // Find city by name (case insensitive, accent tolerant)
-                const cityId = Object.keys(citiesData).find(id => {
-                    const nomeCidade = citiesData[id].nome || '';
-                    return normalizeStr(nomeCidade) === normalizeStr(cityName);
-                });
+                const cityId = cityIdsByName.get(normalizeStr(cityName));
 
                 if (cityId) {
                     newInvestments.push({
@@ -2652,12 +2768,31 @@ ${cityInvestments || ''}
                 }
             });
 
+            // Merge into the existing data: the server upserts by natural key and reports the counts
+            let counts = null;
+            let savedOnServer = false;
+            if (imported > 0) {
+                const result = await mergeInvestmentsToServer(newInvestments);
+                if (result) {
+                    counts = result;
+                    savedOnServer = true;
+                    await loadInvestmentsFromServer();
+                } else {
+                    const local = mergeInvestmentsLocally(investmentsData, newInvestments);
+                    counts = local.counts;
+                    investmentsData = local.merged;
+                }
+                window.investmentsData = investmentsData; // Atualiza global para filtros
+            }
+
             // Build result message
             let message = '';
 
             if (imported > 0) {
-                message += `✅ SUCESSO!\n\n${imported} investimentos importados com sucesso.\n`;
-                message += `(Os dados anteriores foram sobrescritos)\n`;
+                message += `✅ SUCESSO!\n\n${imported} linhas lidas da planilha:\n`;
+                message += `• ${counts.inserted} novos investimentos\n`;
+                message += `• ${counts.updated} atualizados\n`;
+                message += `• ${counts.duplicate} duplicados (já existiam, ignorados)\n`;
             } else {
                 message += `⚠️ ATENÇÃO!\n\nNenhum investimento foi importado.\n`;
             }
@@ -2670,11 +2805,7 @@ ${cityInvestments || ''}
                 message += `\n❌ Linhas com erro (${invalidRows.length}):\n${invalidRows.slice(0, 5).join('\n')}${invalidRows.length > 5 ? '\n...' : ''}\n`;
             }
 
-            // Replace existing data with new data (overwrite)
             if (imported > 0) {
-                investmentsData = newInvestments;
-                window.investmentsData = newInvestments; // Atualiza global para filtros
-
                 // Atualiza campaignData.money com totais de investimentos
                 // Primeiro limpa apenas os valores de money (não afeta votes)
                 Object.keys(campaignData).forEach(slug => {
@@ -2682,17 +2813,16 @@ ${cityInvestments || ''}
                 });
 
                 // Recalcula totais de investimentos por cidade
-                newInvestments.forEach(inv => {
+                investmentsData.forEach(inv => {
                     const slug = inv.cityId;
                     if (!campaignData[slug]) {
                         campaignData[slug] = { votes: 0, money: 0 };
                     }
                     campaignData[slug].money += inv.valor || 0;
                 });
+                layerBreaks.money = null; // quebras do bootstrap não valem mais
 
-                // Save to server
-                const saved = await saveInvestmentsToServer();
-                if (saved) {
+                if (savedOnServer) {
                     message += `\n💾 Dados salvos no servidor com sucesso!`;
                 } else {
                     message += `\n⚠️ Não foi possível salvar no servidor (dados mantidos localmente)`;
@@ -4162,6 +4292,8 @@ ${cityInvestments || ''}
 
         // Reset campaignData temporariamente
         const filteredCampaignData = {};
+        // Com filtros ativos as quebras do servidor (dados completos) não se aplicam
+        campaignFiltered = activeFilters.ano !== 'all' || activeFilters.area !== 'all' || activeFilters.tipo !== 'all';
 
         if (mode === 'heatmap-votes') {
             // Filtrar votos por ano
@@ -1,17 +1,38 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import List, Optional
-import uvicorn
+from typing import Dict, List, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import gzip
+import hashlib
+import ipaddress
 import os
 import json
+import threading
+import time
 from io import BytesIO
-from openpyxl import Workbook
-from fastapi.responses import StreamingResponse
-from openai import OpenAI
-from duckduckgo_search import DDGS
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
 from dotenv import load_dotenv
+import metrics
+from chat_sessions import KEEP_TURNS, SUMMARY_TOKENS, SessionStore, extractive_summary
+from chat_tools import TOOLS, ChatTools
+from cities import NOT_INFORMED, CityCatalog
+from city_search import MAX_LIMIT as SEARCH_MAX_LIMIT, CitySearchIndex
+from history import DATASETS as HISTORY_DATASETS, HistoryLog
+from cache import MISSING, SingleFlight, TTLCache
+from profiling import PROFILE_HEADER, RequestProfiler
+from negotiation import JSON, LAYOUTS, columns, encode, negotiate
+from retrieval import (BM25Index, city_items, describe_city, describe_investment, format_passage,
+                       investment_items)
+from scheduler import Overloaded, UpstreamScheduler, call_with_retries, is_transient
+from reference import REGION_LEVELS, REGIONS_PATH, SVG_PATH, ReferenceData, ReferenceWatcher
+from startup_snapshot import load_or_build, source_digests
+from state import VersionedState
+from storage import (INVESTMENT_FIELDS, STORAGE_BACKEND, SQLITE_PATH, InvestmentIndex, SQLiteStore, WriteBehindQueue, aggregate_campaign,
+                     merge_votos, write_json_atomic)
+from text_utils import normalize_message
 
 # --- Configuração ---
 load_dotenv()
@@ -19,7 +40,33 @@ load_dotenv()
 # Configuração de credenciais removida (Acesso Aberto)
 API_KEY = os.getenv("OPENAI_API_KEY")
 
-app = FastAPI()
+# Token opcional para os endpoints administrativos (/api/admin/*)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def is_admin(token: Optional[str]):
+    return not ADMIN_TOKEN or token == ADMIN_TOKEN
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Acesso administrativo negado.")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Dados carregados aqui (e não no import) para o processo subir rápido
+    load_all()
+    HISTORY.start(STATE)
+    PERSISTENCE.start()
+    watcher = asyncio.create_task(watch_reference_files()) if REFERENCE_WATCH_INTERVAL > 0 else None
+    yield
+    if watcher:
+        watcher.cancel()
+    from dossier import shutdown_pool
+    shutdown_pool()  # processos de geração de dossiês, se algum lote grande os criou
+    # Desligamento: grava tudo o que ainda estiver pendente
+    await PERSISTENCE.stop()
+    await asyncio.to_thread(HISTORY.stop)
+
+app = FastAPI(lifespan=lifespan)
 
 # Permite conexões do frontend
 app.add_middleware(
@@ -37,6 +84,8 @@ class ChatRequest(BaseModel):
     mayor_context: Optional[str] = None
     site_stats: Optional[str] = None
     investment_context: Optional[str] = None
+    mode: Optional[str] = None  # "prompt" (contexto completo) ou "tools" (function calling); padrão: CHAT_MODE
+    session_id: Optional[str] = None  # continua a conversa (devolvido em cada resposta); ver chat_sessions.py
 
 # --- Novos Modelos ---
 class LoginRequest(BaseModel):
@@ -56,165 +105,335 @@ class CampaignBulkItem(BaseModel):
 class CampaignBulkUpdate(BaseModel):
     items: List[CampaignBulkItem]
 
-# --- Gerenciamento de Dados de Campanha ---
-CAMPAIGN_DATA = {} 
+# --- Persistência (JSON por padrão, SQLite opcional via STORAGE_BACKEND=sqlite) ---
+STORE = None
 
-def save_campaign_data():
-    try:
-        with open("campaign_data.json", "w", encoding="utf-8") as f:
-            json.dump(CAMPAIGN_DATA, f, indent=2)
-    except Exception as e:
-        print(f"Erro ao salvar campanha: {e}")
+def open_store():
+    global STORE
+    if STORAGE_BACKEND != "sqlite" or STORE is not None:
+        return
+    STORE = SQLiteStore(SQLITE_PATH)
+    if STORE.is_empty():
+        print(f"Banco {SQLITE_PATH} vazio, migrando dados dos arquivos JSON...")
+        print(f"Migração concluída: {STORE.migrate_from_json()}")
+
+# --- Gerenciamento de Dados de Campanha ---
+def write_campaign_data(data):
+    if STORE:
+        STORE.replace_campaign(data)
+    else:
+        write_json_atomic("campaign_data.json", data, indent=2)
 
-# Carrega na inicialização
 # Carrega na inicialização será feito via rebuild_campaign_data() para consistência
 
 # --- Gerenciamento de Dados de Investimentos ---
-INVESTMENTS_DATA = []
-
-def save_investments_data():
-    try:
-        with open("investments_data.json", "w", encoding="utf-8") as f:
-            json.dump(INVESTMENTS_DATA, f, indent=2, ensure_ascii=False)
-        print(f"Investimentos salvos: {len(INVESTMENTS_DATA)} registros")
-    except Exception as e:
-        print(f"Erro ao salvar investimentos: {e}")
-
-# Carrega na inicialização
-if os.path.exists("investments_data.json"):
-    try:
-        with open("investments_data.json", "r", encoding="utf-8") as f:
-            INVESTMENTS_DATA = json.load(f)
-        print(f"Investimentos carregados: {len(INVESTMENTS_DATA)} registros")
-    except:
-        INVESTMENTS_DATA = []
+def write_investments_data(data):
+    if STORE:
+        STORE.replace_investments(data)
+    else:
+        write_json_atomic("investments_data.json", data, indent=2, ensure_ascii=False)
+    print(f"Investimentos salvos: {len(data)} registros")
+
+def load_investments_data():
+    investments = []
+    if STORE:
+        investments = STORE.load_investments()
+    elif os.path.exists("investments_data.json"):
+        try:
+            with open("investments_data.json", "r", encoding="utf-8") as f:
+                investments = json.load(f)
+        except:
+            investments = []
+    print(f"Investimentos carregados: {len(investments)} registros")
+    return investments
 
 # --- Gerenciamento de Dados de Votos (por Cidade/Ano) ---
-VOTOS_DATA = {}  # { 'cidade-slug': [{ ano: 2024, votos: 15000 }, ...] }
-
-def save_votos_data():
-    try:
-        with open("votos_data.json", "w", encoding="utf-8") as f:
-            json.dump(VOTOS_DATA, f, indent=2, ensure_ascii=False)
-        print(f"Votos salvos: {len(VOTOS_DATA)} cidades")
-    except Exception as e:
-        print(f"Erro ao salvar votos: {e}")
-
-# Carrega votos na inicialização
-if os.path.exists("votos_data.json"):
-    try:
-        with open("votos_data.json", "r", encoding="utf-8") as f:
-            VOTOS_DATA = json.load(f)
-        print(f"Votos carregados: {len(VOTOS_DATA)} cidades")
-    except:
-
-        VOTOS_DATA = {}
-
-# --- Reconstrução de Dados Agregados (CAMPAIGN_DATA) ---
+# { 'cidade-slug': [{ ano: 2024, votos: 15000 }, ...] }
+def write_votos_data(data):
+    if STORE:
+        STORE.replace_votos(data)
+    else:
+        write_json_atomic("votos_data.json", data, indent=2, ensure_ascii=False)
+    print(f"Votos salvos: {len(data)} cidades")
+
+def load_votos_data():
+    votos = {}
+    if STORE:
+        votos = STORE.load_votos()
+    elif os.path.exists("votos_data.json"):
+        try:
+            with open("votos_data.json", "r", encoding="utf-8") as f:
+                votos = json.load(f)
+        except:
+            votos = {}
+    print(f"Votos carregados: {len(votos)} cidades")
+    return votos
+
+# --- Estado Versionado (campanha, votos e investimentos) ---
+# Leitores pegam STATE.current uma vez por requisição (snapshot imutável, sem lock);
+# escritas montam a próxima versão e a publicam atomicamente via publish().
+STATE = VersionedState(campaign={}, votos={}, investments=[], reference=ReferenceData.empty(""))
+
+# Fila de gravação em segundo plano: snapshots são imutáveis, então o I/O roda em thread sem cópia profunda
+PERSISTENCE = WriteBehindQueue({
+    "campaign": (lambda: dict(STATE.current.campaign), write_campaign_data),
+    "investments": (lambda: list(STATE.current.investments), write_investments_data),
+    "votos": (lambda: dict(STATE.current.votos), write_votos_data),
+})
+
+def publish(build, dirty):
+    """
+    Publica a próxima versão dos dados, agenda a gravação dos datasets
+    alterados e reindexa os investimentos se eles mudaram. Quando build não
+    muda nada (devolve {}), nenhuma versão é publicada nem gravada.
+    """
+    changed = set()
+
+    def tracked(snap):
+        changes = build(snap)
+        changed.update(changes or ())
+        return changes
+
+    snapshot = STATE.update(tracked)
+    if changed:
+        for name in dirty:
+            PERSISTENCE.mark_dirty(name)
+        if "investments" in changed:
+            index_investments(snapshot)
+    return snapshot
+
+def replace_dataset(name, value):
+    """Substitui votos ou investimentos e recalcula a campanha na mesma versão."""
+    def build(snap):
+        datasets = {"votos": snap.votos, "investments": snap.investments, name: value}
+        return {name: value, "campaign": aggregate_campaign(datasets["votos"], datasets["investments"])}
+    snapshot = publish(build, [name, "campaign"])
+    print(f"Dados de campanha reconstruídos: {len(snapshot.campaign)} cidades.")
+    return snapshot
+
+# Histórico de revisões (deltas + checkpoints em SQLite) de cada versão publicada; ver history.py
+HISTORY = HistoryLog()
+
+# --- Índice de Busca Local (descrições de cidades e investimentos) ---
+RETRIEVAL = BM25Index()
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+# Fração dos termos da pergunta encontrada na base local a partir da qual a busca web é dispensada
+RETRIEVAL_SKIP_COVERAGE = float(os.getenv("RETRIEVAL_SKIP_COVERAGE", "0.66"))
+
+def index_investments(snapshot):
+    start = time.perf_counter()
+    added, removed = RETRIEVAL.sync("inv", investment_items(snapshot.investments), describe_investment,
+                                    snapshot.version)
+    if added or removed:
+        print(f"Índice local: +{added} / -{removed} investimentos em {(time.perf_counter() - start) * 1000:.0f}ms")
+
+# --- Reconstrução de Dados Agregados (campanha) ---
 def rebuild_campaign_data():
-    global CAMPAIGN_DATA
-    CAMPAIGN_DATA = {}
-    
-    # 1. Agrega Votos
-    for slug, entries in VOTOS_DATA.items():
-        if slug not in CAMPAIGN_DATA:
-            CAMPAIGN_DATA[slug] = {"votes": 0, "money": 0}
-        total = sum(e["votos"] for e in entries)
-        CAMPAIGN_DATA[slug]["votes"] = total
-        
-    # 2. Agrega Investimentos
-    for inv in INVESTMENTS_DATA:
-        slug = inv.get("cityId")
-        if not slug: continue
-        if slug not in CAMPAIGN_DATA:
-            CAMPAIGN_DATA[slug] = {"votes": 0, "money": 0}
-        
-        CAMPAIGN_DATA[slug]["money"] += inv.get("valor", 0)
-        
     # Salva para consistência externa se necessário, mas a memória é a fonte da verdade
-    save_campaign_data()
-    print(f"Dados de campanha reconstruídos: {len(CAMPAIGN_DATA)} cidades.")
-
-# Executa reconstrução inicial
-rebuild_campaign_data()
+    snapshot = publish(lambda snap: {"campaign": aggregate_campaign(snap.votos, snap.investments)}, ["campaign"])
+    print(f"Dados de campanha reconstruídos: {len(snapshot.campaign)} cidades.")
 
 # --- Dados Globais (Carregados na inialização) ---
-CITIES_DATA = {}
+# Atalhos para a carga atual dos dados de referência (STATE.current.reference); trocados juntos
+# na recarga. Código que roda fora do event loop ou guarda cache por versão usa snapshot.reference.
+CITIES_DATA = CityCatalog()
 ELECTORAL_DATA = {}
 GLOBAL_STATS = ""
-
-def load_data():
-    global CITIES_DATA, ELECTORAL_DATA, GLOBAL_STATS
-    try:
-        with open("cidades_pr.json", "r", encoding="utf-8") as f:
-            CITIES_DATA = json.load(f)
-        print(f"Dados de {len(CITIES_DATA)} cidades carregados com sucesso.")
-
-        # 1. Carregar e Agregar Dados Eleitorais Globais
-        if os.path.exists("dados_eleitorais.json"):
-            with open("dados_eleitorais.json", "r", encoding="utf-8") as f:
-                ELECTORAL_DATA = json.load(f)
-            print(f"Dados eleitorais de {len(ELECTORAL_DATA)} cidades carregados.")
-            
-            # Agregação Global Simplificada
-            total_eleitores_state = 0
-            gender_counts = {"FEMININO": 0, "MASCULINO": 0}
-            
-            for d in ELECTORAL_DATA.values():
-                total_eleitores_state += d.get("total_eleitores", 0)
-                g = d.get("genero", {})
-                gender_counts["FEMININO"] += g.get("FEMININO", 0)
-                gender_counts["MASCULINO"] += g.get("MASCULINO", 0)
-                
-            GLOBAL_STATS += f"\n**Estatísticas Eleitorais do Estado (Paraná):**\n"
-            GLOBAL_STATS += f"- Eleitorado Total: {total_eleitores_state:,}\n"
-            GLOBAL_STATS += f"- Mulheres: {gender_counts['FEMININO']:,} | Homens: {gender_counts['MASCULINO']:,}\n"
-        else:
-            ELECTORAL_DATA = {}
-        
-        # 1. Top 10 População
-        top_pop = sorted(CITIES_DATA.values(), key=lambda x: int(x.get('habitantes', 0)), reverse=True)[:10]
-        GLOBAL_STATS += "**Top 10 Cidades Mais Populosas:**\n"
-        for i, c in enumerate(top_pop, 1):
-            pop_fmt = f"{c.get('habitantes'):,}".replace(",", ".")
-            GLOBAL_STATS += f"{i}. {c.get('nome')} ({pop_fmt} hab.)\n"
+CITY_SEARCH = CitySearchIndex({})
+GEO = None  # índice geográfico (contornos do SVG + regiões do IBGE), guardado no snapshot
+REGION_ROLLUPS = {}  # (nível, versão dos dados) -> agregados por região
+# (versão dos dados, {formato: (etag, corpo, corpo gzip)}) da carga inicial; trocado inteiro, sem lock
+BOOTSTRAP_CACHE = (None, {})
+
+# Arquivos de referência e versão do formato das estruturas derivadas guardadas no snapshot
+REFERENCE_FILES = ["cidades_pr.json", "dados_eleitorais.json", SVG_PATH, REGIONS_PATH]
+REFERENCE_SNAPSHOT_VERSION = 4
+
+def build_global_stats(cities_data, electoral_data):
+    """Monta o resumo estadual usado no prompt do chat."""
+    stats = ""
+
+    # Agregação Global Simplificada
+    if electoral_data:
+        total_eleitores_state = 0
+        gender_counts = {"FEMININO": 0, "MASCULINO": 0}
         
-        # 2. Top 10 PIB per Capita
-        GLOBAL_STATS += "\n**Top 10 PIB per Capita:**\n"
-        def get_pib(c):
-            val = c.get('pib_per_capita', 0)
-            return float(val) if val else 0
+        for d in electoral_data.values():
+            total_eleitores_state += d.get("total_eleitores", 0)
+            g = d.get("genero", {})
+            gender_counts["FEMININO"] += g.get("FEMININO", 0)
+            gender_counts["MASCULINO"] += g.get("MASCULINO", 0)
             
-        top_pib = sorted(CITIES_DATA.values(), key=get_pib, reverse=True)[:10]
-        for i, c in enumerate(top_pib, 1):
-            pib_val = get_pib(c)
-            GLOBAL_STATS += f"{i}. {c.get('nome')} (R$ {pib_val:,.2f})\n"
-
-        # 3. Top 10 Área
-        GLOBAL_STATS += "\n**Top 10 Maior Área:**\n"
-        top_area = sorted(CITIES_DATA.values(), key=lambda x: float(str(x.get('area_km2', 0)).replace(',', '.')), reverse=True)[:10]
-        for i, c in enumerate(top_area, 1):
-            GLOBAL_STATS += f"{i}. {c.get('nome')} ({c.get('area_km2')} km²)\n"
-
-        # 4. Estatísticas de Partidos (Top 10)
-        party_counts = {}
-        for c in CITIES_DATA.values():
-            p = c.get('partido', 'Outros')
-            party_counts[p] = party_counts.get(p, 0) + 1
-        
-        sorted_parties = sorted(party_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-        GLOBAL_STATS += "\n**Top 10 Partidos com Mais Prefeitos:**\n"
-        for i, (partido, count) in enumerate(sorted_parties, 1):
-            GLOBAL_STATS += f"{i}. {partido}: {count} cidades\n"
+        stats += f"\n**Estatísticas Eleitorais do Estado (Paraná):**\n"
+        stats += f"- Eleitorado Total: {total_eleitores_state:,}\n"
+        stats += f"- Mulheres: {gender_counts['FEMININO']:,} | Homens: {gender_counts['MASCULINO']:,}\n"
+    
+    # 1. Top 10 População (rankings já calculados no catálogo)
+    stats += "**Top 10 Cidades Mais Populosas:**\n"
+    for i, c in enumerate(cities_data.top("habitantes"), 1):
+        pop_fmt = f"{c.habitantes:,}".replace(",", ".")
+        stats += f"{i}. {c.nome} ({pop_fmt} hab.)\n"
+    
+    # 2. Top 10 PIB per Capita
+    stats += "\n**Top 10 PIB per Capita:**\n"
+    for i, c in enumerate(cities_data.top("pib_per_capita"), 1):
+        stats += f"{i}. {c.nome} (R$ {c.pib_per_capita:,.2f})\n"
+
+    # 3. Top 10 Área
+    stats += "\n**Top 10 Maior Área:**\n"
+    for i, c in enumerate(cities_data.top("area_km2"), 1):
+        stats += f"{i}. {c.nome} ({c.area_km2} km²)\n"
+
+    # 4. Estatísticas de Partidos (Top 10)
+    sorted_parties = cities_data.party_counts[:10]
+    stats += "\n**Top 10 Partidos com Mais Prefeitos:**\n"
+    for i, (partido, count) in enumerate(sorted_parties, 1):
+        stats += f"{i}. {partido}: {count} cidades\n"
+
+    stats += f"\n**Total de Cidades no Banco de Dados:** {len(cities_data)}\n"
+    return stats
+
+def build_reference_data():
+    """Lê os arquivos de referência e monta as estruturas derivadas (conteúdo do snapshot)."""
+    with open("cidades_pr.json", "r", encoding="utf-8") as f:
+        cities_data = CityCatalog.from_raw(json.load(f))
+
+    # 1. Carregar e Agregar Dados Eleitorais Globais
+    electoral_data = {}
+    if os.path.exists("dados_eleitorais.json"):
+        with open("dados_eleitorais.json", "r", encoding="utf-8") as f:
+            electoral_data = json.load(f)
+
+    geo = None
+    if os.path.exists(SVG_PATH):
+        from geo import GeoIndex, load_regions
+        geo = GeoIndex.build(cities_data, SVG_PATH, load_regions())
+
+    return {
+        "cities": cities_data,
+        "electoral": electoral_data,
+        "global_stats": build_global_stats(cities_data, electoral_data),
+        "geo": geo,
+    }
+
+def prepare_reference(digests=None):
+    """Monta uma carga nova dos dados de referência (parse + índices), sem tocar na atual. Devolve (carga, tempos)."""
+    timings = {}
+    start = time.perf_counter()
+    digests = digests or source_digests(REFERENCE_FILES)
+    data, cached = load_or_build(REFERENCE_FILES, build_reference_data, REFERENCE_SNAPSHOT_VERSION, digests=digests)
+    metrics.record_cache("startup_snapshot", cached)
+    timings["parse"] = time.perf_counter() - start
+    start = time.perf_counter()
+    reference = ReferenceData.from_build(data, digests)
+    timings["index"] = time.perf_counter() - start
+    origem = "snapshot" if cached else "arquivos JSON"
+    print(f"Dados de {len(reference.cities)} cidades e dados eleitorais de {len(reference.electoral)} cidades "
+          f"carregados ({origem}).")
+    return reference, timings
+
+def install_reference(reference):
+    """
+    Publica a carga: uma versão nova do estado (requisições em andamento ficam
+    com o snapshot anterior) e os atalhos globais apontando para ela.
+    """
+    global CITIES_DATA, ELECTORAL_DATA, GLOBAL_STATS, CITY_SEARCH, GEO, BOOTSTRAP_CACHE
+
+    def build(snap):
+        global CITIES_DATA, ELECTORAL_DATA, GLOBAL_STATS, CITY_SEARCH, GEO
+        # Sob o lock de escrita do estado: atalhos e snapshot mudam juntos
+        CITIES_DATA, ELECTORAL_DATA, GLOBAL_STATS = reference.cities, reference.electoral, reference.global_stats
+        CITY_SEARCH, GEO = reference.city_search, reference.geo
+        return {"reference": reference}
 
-        GLOBAL_STATS += f"\n**Total de Cidades no Banco de Dados:** {len(CITIES_DATA)}\n"
+    snapshot = STATE.update(build)
+    REGION_ROLLUPS.clear()
+    BOOTSTRAP_CACHE = (None, {})
+    return snapshot
 
+def load_data():
+    try:
+        reference, _ = prepare_reference()
     except Exception as e:
         print(f"Erro ao carregar ou processar dados: {e}")
-        GLOBAL_STATS = "Dados globais indisponíveis no momento."
+        reference = ReferenceData.empty("Dados globais indisponíveis no momento.")
+    install_reference(reference)
+
+# --- Recarga dos Dados de Referência (sem reiniciar) ---
+# Intervalo (s) da verificação de mudança nos arquivos de referência; 0 desliga (só POST /api/admin/reload)
+REFERENCE_WATCH_INTERVAL = float(os.getenv("REFERENCE_WATCH_INTERVAL", "10"))
+RELOAD_LOCK = asyncio.Lock()
+LAST_RELOAD = {}
 
-# Inicializa os dados
-load_data()
+async def reload_reference(force=False):
+    """
+    Relê os arquivos de referência em thread (o event loop segue atendendo com
+    a carga atual) e troca tudo de uma vez. Sem mudança nos hashes dos
+    arquivos, não faz nada (a menos que `force`). Devolve o relatório de tempos.
+    """
+    global LAST_RELOAD
+    async with RELOAD_LOCK:
+        start = time.perf_counter()
+        digests = await asyncio.to_thread(source_digests, REFERENCE_FILES)
+        if not force and digests == STATE.current.reference.digests:
+            return {"reloaded": False, "reason": "arquivos sem alteração", "version": STATE.version}
+        reference, timings = await asyncio.to_thread(prepare_reference, digests)
+        # Busca local das descrições das cidades: só as cidades novas/alteradas são reindexadas
+        step = time.perf_counter()
+        await asyncio.to_thread(RETRIEVAL.sync, "city", city_items(reference.cities), describe_city)
+        timings["retrieval"] = time.perf_counter() - step
+        step = time.perf_counter()
+        snapshot = install_reference(reference)
+        timings["swap"] = time.perf_counter() - step
+        timings["total"] = time.perf_counter() - start
+        for name, seconds in timings.items():
+            metrics.REFERENCE_RELOAD_SECONDS.observe(seconds, step=name)
+        LAST_RELOAD = {
+            "reloaded": True,
+            "version": snapshot.version,
+            "cities": len(reference.cities),
+            "electoral": len(reference.electoral),
+            "timings_ms": {name: round(seconds * 1000, 1) for name, seconds in timings.items()},
+        }
+        print(f"Dados de referência recarregados (versão {snapshot.version}) em {LAST_RELOAD['timings_ms']['total']}ms")
+        return LAST_RELOAD
+
+async def watch_reference_files():
+    watcher = ReferenceWatcher(REFERENCE_FILES)
+    while True:
+        await asyncio.sleep(REFERENCE_WATCH_INTERVAL)
+        try:
+            if await asyncio.to_thread(watcher.poll):
+                await reload_reference()
+        except Exception as e:
+            # Arquivo inválido (ex.: JSON truncado): a carga atual continua no ar
+            print(f"Erro ao recarregar dados de referência: {e}")
+
+@app.post("/api/admin/reload", dependencies=[Depends(require_admin)])
+async def admin_reload(force: bool = False):
+    """Recarrega cidades_pr.json, dados_eleitorais.json, mapa e regiões sem reiniciar o servidor."""
+    try:
+        return await reload_reference(force)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Dados de referência inválidos (carga atual mantida): {e}")
+
+@app.get("/api/admin/reload", dependencies=[Depends(require_admin)])
+async def admin_reload_status():
+    """Versão dos dados e relatório da última recarga."""
+    reference = STATE.current.reference
+    return {"version": STATE.version, "loaded_at": reference.loaded_at, "digests": reference.digests,
+            "last_reload": LAST_RELOAD}
+
+def load_all():
+    """Carrega dados de referência, votos e investimentos e reconstrói a campanha."""
+    start = time.perf_counter()
+    open_store()
+    load_data()
+    STATE.update(lambda snap: {"votos": load_votos_data(), "investments": load_investments_data()})
+    rebuild_campaign_data()
+    RETRIEVAL.sync("city", city_items(CITIES_DATA), describe_city)
+    index_investments(STATE.current)
+    print(f"Dados prontos em {(time.perf_counter() - start) * 1000:.0f}ms")
 
 # --- Novos Endpoints ---
 
@@ -222,9 +441,73 @@ load_data()
 async def login(credentials: LoginRequest):
     return {"success": True, "token": "admin-token-secure"}
 
+# --- Formato das respostas (JSON ou MessagePack/CBOR pelo Accept; ver negotiation.py) ---
+def respond(request: Request, payload, to_columns=None):
+    """
+    Responde no formato pedido em Accept. Em formato binário (ou com
+    ?layout=columns) as listas saem em colunas via `to_columns(payload)`.
+    """
+    media = negotiate(request.headers.get("accept"))
+    layout = request.query_params.get("layout") or ("columns" if media else "rows")
+    if layout not in LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Layout inválido (use {' ou '.join(LAYOUTS)}).")
+    if layout == "columns" and to_columns:
+        payload = to_columns(payload)
+    if media is None:
+        return payload
+    return Response(encode(payload, media), media_type=media, headers={"Vary": "Accept"})
+
+def campaign_columns(campaign):
+    return columns([{"id": slug, **values} for slug, values in campaign.items()], ("id", "votes", "money"))
+
+def votos_columns(payload):
+    rows = [{"city": slug, "ano": e.get("ano"), "votos": e.get("votos")}
+            for slug, entries in payload["votos"].items() for e in entries]
+    return {"votos": columns(rows, ("city", "ano", "votos")), "count": payload["count"]}
+
+def investments_columns(payload):
+    return {"investments": columns(payload["investments"], INVESTMENT_FIELDS), "count": payload["count"]}
+
 @app.get("/api/campaign/data")
-async def get_campaign_data():
-    return CAMPAIGN_DATA
+async def get_campaign_data(request: Request):
+    return respond(request, dict(STATE.current.campaign), campaign_columns)
+
+def bootstrap_payload(snapshot, media=JSON):
+    """(etag, corpo, corpo gzip) da carga inicial em cada formato, montados uma vez por versão dos dados."""
+    global BOOTSTRAP_CACHE
+    version, entries = BOOTSTRAP_CACHE
+    cached = entries.get(media) if version == snapshot.version else None
+    if cached is None:
+        from bootstrap import build_bootstrap
+        reference = snapshot.reference
+        payload = build_bootstrap(reference.cities, reference.electoral_by_city, snapshot.campaign, snapshot.version)
+        if media == JSON:
+            body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        else:
+            body = encode(payload, media)  # o payload já é colunar
+        etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        cached = (etag, body, gzip.compress(body, compresslevel=6))
+        # Só a versão atual interessa; uma requisição atrasada não sobrescreve uma versão mais nova
+        version, entries = BOOTSTRAP_CACHE
+        if version == snapshot.version:
+            BOOTSTRAP_CACHE = (version, {**entries, media: cached})
+        elif version is None or version < snapshot.version:
+            BOOTSTRAP_CACHE = (snapshot.version, {media: cached})
+    return cached
+
+@app.get("/api/bootstrap")
+async def bootstrap(request: Request):
+    """Cidades, métricas de campanha e quebras do coroplético numa única resposta (versionada e comprimida)."""
+    snapshot = STATE.current
+    media = negotiate(request.headers.get("accept")) or JSON
+    with metrics.stage("bootstrap_payload", metrics.ENDPOINT_STAGE_SECONDS):
+        etag, body, compressed = await asyncio.to_thread(bootstrap_payload, snapshot, media)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(compressed, media_type=media, headers={**headers, "Content-Encoding": "gzip"})
+    return Response(body, media_type=media, headers=headers)
 
 @app.get("/api/status")
 async def api_status():
@@ -232,46 +515,206 @@ async def api_status():
     return {"status": "online", "message": "Servidor do Mapa Paraná operando!"}
 
 @app.get("/api/cities")
-async def get_cities_list():
+async def get_cities_list(request: Request):
     """Retorna lista simplificada de cidades para o App (Dropdown/Busca)."""
-    # Retorna lista para facilitar iteração no React Native
-    simple_list = []
-    for slug, data in CITIES_DATA.items():
-        simple_list.append({
-            "id": slug,
-            "nome": data.get("nome"),
-            "habitantes": data.get("habitantes"),
-            "partido": data.get("partido")
+    if negotiate(request.headers.get("accept")) or request.query_params.get("layout"):
+        return respond(request, list(CITIES_DATA.summary), columns)
+    # Lista ordenada por nome, montada e serializada uma vez na carga dos dados
+    return Response(CITIES_DATA.summary_json, media_type="application/json")
+
+@app.get("/api/search")
+async def search_cities(q: str = "", limit: int = Query(10, ge=1, le=SEARCH_MAX_LIMIT), offset: int = Query(0, ge=0)):
+    """Autocomplete de cidades por nome, prefeito, partido ou gentílico (sem acento e tolerante a erros)."""
+    total, results = CITY_SEARCH.search(q, limit=limit, offset=offset)
+    return {"query": q, "total": total, "offset": offset, "results": results}
+
+def get_similarity(reference=None):
+    """Motor de cidades semelhantes de uma carga dos dados de referência (import do NumPy adiado)."""
+    reference = reference or STATE.current.reference
+    engine = reference.similarity
+    if engine is None:
+        from similarity import SimilarityEngine
+        engine = reference.similarity = SimilarityEngine(reference.cities, reference.electoral_by_city)
+    return engine
+
+def check_similarity_params(k: int, metric: str):
+    from similarity import METRICS
+    if metric not in METRICS:
+        raise HTTPException(status_code=400, detail=f"Métrica inválida (use {' ou '.join(METRICS)}).")
+    if not 1 <= k <= 50:
+        raise HTTPException(status_code=400, detail="k deve estar entre 1 e 50.")
+
+@app.get("/api/cities/similar")
+async def similar_cities_batch(k: int = 5, metric: str = "cosine", cities: Optional[str] = None):
+    """Vizinhos mais próximos de todas as cidades (ou das listadas em `cities`, separadas por vírgula)."""
+    check_similarity_params(k, metric)
+    slugs = [s.strip() for s in cities.split(",") if s.strip()] if cities else None
+    unknown = [s for s in slugs or () if s not in CITIES_DATA]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Cidades não encontradas: {', '.join(unknown)}")
+    engine = get_similarity()
+    if not slugs:
+        return Response(engine.all_similar_json(k, metric), media_type="application/json")
+    return {"metric": metric, "k": k, "similar": engine.all_similar(k, metric, slugs)}
+
+@app.get("/api/cities/{slug}/similar")
+async def similar_cities(slug: str, k: int = 10, metric: str = "cosine"):
+    """Cidades mais parecidas em população, economia e perfil do eleitorado."""
+    check_similarity_params(k, metric)
+    if slug not in CITIES_DATA:
+        raise HTTPException(status_code=404, detail="Cidade não encontrada.")
+    from similarity import FEATURE_NAMES
+    return {"city": slug, "metric": metric, "features": FEATURE_NAMES,
+            "similar": get_similarity().similar(slug, k, metric)}
+
+def get_geo(reference=None):
+    geo = (reference or STATE.current.reference).geo
+    if geo is None:
+        raise HTTPException(status_code=503, detail="Índice geográfico indisponível (mapa_pr.svg não encontrado).")
+    return geo
+
+@app.get("/api/cities/{slug}/neighbors")
+async def city_neighbors(slug: str, depth: int = 1):
+    """Municípios vizinhos (fronteira compartilhada) até `depth` fronteiras de distância."""
+    geo = get_geo()
+    if slug not in geo:
+        raise HTTPException(status_code=404, detail="Cidade não encontrada.")
+    if not 1 <= depth <= 5:
+        raise HTTPException(status_code=400, detail="depth deve estar entre 1 e 5.")
+    distances = geo.distances_km(geo.position[slug])
+    neighbors = []
+    for j, ring, border in geo.rings(slug, depth):
+        other = geo.slugs[j]
+        entry = {"id": other, "nome": CITIES_DATA.get(other, {}).get("nome"), "anel": ring,
+                 "distancia_km": round(float(distances[j]), 1)}
+        if border is not None:
+            entry["fronteira_km"] = round(border, 1)
+        neighbors.append(entry)
+    return {"city": slug, "depth": depth,
+            "regioes": {level: geo.region_of(slug, level) for level in REGION_LEVELS},
+            "neighbors": neighbors}
+
+def region_rollup(level, snapshot):
+    """Agregados por região para a versão dos dados (somas vetorizadas sobre os arrays do índice)."""
+    key = (level, snapshot.version)
+    rows = REGION_ROLLUPS.get(key)
+    if rows is None:
+        import numpy as np
+        reference = snapshot.reference
+        geo = get_geo(reference)
+
+        def column(values):
+            return np.array([values(slug) or 0 for slug in geo.slugs], dtype=np.float64)
+
+        def number(slug, field):
+            value = reference.cities.get(slug, {}).get(field)
+            return value if isinstance(value, (int, float)) else 0
+
+        rows = geo.rollup(level, {
+            "habitantes": column(lambda s: number(s, "habitantes")),
+            "area_km2": column(lambda s: number(s, "area_km2")),
+            "eleitores": column(lambda s: reference.electoral_by_city.get(s, {}).get("total_eleitores")),
+            "votos": column(lambda s: snapshot.campaign.get(s, {}).get("votes")),
+            "investimento": column(lambda s: snapshot.campaign.get(s, {}).get("money")),
         })
-    # Ordena por nome
-    simple_list.sort(key=lambda x: x["nome"])
-    return simple_list
+        codes = geo.regions[level][0]
+        for code, row in enumerate(rows):
+            row["municipios"] = [geo.slugs[i] for i in np.flatnonzero(codes == code)]
+        for stale in [k for k in REGION_ROLLUPS if k[0] == level]:
+            del REGION_ROLLUPS[stale]
+        REGION_ROLLUPS[key] = rows
+    return rows
+
+@app.get("/api/regions")
+async def regions(level: str = "mesorregiao"):
+    """Meso ou microrregiões do IBGE com totais de população, eleitorado, votos e investimentos."""
+    if level not in REGION_LEVELS:
+        raise HTTPException(status_code=400, detail=f"Nível inválido (use {' ou '.join(REGION_LEVELS)}).")
+    snapshot = STATE.current
+    if level not in get_geo(snapshot.reference).regions:
+        raise HTTPException(status_code=503, detail="Regiões do IBGE indisponíveis: rode download_ibge_regioes.py.")
+    return {"level": level, "version": snapshot.version, "regions": region_rollup(level, snapshot)}
+
+# --- Cruzamentos do Perfil do Eleitorado (cubo em disco, ver voter_cube.py) ---
+VOTER_CUBE = (None, None)  # (mtime de dims.json, cubo aberto)
+_VOTER_CUBE_LOCK = threading.Lock()
+
+def get_voter_cube():
+    """Cubo aberto com mmap; reaberto quando o ETL grava uma versão nova."""
+    global VOTER_CUBE
+    from voter_cube import CUBE_DIR, VoterCube
+    try:
+        mtime = os.path.getmtime(os.path.join(CUBE_DIR, "dims.json"))
+    except OSError:
+        raise HTTPException(status_code=503, detail="Cubo do perfil do eleitorado indisponível: rode download_tse_data.py.")
+    with _VOTER_CUBE_LOCK:
+        loaded_mtime, cube = VOTER_CUBE
+        if cube is None or loaded_mtime != mtime:
+            cube = VoterCube(CUBE_DIR)
+            VOTER_CUBE = (mtime, cube)
+    return cube
+
+def split_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()] if value else []
+
+@app.get("/api/perfil/cube")
+async def voter_cube_info():
+    """Dimensões do cubo do perfil do eleitorado e os valores de cada uma."""
+    cube = await asyncio.to_thread(get_voter_cube)  # abrir o cubo lê dims.json e mapeia os arrays
+    return cube.describe()
+
+@app.get("/api/perfil/crosstab")
+async def voter_crosstab(request: Request, cities: Optional[str] = None, group_by: Optional[str] = None,
+                         idade: Optional[str] = None):
+    """
+    Cruzamento do perfil do eleitorado em uma ou várias cidades. Filtros por
+    dimensão na query (ex.: genero=feminino&grau_instrucao=superior&idade=25-34),
+    valores separados por vírgula; group_by lista dimensões (incluindo municipio).
+    """
+    cube = await asyncio.to_thread(get_voter_cube)
+    from voter_cube import CubeQueryError
+    filters = {dim: split_list(request.query_params.get(dim)) for dim in cube.dims if dim in request.query_params}
+    ages = None
+    if idade:
+        low, _, high = idade.partition("-")
+        try:
+            ages = (int(low), int(high) if high else 200)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="idade deve ser um intervalo como 25-34 ou 60-.")
+    try:
+        with metrics.stage("voter_crosstab", metrics.ENDPOINT_STAGE_SECONDS):
+            # A soma sobre o cubo em mmap é CPU e E/S: fora do event loop
+            result = await asyncio.to_thread(cube.crosstab, split_list(cities) or None, filters,
+                                             split_list(group_by), ages)
+    except CubeQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return respond(request, {"filters": filters, "idade": idade, **result},
+                   lambda p: {**p, "groups": columns(p["groups"])})
 
 @app.post("/api/campaign/update")
 async def update_campaign(data: CampaignUpdate):
     slug = data.city_slug
-    if slug not in CAMPAIGN_DATA:
-        CAMPAIGN_DATA[slug] = {}
-    
-    CAMPAIGN_DATA[slug]["votes"] = data.votes
-    CAMPAIGN_DATA[slug]["money"] = data.money
-    
-    save_campaign_data()
-    return {"success": True, "data": CAMPAIGN_DATA[slug]}
+
+    def build(snap):
+        campaign = dict(snap.campaign)
+        campaign[slug] = {**campaign.get(slug, {}), "votes": data.votes, "money": data.money}
+        return {"campaign": campaign}
+
+    snapshot = publish(build, ["campaign"])
+    return {"success": True, "data": snapshot.campaign[slug]}
 
 @app.post("/api/campaign/update_bulk")
 async def update_campaign_bulk(data: CampaignBulkUpdate):
-    count = 0
-    for item in data.items:
-        slug = item.city_slug
-        if slug not in CAMPAIGN_DATA:
-            CAMPAIGN_DATA[slug] = {}
-        CAMPAIGN_DATA[slug]["votes"] = item.votes
-        CAMPAIGN_DATA[slug]["money"] = item.money
-        count += 1
-    
-    save_campaign_data()
-    return {"success": True, "updates": count}
+    def build(snap):
+        campaign = dict(snap.campaign)
+        for item in data.items:
+            slug = item.city_slug
+            campaign[slug] = {**campaign.get(slug, {}), "votes": item.votes, "money": item.money}
+        return {"campaign": campaign}
+
+    # O lote inteiro vira uma única versão e uma única gravação (uma transação no SQLite)
+    publish(build, ["campaign"])
+    return {"success": True, "updates": len(data.items)}
 
 # --- Endpoints de Investimentos ---
 
@@ -288,18 +731,45 @@ class InvestmentsUpdate(BaseModel):
     investments: List[InvestmentItem]
 
 @app.get("/api/investments/data")
-async def get_investments_data():
-    """Retorna todos os investimentos salvos."""
-    return {"investments": INVESTMENTS_DATA, "count": len(INVESTMENTS_DATA)}
+async def get_investments_data(request: Request, city: Optional[str] = None, ano: Optional[int] = None,
+                               area: Optional[str] = None):
+    """Retorna os investimentos salvos (opcionalmente filtrados por cidade, ano e área)."""
+    investments = STATE.current.investments
+    if city is None and ano is None and area is None:
+        return respond(request, {"investments": list(investments), "count": len(investments)}, investments_columns)
+
+    # Filtra o snapshot publicado (o banco só alcança o estado quando a fila de gravação esvazia)
+    items = [
+        inv for inv in investments
+        if (city is None or inv.get("cityId") == city)
+        and (ano is None or inv.get("ano") == ano)
+        and (area is None or inv.get("area") == area)
+    ]
+    return respond(request, {"investments": items, "count": len(items)}, investments_columns)
 
 @app.post("/api/investments/save")
 async def save_investments(data: InvestmentsUpdate):
     """Salva/sobrescreve todos os investimentos."""
-    global INVESTMENTS_DATA
-    INVESTMENTS_DATA = [inv.dict() for inv in data.investments]
-    save_investments_data()
-    rebuild_campaign_data() # Atualiza agregados
-    return {"success": True, "count": len(INVESTMENTS_DATA)}
+    snapshot = replace_dataset("investments", [inv.dict() for inv in data.investments]) # Atualiza agregados
+    return {"success": True, "count": len(snapshot.investments)}
+
+# Índice hash das chaves naturais dos investimentos publicados (usado pelo merge, sob o lock de escrita)
+INVESTMENT_INDEX = InvestmentIndex()
+
+@app.post("/api/investments/merge")
+async def merge_investments(data: InvestmentsUpdate):
+    """Importação incremental: upsert pela chave natural (cidade, ano, tipo, descrição, valor), sem duplicar."""
+    counts = {}
+
+    def build(snap):
+        merged, stats = INVESTMENT_INDEX.merge(snap.investments, [inv.dict() for inv in data.investments])
+        counts.update(stats)
+        if not stats["inserted"] and not stats["updated"]:
+            return {}
+        return {"investments": merged, "campaign": aggregate_campaign(snap.votos, merged)}
+
+    snapshot = publish(build, ["investments", "campaign"])
+    return {"success": True, "count": len(snapshot.investments), **counts}
 
 # --- Endpoints de Votos (por Cidade/Ano) ---
 
@@ -307,38 +777,108 @@ class VotosUpdate(BaseModel):
     votos: dict  # { 'cidade-slug': [{ ano: int, votos: int }, ...] }
 
 @app.get("/api/votos/data")
-async def get_votos_data():
-    """Retorna todos os votos salvos por cidade/ano."""
-    return {"votos": VOTOS_DATA, "count": len(VOTOS_DATA)}
+async def get_votos_data(request: Request, city: Optional[str] = None, ano: Optional[int] = None):
+    """Retorna os votos salvos por cidade/ano (opcionalmente filtrados)."""
+    votos_data = STATE.current.votos
+    if city is None and ano is None:
+        return respond(request, {"votos": dict(votos_data), "count": len(votos_data)}, votos_columns)
+
+    # Mesmo motivo dos investimentos: o snapshot é a fonte, não o banco
+    selected_cities = votos_data.items() if city is None else [(city, votos_data.get(city, ()))]
+    votos = {}
+    for slug, entries in selected_cities:
+        selected = [e for e in entries if ano is None or e.get("ano") == ano]
+        if selected:
+            votos[slug] = selected
+    return respond(request, {"votos": votos, "count": len(votos)}, votos_columns)
 
 @app.post("/api/votos/save")
 async def save_votos(data: VotosUpdate):
     """Salva/sobrescreve todos os votos."""
-    global VOTOS_DATA
-    VOTOS_DATA = data.votos
-    save_votos_data()
-    rebuild_campaign_data() # Atualiza agregados
-    return {"success": True, "count": len(VOTOS_DATA)}
+    snapshot = replace_dataset("votos", data.votos) # Atualiza agregados
+    return {"success": True, "count": len(snapshot.votos)}
+
+@app.post("/api/votos/merge")
+async def merge_votos_endpoint(data: VotosUpdate):
+    """Mescla votos por cidade/ano (ex.: importação do TSE): substitui só os anos enviados."""
+    counts = {}
+
+    def build(snap):
+        merged, stats = merge_votos(snap.votos, data.votos)
+        counts.update(stats)
+        return {"votos": merged, "campaign": aggregate_campaign(merged, snap.investments)}
+
+    try:
+        snapshot = publish(build, ["votos", "campaign"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Votos inválidos: {e}")
+    return {"success": True, "count": len(snapshot.votos), **counts}
+
+# --- Histórico e consultas no tempo (ver history.py) ---
+HISTORY_VIEWS = {
+    "votos": (lambda votos: {"votos": votos, "count": len(votos)}, votos_columns),
+    "investments": (lambda investments: {"investments": investments, "count": len(investments)}, investments_columns),
+    "campaign": (lambda campaign: campaign, campaign_columns),
+}
+
+def check_history_dataset(dataset):
+    if dataset not in HISTORY_DATASETS:
+        raise HTTPException(status_code=404, detail=f"Dataset sem histórico (use {', '.join(HISTORY_DATASETS)}).")
+
+async def run_history(query, *args):
+    """Consulta ao histórico em thread, depois de gravadas as versões já publicadas; 404 para revisão inexistente."""
+    def run():
+        HISTORY.sync()
+        return query(*args)
+    try:
+        with metrics.stage("history_reconstruct", metrics.ENDPOINT_STAGE_SECONDS):
+            return await asyncio.to_thread(run)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Revisão {e.args[0]} não encontrada no histórico.")
+
+@app.get("/api/history")
+async def history_list(limit: int = 50, before: Optional[int] = None):
+    """Revisões mais recentes primeiro (o que mudou em cada uma e quanto ocupou), com os totais do histórico."""
+    def load():
+        HISTORY.sync()
+        return {"revisions": HISTORY.revisions(limit=max(1, min(limit, 500)), before=before), "totals": HISTORY.totals()}
+    return await asyncio.to_thread(load)
+
+@app.get("/api/history/diff")
+async def history_diff(dataset: str, start: int = Query(..., alias="from"), end: int = Query(..., alias="to")):
+    """Diferença líquida de um dataset entre duas revisões."""
+    check_history_dataset(dataset)
+    return {"dataset": dataset, "from": start, "to": end, **await run_history(HISTORY.diff, dataset, start, end)}
+
+@app.get("/api/history/{revision}/{dataset}")
+async def history_dataset(request: Request, revision: int, dataset: str):
+    """Votos, investimentos ou campanha como estavam numa revisão (mesmo formato dos endpoints /data)."""
+    check_history_dataset(dataset)
+    value = await run_history(HISTORY.state_at, dataset, revision)
+    wrap, to_columns = HISTORY_VIEWS[dataset]
+    return respond(request, wrap(value), to_columns)
+
+@app.post("/api/history/{revision}/restore", dependencies=[Depends(require_admin)])
+async def history_restore(revision: int):
+    """Volta votos, investimentos e campanha ao estado de uma revisão (a restauração vira uma nova revisão)."""
+    states = {name: await run_history(HISTORY.state_at, name, revision) for name in HISTORY_DATASETS}
+    publish(lambda snap: states, list(states))
+    print(f"Dados restaurados para a revisão {revision}.")
+    return {"success": True, "revision": revision, **{name: len(value) for name, value in states.items()}}
 
 # --- DELETE Endpoints ---
 
 @app.delete("/api/investments")
 async def delete_investments():
     """Deleta todos os investimentos."""
-    global INVESTMENTS_DATA
-    INVESTMENTS_DATA = []
-    save_investments_data()
-    rebuild_campaign_data()  # Atualiza agregados
+    replace_dataset("investments", [])  # Atualiza agregados
     print("Todos os investimentos foram deletados.")
     return {"success": True, "message": "Investimentos deletados com sucesso"}
 
 @app.delete("/api/votos")
 async def delete_votos():
     """Deleta todos os votos."""
-    global VOTOS_DATA
-    VOTOS_DATA = {}
-    save_votos_data()
-    rebuild_campaign_data()  # Atualiza agregados
+    replace_dataset("votos", {})  # Atualiza agregados
     print("Todos os votos foram deletados.")
     return {"success": True, "message": "Votos deletados com sucesso"}
 
@@ -357,6 +897,7 @@ class ExportRequest(BaseModel):
 
 @app.post("/api/export_excel")
 async def export_excel(data: ExportRequest):
+    from openpyxl import Workbook  # import tardio: só usado na exportação
     wb = Workbook()
     ws = wb.active
     ws.title = "Resumo Campanha"
@@ -398,12 +939,221 @@ async def export_excel(data: ExportRequest):
     # Retorna a URL direta para download
     return {"success": True, "download_url": f"/{filename}"}
 
+# --- Dossiês por município (ver dossier.py) ---
+DOSSIER_INPUTS = (None, {}, {})  # (versão dos dados, {slug: entradas}, {(slug, formato): chave})
+_DOSSIER_INPUTS_LOCK = threading.Lock()
+
+def select_dossier_cities(snapshot, cities=None, partido=None):
+    """Slugs pedidos (todos, por padrão), opcionalmente só os do partido; KeyError com os desconhecidos."""
+    catalog = snapshot.reference.cities
+    slugs = list(cities) if cities else list(catalog)
+    unknown = [slug for slug in slugs if slug not in catalog]
+    if unknown:
+        raise KeyError(f"Cidades não encontradas: {', '.join(unknown)}")
+    if partido:
+        partido = partido.strip().upper()
+        slugs = [slug for slug in slugs if (catalog[slug].partido or "").upper() == partido]
+    return slugs
+
+def dossier_jobs(snapshot, slugs, fmt):
+    """[(slug, chave, entradas)] das cidades; entradas e chaves montadas uma vez por versão dos dados."""
+    global DOSSIER_INPUTS
+    import dossier
+    # Sob o lock: lotes concorrentes montam as entradas uma vez só e não se atropelam nas chaves
+    with _DOSSIER_INPUTS_LOCK:
+        version, inputs, keys = DOSSIER_INPUTS
+        if version != snapshot.version:
+            reference = snapshot.reference
+            investments = dossier.group_investments(snapshot.investments)
+            inputs = {
+                slug: dossier.city_inputs(city, reference.electoral_by_city.get(slug),
+                                          snapshot.campaign.get(slug), snapshot.votos.get(slug), investments.get(slug))
+                for slug, city in reference.cities.items()
+            }
+            keys = {}
+            if version is None or version < snapshot.version:  # um lote atrasado não derruba a versão nova
+                DOSSIER_INPUTS = (snapshot.version, inputs, keys)
+        jobs = []
+        for slug in slugs:
+            key = keys.get((slug, fmt))
+            if key is None:
+                key = keys[slug, fmt] = dossier.dossier_key(inputs[slug], fmt)
+            jobs.append((slug, key, inputs[slug]))
+    return jobs
+
+DOSSIER_MEDIA = {"html": "text/html; charset=utf-8",
+                 "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+
+def dossier_batch(snapshot, slugs, fmt):
+    """Lote dos dossiês, com o mesmo snapshot em que os slugs foram validados."""
+    import dossier
+    if fmt not in dossier.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido (use {' ou '.join(dossier.FORMATS)}).")
+    return dossier.DossierBatch(dossier_jobs(snapshot, slugs, fmt), fmt)
+
+@app.get("/api/dossiers")
+async def dossiers_zip(cities: Optional[str] = None, partido: Optional[str] = None, format: str = "html"):
+    """ZIP com o dossiê de cada cidade pedida (todas por padrão); só as cidades com dados alterados são regeradas."""
+    from dossier import iter_zip
+    snapshot = STATE.current  # uma recarga no meio do caminho não invalida os slugs já validados
+    try:
+        slugs = select_dossier_cities(snapshot, split_list(cities), partido)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    with metrics.stage("dossier_inputs", metrics.ENDPOINT_STAGE_SECONDS):
+        batch = await asyncio.to_thread(dossier_batch, snapshot, slugs, format)
+    print(f"Dossiês ({format}): {len(slugs)} cidades, {len(batch.cached)} em cache, {len(batch.pending)} a gerar")
+    headers = {"Content-Disposition": f'attachment; filename="dossies_{format}.zip"',
+               "X-Dossiers-Cached": str(len(batch.cached)), "X-Dossiers-Rendered": str(len(batch.pending))}
+    # Gerador síncrono: o Starlette o consome numa thread, fora do event loop
+    return StreamingResponse(iter_zip(batch.results(), format, batch.render), media_type="application/zip",
+                             headers=headers)
+
+@app.get("/api/cities/{slug}/dossier")
+async def city_dossier(slug: str, format: str = "html"):
+    """Dossiê de uma cidade (do cache, se os dados dela não mudaram)."""
+    snapshot = STATE.current
+    try:
+        select_dossier_cities(snapshot, [slug])
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    batch = await asyncio.to_thread(dossier_batch, snapshot, [slug], format)
+    _, path = (await asyncio.to_thread(batch.run))[0]
+    try:
+        with open(path, "rb") as f:
+            body = f.read()
+    except FileNotFoundError:  # substituído por uma versão mais nova no meio do caminho
+        body = await asyncio.to_thread(batch.render, slug)
+    disposition = "inline" if format == "html" else f'attachment; filename="{slug}.{format}"'
+    return Response(body, media_type=DOSSIER_MEDIA[format], headers={"Content-Disposition": disposition})
+
+
+# --- Simulador de Alocação de Orçamento ---
+class CityLimit(BaseModel):
+    min: float = 0
+    max: Optional[float] = None
+
+class AllocationRequest(BaseModel):
+    budget: float
+    cities: Optional[List[str]] = None  # padrão: todas as cidades com eleitorado conhecido
+    min_per_city: float = 0
+    max_per_city: Optional[float] = None
+    limits: Dict[str, CityLimit] = {}  # limites específicos por cidade
+    areas: Optional[List[str]] = None  # áreas permitidas para as emendas
+    regions: Optional[List[str]] = None  # restringe às cidades destas meso/microrregiões (id ou nome)
+    scenarios: int = 2000
+    seed: Optional[int] = None
+    allow_unreliable: bool = False  # projeta mesmo com o modelo marcado como não confiável
+
+MAX_SCENARIOS = 20000
+ALLOCATION_MODEL = (None, None)  # (versão dos dados, modelo ajustado)
+
+def get_allocation_model(snapshot):
+    """Modelo de resposta ajustado para a versão dos dados (reajustado quando votos/investimentos mudam)."""
+    global ALLOCATION_MODEL
+    version, model = ALLOCATION_MODEL
+    if version != snapshot.version:
+        from allocation import ResponseModel
+        electorate = {slug: d.get("total_eleitores", 0) for slug, d in snapshot.reference.electoral_by_city.items()}
+        model = ResponseModel.fit(snapshot.investments, snapshot.votos, electorate)
+        ALLOCATION_MODEL = (snapshot.version, model)
+    return model
+
+@app.get("/api/simulate/model")
+async def allocation_model():
+    """Parâmetros do modelo de resposta (votos × investimento) ajustado com o histórico."""
+    snapshot = STATE.current
+    model = await asyncio.to_thread(get_allocation_model, snapshot)
+    return {"version": snapshot.version, **model.describe()}
+
+@app.post("/api/simulate/allocation")
+async def simulate_allocation(data: AllocationRequest):
+    """Melhor distribuição de um orçamento entre cidades, com votos esperados e comparação com cenários aleatórios."""
+    if data.budget <= 0:
+        raise HTTPException(status_code=400, detail="O orçamento deve ser positivo.")
+    if not 0 <= data.scenarios <= MAX_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"Use entre 0 e {MAX_SCENARIOS} cenários.")
+    snapshot = STATE.current
+    reference = snapshot.reference
+    electoral = reference.electoral_by_city
+    if data.cities is not None and not data.cities:
+        raise HTTPException(status_code=400, detail="Informe ao menos uma cidade (ou omita `cities` para usar todas).")
+    unknown = [s for s in list(data.cities or ()) + list(data.limits) if s not in reference.cities]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cidades desconhecidas: {', '.join(sorted(set(unknown)))}")
+    slugs = data.cities or [s for s in reference.cities if electoral.get(s, {}).get("total_eleitores")]
+    if data.regions:
+        geo = get_geo(reference)
+        found = {key: geo.find_region(key) for key in data.regions}
+        missing = [key for key, region in found.items() if region is None]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Regiões não encontradas: {', '.join(missing)}")
+        allowed = {geo.slugs[i] for level, code in found.values() for i in geo.members(level, code)}
+        slugs = [s for s in slugs if s in allowed]
+        if not slugs:
+            raise HTTPException(status_code=400, detail="Nenhuma das cidades pedidas fica nessas regiões.")
+    unknown = [s for s in list(slugs) + list(data.limits) if not electoral.get(s, {}).get("total_eleitores")]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cidades sem eleitorado conhecido: {', '.join(sorted(set(unknown)))}")
+
+    def run():
+        import numpy as np
+        from allocation import InfeasibleAllocation, UnreliableModel, simulate
+
+        model = get_allocation_model(snapshot)
+        unknown_areas = model.unknown_areas(data.areas)
+        if unknown_areas:
+            raise HTTPException(status_code=400,
+                                detail=f"Áreas sem investimentos no histórico: {', '.join(unknown_areas)}")
+        eleitores = np.array([electoral[s]["total_eleitores"] for s in slugs], dtype=np.float64)
+        default_max = data.max_per_city if data.max_per_city is not None else data.budget
+        limits = [data.limits.get(s) for s in slugs]
+        lower = np.array([l.min if l else data.min_per_city for l in limits], dtype=np.float64)
+        upper = np.array([l.max if l and l.max is not None else default_max for l in limits], dtype=np.float64)
+        try:
+            result = simulate(model, data.budget, eleitores, slugs, lower, upper, data.areas, data.scenarios, data.seed,
+                              allow_unreliable=data.allow_unreliable)
+        except InfeasibleAllocation as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except UnreliableModel as e:
+            raise HTTPException(status_code=409, detail=f"{e} Importe mais votos e investimentos ou envie "
+                                                        "allow_unreliable=true para uma projeção indicativa.")
+        for entry in result["alocacao"]:
+            entry["nome"] = reference.cities.get(entry["cidade"], {}).get("nome")
+        return {"version": snapshot.version, "modelo": model.describe(), **result}
+
+    with metrics.stage("allocation_simulation", metrics.ENDPOINT_STAGE_SECONDS):
+        return await asyncio.to_thread(run)
+
+# --- Clientes Externos (imports tardios: SDKs pesados, usados só no chat) ---
+_OPENAI_CLIENT = None
+_OPENAI_LOCK = threading.Lock()
+_SEARCH_SESSIONS = threading.local()
+
+def get_openai_client():
+    """Cliente único (pool de conexões compartilhado); as novas tentativas ficam com call_with_retries."""
+    global _OPENAI_CLIENT
+    if _OPENAI_CLIENT is None:
+        with _OPENAI_LOCK:
+            if _OPENAI_CLIENT is None:
+                from openai import OpenAI
+                _OPENAI_CLIENT = OpenAI(api_key=API_KEY, max_retries=0, timeout=60.0)
+    return _OPENAI_CLIENT
+
+def new_search_session():
+    # Uma sessão por thread de trabalho, reaproveitada entre buscas
+    session = getattr(_SEARCH_SESSIONS, "session", None)
+    if session is None:
+        from duckduckgo_search import DDGS
+        session = _SEARCH_SESSIONS.session = DDGS()
+    return session
 
 # --- Ferramentas de Busca ---
 def search_web(query: str, max_results: int = 3):
     """Busca no DuckDuckGo para obter informações recentes."""
     try:
-        results = DDGS().text(query, max_results=max_results)
+        with metrics.stage("search_web"):
+            results = new_search_session().text(query, max_results=max_results)
         return results
     except Exception as e:
         print(f"Erro na busca: {e}")
@@ -411,53 +1161,46 @@ def search_web(query: str, max_results: int = 3):
 
 # --- Lógica de Chat ---
 
-def get_target_city(message: str, current_context: Optional[str]):
+def get_target_city(message: str, current_context: Optional[str], reference=None):
     """Identifica a cidade alvo na mensagem ou contexto."""
+    cities = (reference or STATE.current.reference).cities
     target_city_data = None
     target_city_slug = None
     
     # 1. Se contexto for genérico, busca na mensagem
     if not current_context or "Estado Geral" in current_context:
-        message_lower = message.lower()
-        for slug, data in CITIES_DATA.items():
-            if data.get("nome", "").lower() in message_lower:
-                return data, slug
+        city = cities.find_in_text(message)
+        if city:
+            return city, city.slug
     else:
         # 2. Se contexto já existe, tenta validar
-        for slug, data in CITIES_DATA.items():
-            if data.get("nome", "") in current_context:
-                return data, slug
+        for city in cities.values():
+            if city.nome and city.nome in current_context:
+                return city, city.slug
                 
     return None, None
 
-def build_local_data_context(city_data, city_slug):
+def build_local_data_context(city_data, city_slug, snapshot=None):
     """Constrói o contexto de dados locais da cidade."""
     if not city_data:
         return ""
+    snapshot = snapshot or STATE.current
+    campaign_data = snapshot.campaign
+    electoral = snapshot.reference.electoral_by_city
         
     context = f"""
-    DADOS GERAIS DE {city_data.get('nome').upper()}:
-    - Prefeito: {city_data.get('prefeito')} ({city_data.get('partido')})
-    - Habitantes: {city_data.get('habitantes')} (Fonte: IBGE)
-    - Área: {city_data.get('area_km2')} km²
-    - PIB per Capita: R$ {city_data.get('pib_per_capita')}
-    - IDHM: {city_data.get('idhm')}
-    - Descrição: {city_data.get('descricao')}
+    DADOS GERAIS DE {city_data.nome.upper()}:
+    - Prefeito: {city_data.get('prefeito', NOT_INFORMED)} ({city_data.get('partido', NOT_INFORMED)})
+    - Habitantes: {city_data.get('habitantes', NOT_INFORMED)} (Fonte: IBGE)
+    - Área: {city_data.get('area_km2', NOT_INFORMED)} km²
+    - PIB per Capita: R$ {city_data.get('pib_per_capita', NOT_INFORMED)}
+    - IDHM: {city_data.get('idhm', NOT_INFORMED)}
+    - Descrição: {city_data.get('descricao', NOT_INFORMED)}
     """
     
-    # Dados Eleitorais
+    # Dados Eleitorais (chaves do TSE já conciliadas com os slugs na carga)
     if city_slug:
-        normalized_slug = city_slug.lower().replace("-", "_")
-        city_electoral = ELECTORAL_DATA.get(normalized_slug)
-        
-        if not city_electoral:
-             # Fallback: search by name
-             search_name = city_data.get('nome', '').lower()
-             for v in ELECTORAL_DATA.values():
-                 if v.get('nome', '').lower() == search_name:
-                     city_electoral = v
-                     break
-                     
+        city_electoral = electoral.get(city_slug)
         if city_electoral:
             context += f"""
             \n--- DADOS ELEITORAIS DETALHADOS (TSE) ---
@@ -469,20 +1212,17 @@ def build_local_data_context(city_data, city_slug):
             """
             
     # Dados de Campanha
-    if city_slug in CAMPAIGN_DATA:
-        camp = CAMPAIGN_DATA[city_slug]
+    if city_slug in campaign_data:
+        camp = campaign_data[city_slug]
         votes = camp.get('votes', 0)
         money = camp.get('money', 0)
         
-        pop = int(city_data.get('habitantes', 0))
+        pop = city_data.habitantes or 0
         cost_vote = (money / votes) if votes > 0 else 0
         cost_pop = (money / pop) if pop > 0 else 0
         
         # Conversão
-        normalized_slug = city_slug.lower().replace("-", "_")
-        total_eleitores = 0
-        if ELECTORAL_DATA.get(normalized_slug):
-            total_eleitores = ELECTORAL_DATA[normalized_slug].get('total_eleitores', 0)
+        total_eleitores = (electoral.get(city_slug) or {}).get('total_eleitores', 0)
             
         conversion_rate = (votes / total_eleitores * 100) if total_eleitores > 0 else 0
         
@@ -499,16 +1239,9 @@ def build_local_data_context(city_data, city_slug):
 
 import re
 
-def get_demographic_summary(slug):
+def get_demographic_summary(slug, reference=None):
     """Retorna resumo demográfico para uma cidade."""
-    n_slug = slug.lower().replace("-", "_")
-    data = ELECTORAL_DATA.get(n_slug)
-    if not data:
-        # Tenta fallback pelo nome nas keys
-        for k, v in ELECTORAL_DATA.items():
-            if slug.replace("-", " ") in k.replace("_", " "):
-                data = v
-                break
+    data = (reference or STATE.current.reference).electoral_by_city.get(slug)
     
     if not data:
         return "Dados demográficos não disponíveis."
@@ -534,9 +1267,11 @@ def get_demographic_summary(slug):
             
     return f"Eleitorado: {total:,} | Mulheres: {fem_pct:.1f}% | Faixa etária principal: {best_faixa}"
 
-def build_strategic_report(message):
+def build_strategic_report(message, snapshot=None):
     """Gera insights estratégicos, busca dados e demografia."""
     message_lower = message.lower()
+    snapshot = snapshot or STATE.current
+    reference = snapshot.reference
     
     # Keywords expandidas para capturar mais tipos de perguntas sobre campanha
     keywords = [
@@ -549,8 +1284,8 @@ def build_strategic_report(message):
     ]
     
     # Sempre gera relatório se houver dados de campanha ou investimentos
-    has_campaign_data = len(CAMPAIGN_DATA) > 0
-    has_investments = len(INVESTMENTS_DATA) > 0
+    has_campaign_data = len(snapshot.campaign) > 0
+    has_investments = len(snapshot.investments) > 0
     
     if not any(k in message_lower for k in keywords) and not has_campaign_data:
         return ""
@@ -567,9 +1302,9 @@ def build_strategic_report(message):
     active_campaigns = 0
     total_invested = 0
     
-    for slug, camp in CAMPAIGN_DATA.items():
-        if slug not in CITIES_DATA: continue
-        city = CITIES_DATA[slug]
+    for slug, camp in snapshot.campaign.items():
+        if slug not in reference.cities: continue
+        city = reference.cities[slug]
         
         votes = camp.get('votes', 0)
         money = camp.get('money', 0)
@@ -579,19 +1314,16 @@ def build_strategic_report(message):
         active_campaigns += 1
         total_invested += money
         
-        n_slug = slug.lower().replace("-", "_")
-        eleitores = 0
-        if ELECTORAL_DATA.get(n_slug):
-            eleitores = ELECTORAL_DATA[n_slug].get('total_eleitores', 0)
+        eleitores = (reference.electoral_by_city.get(slug) or {}).get('total_eleitores', 0)
         
         conv = (votes/eleitores*100) if eleitores > 0 else 0
         cpv = (money/votes) if votes > 0 else 0
         
         # Busca demografia
-        demo_summary = get_demographic_summary(slug)
+        demo_summary = get_demographic_summary(slug, reference)
         
         item = {
-            "nome": city['nome'],
+            "nome": city.nome,
             "votes": votes,
             "money": money,
             "conversion": conv,
@@ -635,8 +1367,91 @@ def build_strategic_report(message):
     
     return report
 
+# --- Cache de Respostas do Chat ---
+# Perguntas repetidas (mesma mensagem normalizada, cidade e versão dos dados) reaproveitam a resposta;
+# perguntas idênticas simultâneas viram uma única chamada ao modelo.
+CHAT_CACHE = TTLCache(maxsize=int(os.getenv("CHAT_CACHE_SIZE", "256")), ttl=float(os.getenv("CHAT_CACHE_TTL", "300")))
+CHAT_INFLIGHT = SingleFlight()
+
+# Modo padrão do chat: "prompt" monta todo o contexto no prompt; "tools" deixa o modelo consultar os dados
+CHAT_MODE = os.getenv("CHAT_MODE", "prompt")
+CHAT_MODES = ("prompt", "tools")
+MAX_TOOL_ROUNDS = int(os.getenv("CHAT_MAX_TOOL_ROUNDS", "4"))
+
+def chat_cache_key(request: ChatRequest, city_slug, data_version, mode):
+    # O contexto de investimentos enviado pelo cliente entra no prompt, então também entra na chave
+    investment_hash = hashlib.blake2b((request.investment_context or "").encode("utf-8"), digest_size=8).hexdigest()
+    return (normalize_message(request.message), city_slug, data_version, investment_hash, mode)
+
+# Limita as chamadas simultâneas ao modelo/busca, com fila justa por cliente
+UPSTREAM = UpstreamScheduler()
+
+# Proxies reversos (IPs ou redes, separados por vírgula) cujo X-Forwarded-For é confiável.
+# Sem isso o cabeçalho é ignorado: qualquer cliente poderia forjá-lo para escapar do limite.
+TRUSTED_PROXIES = [ipaddress.ip_network(p.strip(), strict=False)
+                   for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()]
+
+def is_trusted_proxy(host):
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def client_id(http_request: Request):
+    """Chave de justiça por cliente: o IP da conexão ou, atrás de um proxy confiável, o último IP não confiável do X-Forwarded-For."""
+    host = http_request.client.host if http_request.client else "anon"
+    forwarded = http_request.headers.get("x-forwarded-for")
+    if forwarded and is_trusted_proxy(host):
+        # Cada proxy acrescenta à direita; entradas à esquerda do primeiro proxy confiável podem ser forjadas
+        for hop in reversed([h.strip() for h in forwarded.split(",") if h.strip()]):
+            if not is_trusted_proxy(hop):
+                return hop
+    return host
+
+# Sessões de conversa (histórico compacto por sessão, resumido quando passa do orçamento)
+CHAT_SESSIONS = SessionStore()
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+_COMPACTIONS = set()  # tarefas de resumo em andamento (referência forte até terminarem)
+
+def summarize_history(summary, turns):
+    """Resumo dos turnos antigos (e do resumo anterior) pelo modelo, no limite de SUMMARY_TOKENS."""
+    client = get_openai_client()
+    conversation = "\n\n".join(f"Pergunta: {t.question}\nResposta: {t.answer}" for t in turns)
+    if summary:
+        conversation = f"Resumo anterior:\n{summary}\n\n{conversation}"
+    response = call_with_retries(lambda: client.chat.completions.create(
+        model=CHAT_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": "Resuma a conversa entre o usuário e o assistente de estratégia política "
+                                          "em tópicos curtos. Preserve cidades, números, decisões e pedidos "
+                                          "pendentes; descarte formatação e repetições."},
+            {"role": "user", "content": conversation},
+        ],
+        temperature=0.2,
+        max_tokens=SUMMARY_TOKENS
+    ))
+    if response.usage:
+        metrics.record_tokens(response.usage.prompt_tokens, response.usage.completion_tokens)
+    return response.choices[0].message.content or extractive_summary(summary, turns)
+
+async def compact_session(session, client):
+    """Resume os turnos antigos fora do caminho da resposta; o próximo turno não espera por isto."""
+    session.compacting = True
+    folded = session.turns[:-KEEP_TURNS]
+    try:
+        summary = await UPSTREAM.run(client, lambda: asyncio.to_thread(summarize_history, session.summary, folded))
+        method = "llm"
+    except Exception as e:
+        print(f"Resumo do histórico pelo modelo falhou ({type(e).__name__}); usando resumo extrativo")
+        summary, method = extractive_summary(session.summary, folded), "extractive"
+    finally:
+        session.compacting = False
+    session.fold(len(folded), summary)
+    metrics.CHAT_COMPACTIONS.inc(method=method)
+
 @app.post("/api/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     if not API_KEY:
         return {
             "response": "⚠️ **A API Key da OpenAI não foi configurada.**\n\n"
@@ -644,41 +1459,144 @@ async def chat_endpoint(request: ChatRequest):
             "sources": []
         }
 
-    client = OpenAI(api_key=API_KEY)
-    
-    # 1. Identificar Cidade
-    target_city_data, target_city_slug = get_target_city(request.message, request.city_context)
+    mode = request.mode or CHAT_MODE
+    if mode not in CHAT_MODES:
+        raise HTTPException(status_code=400, detail=f"Modo de chat inválido (use {' ou '.join(CHAT_MODES)}).")
+    generator = generate_tool_chat_response if mode == "tools" else generate_chat_response
+
+    session = CHAT_SESSIONS.open(request.session_id)
+    async with session.lock:
+        # Uma versão dos dados (e da referência) para o turno inteiro, mesmo com recarga no meio
+        snapshot = STATE.current
+        cities = snapshot.reference.cities
+        # 1. Identificar Cidade (sem cidade na pergunta, vale a da conversa)
+        with metrics.stage("get_target_city"):
+            target_city_data, target_city_slug = get_target_city(request.message, request.city_context,
+                                                                 snapshot.reference)
+        if target_city_data is None and session.city_slug in cities:
+            target_city_data, target_city_slug = cities[session.city_slug], session.city_slug
+
+        response = await chat_turn(request, http_request, generator, target_city_data, target_city_slug,
+                                   mode, session, snapshot)
+        session.add_turn(request.message, response["response"])
+        session.city_slug = target_city_slug
+        CHAT_SESSIONS.touch(session)  # renova o prazo de inatividade
+    if session.needs_compaction():
+        task = asyncio.create_task(compact_session(session, client_id(http_request)))
+        _COMPACTIONS.add(task)
+        task.add_done_callback(_COMPACTIONS.discard)
+    return {**response, "session_id": session.id}
+
+async def chat_turn(request, http_request, generator, target_city_data, target_city_slug, mode, session, snapshot):
+    """Uma resposta do modelo; o cache de respostas só vale para o primeiro turno (sem histórico)."""
+    history = session.messages()
+
+    async def generate():
+        # Contextos, busca web e modelo são bloqueantes: rodam em thread para não travar o event loop
+        return await UPSTREAM.run(client_id(http_request), lambda: asyncio.to_thread(
+            generator, request, target_city_data, target_city_slug, snapshot, history, session))
+
+    try:
+        if history:
+            return await generate()
+
+        key = chat_cache_key(request, target_city_slug, snapshot.version, mode)
+        cached = CHAT_CACHE.get(key)
+        if cached is not MISSING:
+            metrics.record_cache("chat", True)
+            return cached
+
+        async def generate_and_cache():
+            response = await generate()
+            CHAT_CACHE.set(key, response)
+            return response
+
+        response, leader = await CHAT_INFLIGHT.run(key, generate_and_cache)
+    except Overloaded as e:
+        detail = ("Muitas perguntas em andamento deste usuário. Aguarde a resposta anterior."
+                  if e.status_code == 429 else "O assistente está com muitas solicitações. Tente novamente em instantes.")
+        raise HTTPException(status_code=e.status_code, detail=detail, headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        print(f"Erro OpenAI: {type(e).__name__}: {e}")
+        if is_transient(e):
+            raise HTTPException(status_code=503, detail="O serviço de IA está indisponível no momento. Tente novamente em instantes.",
+                                headers={"Retry-After": str(UPSTREAM.retry_after())})
+        raise HTTPException(status_code=502, detail="Não foi possível gerar a resposta do assistente.")
+
+    if leader:
+        metrics.record_cache("chat", False)
+    else:
+        metrics.CACHE_REQUESTS.inc(cache="chat", result="coalesced")
+    return response
+
+@app.get("/api/chat/sessions/{session_id}")
+async def chat_session(session_id: str):
+    """Resumo e turnos recentes de uma sessão (para o cliente restaurar a conversa)."""
+    session = CHAT_SESSIONS.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Sessão não encontrada ou expirada.")
+    return session.to_dict()
+
+@app.delete("/api/chat/sessions/{session_id}")
+async def end_chat_session(session_id: str):
+    if not CHAT_SESSIONS.delete(session_id):
+        raise HTTPException(status_code=404, detail="Sessão não encontrada ou expirada.")
+    return {"success": True}
+
+def generate_chat_response(request: ChatRequest, target_city_data, target_city_slug, snapshot, history=(),
+                           session=None):
+    """Monta o prompt (dados locais, relatório estratégico, busca web) e consulta o modelo."""
+    client = get_openai_client()
+    reference = snapshot.reference
     city_name = target_city_data.get('nome') if target_city_data else 'Indefinida'
     
-    # 2. Construir Contextos
-    local_data_context = build_local_data_context(target_city_data, target_city_slug)
-    db_analysis_context = build_strategic_report(request.message)
-    
-    # Contexto de Partidos (se mencionado)
-    unique_parties = set(c.get('partido') for c in CITIES_DATA.values() if c.get('partido'))
-    mentioned_parties = [p for p in unique_parties if p.lower() in request.message.lower().split()]
-    
-    if mentioned_parties:
-        db_analysis_context += "\n--- ANÁLISE DE PARTIDOS ---\n"
-        for p in mentioned_parties:
-            cities_of_party = [c for c in CITIES_DATA.values() if c.get('partido') == p]
-            count = len(cities_of_party)
-            cities_of_party.sort(key=lambda x: int(x.get('habitantes', 0)), reverse=True)
-            top_5 = [c['nome'] for c in cities_of_party[:5]]
-            db_analysis_context += f"Partido {p}: {count} prefeitos. Maiores cidades: {', '.join(top_5)}...\n"
-
-    # Contexto de Cidades Mencionadas (se não for a alvo)
-    mentioned_cities = []
-    if not target_city_data: # Só busca outras se não focar em uma
-        for slug, c in CITIES_DATA.items():
-            if c.get('nome', '').lower() in request.message.lower():
-                 mentioned_cities.append(c)
-        if mentioned_cities:
-             db_analysis_context += "\n--- OUTRAS CIDADES MENCIONADAS ---\n"
-             for c in mentioned_cities[:3]: 
-                 db_analysis_context += f"{c['nome']}: Prefeito {c.get('prefeito')} ({c.get('partido')}), {c.get('habitantes')} hab.\n"
-
-    # 3. Busca Web (se necessário)
+    # 2. Construir Contextos (mesma versão dos dados para todo o prompt)
+    with metrics.stage("build_local_data_context"):
+        build_local = lambda: build_local_data_context(target_city_data, target_city_slug, snapshot)
+        local_data_context = (session.context_block((target_city_slug, snapshot.version), build_local)
+                              if session else build_local())
+    with metrics.stage("build_strategic_report"):
+        db_analysis_context = build_strategic_report(request.message, snapshot)
+    
+    with metrics.stage("party_and_city_context"):
+        # Contexto de Partidos (se mencionado)
+        message_words = request.message.lower().split()
+        mentioned_parties = [p for p in reference.cities.by_party if p.lower() in message_words]
+        
+        if mentioned_parties:
+            db_analysis_context += "\n--- ANÁLISE DE PARTIDOS ---\n"
+            for p in mentioned_parties:
+                cities_of_party = reference.cities.party(p)  # já ordenadas por população
+                count = len(cities_of_party)
+                top_5 = [c.nome for c in cities_of_party[:5]]
+                db_analysis_context += f"Partido {p}: {count} prefeitos. Maiores cidades: {', '.join(top_5)}...\n"
+
+        # Contexto de Cidades Mencionadas (se não for a alvo)
+        mentioned_cities = []
+        if not target_city_data: # Só busca outras se não focar em uma
+            message_lower = request.message.lower()
+            mentioned_cities = [reference.cities[slug] for name, slug in reference.cities.names_lower
+                                if name in message_lower]
+            if mentioned_cities:
+                 db_analysis_context += "\n--- OUTRAS CIDADES MENCIONADAS ---\n"
+                 for c in mentioned_cities[:3]: 
+                     db_analysis_context += f"{c.nome}: Prefeito {c.prefeito} ({c.partido}), {c.habitantes} hab.\n"
+
+        # Cidades parecidas com a selecionada (em vez de o modelo adivinhar)
+        if target_city_slug and any(k in request.message.lower() for k in ("parecid", "semelhan", "similar")):
+            similar = get_similarity(reference).similar(target_city_slug, k=5)
+            db_analysis_context += f"\n--- CIDADES MAIS PARECIDAS COM {target_city_data.nome.upper()} " \
+                                   f"(população, economia e perfil do eleitorado) ---\n"
+            db_analysis_context += "".join(f"{c['nome']} (similaridade {c['similarity']:.2f})\n" for c in similar)
+
+    # 3. Trechos relevantes da base local (descrições de cidades e investimentos)
+    with metrics.stage("local_retrieval"):
+        passages, coverage = RETRIEVAL.search(request.message, k=RETRIEVAL_TOP_K)
+    if passages:
+        db_analysis_context += "\n--- TRECHOS RELEVANTES DA BASE LOCAL ---\n"
+        db_analysis_context += "\n".join(format_passage(p["payload"]) for p in passages) + "\n"
+
+    # 4. Busca Web (se necessário)
     search_context = ""
     sources = []
     
@@ -686,6 +1604,8 @@ async def chat_endpoint(request: ChatRequest):
     needs_search = True
     if mentioned_parties: needs_search = False
     if target_city_data and "população" in request.message.lower(): needs_search = False # Já temos no local
+    if passages and coverage >= RETRIEVAL_SKIP_COVERAGE: needs_search = False # A base local cobre a pergunta
+    metrics.CHAT_WEB_SEARCHES.inc(decision="web" if needs_search else "local")
     
     if needs_search:
         query_entity = target_city_data.get("nome") if target_city_data else "Paraná"
@@ -710,10 +1630,10 @@ async def chat_endpoint(request: ChatRequest):
                 search_context += f"- {res['title']}: {res['body']} (Link: {res['href']})\n"
                 # sources.append({"title": res['title'], "url": res['href']}) # Desabilitado conforme solicitado
 
-    # 4. Investment Context
+    # 5. Investment Context
     investment_analysis = request.investment_context or ""
     
-    # 5. Prompt System - FOCO EM DADOS DO BANCO
+    # 6. Prompt System - FOCO EM DADOS DO BANCO
     system_prompt = f"""
     Você é um Estrategista de Marketing Político e Analista de Dados Eleitorais especializado no estado do Paraná.
     
@@ -767,28 +1687,170 @@ async def chat_endpoint(request: ChatRequest):
     Responda de forma completa, analítica e estratégica. Seja o consultor que todo político precisa!
     """
 
-    try:
-        response = client.chat.completions.create(
+    with metrics.stage("llm_completion"):
+        response = call_with_retries(lambda: client.chat.completions.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": system_prompt},
+                *history,
                 {"role": "user", "content": request.message}
             ],
             temperature=0.6,
             max_tokens=1200
-        )
-        # O frontend espera 'sources', mas o usuário pediu para não retornar/mostrar.
-        # Vamos mandar vazio ou oculto.
-        return {"response": response.choices[0].message.content, "sources": []}
+        ))
+    if response.usage:
+        metrics.record_tokens(response.usage.prompt_tokens, response.usage.completion_tokens)
+    # O frontend espera 'sources', mas o usuário pediu para não retornar/mostrar.
+    # Vamos mandar vazio ou oculto.
+    return {"response": response.choices[0].message.content, "sources": []}
+
+TOOLS_SYSTEM_PROMPT = """
+Você é um Estrategista de Marketing Político e Analista de Dados Eleitorais especializado no estado do Paraná.
+
+Use as ferramentas para consultar o banco de dados local (cidades, eleitorado do TSE, votos e
+investimentos/emendas da campanha) e baseie a resposta nos números retornados. Consulte apenas
+o necessário e enriqueça a análise com comparações e uma perspectiva estratégica de campanha.
+
+Responda em Markdown: 1) Resposta direta com dados, 2) Plano de ação, 3) Contexto adicional,
+4) Insight estratégico.
+
+Você SOMENTE responde sobre política, eleições, dados de cidades do Paraná, investimentos
+parlamentares e estratégias de campanha. Para outros assuntos, responda: "Desculpe, sou
+especializado em análise política e dados eleitorais do Paraná. Posso ajudá-lo com informações
+sobre cidades, prefeitos, eleitorado, investimentos ou estratégias de campanha."
+"""
+
+def generate_tool_chat_response(request: ChatRequest, target_city_data, target_city_slug, snapshot, history=(),
+                                session=None):
+    """Modo "tools": prompt enxuto e o modelo busca os dados via function calling."""
+    client = get_openai_client()
+    reference = snapshot.reference
+    tools = ChatTools(reference.cities, reference.electoral_by_city, snapshot,
+                      similarity=lambda: get_similarity(reference))
+    system_prompt = TOOLS_SYSTEM_PROMPT
+    if target_city_data:
+        system_prompt += f"\nCidade selecionada no mapa: {target_city_data.get('nome')} (slug: {target_city_slug})."
+    messages = [
+        {"role": "system", "content": system_prompt},
+        *history,
+        {"role": "user", "content": request.message},
+    ]
 
-    except Exception as e:
-        print(f"Erro OpenAI: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    prompt_tokens = completion_tokens = 0
+    for round_ in range(MAX_TOOL_ROUNDS + 1):
+        # Na última rodada o modelo é obrigado a responder com o que já consultou
+        tool_choice = "none" if round_ == MAX_TOOL_ROUNDS else "auto"
+        with metrics.stage("llm_completion"):
+            response = call_with_retries(lambda: client.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                tools=TOOLS,
+                tool_choice=tool_choice,
+                temperature=0.6,
+                max_tokens=1200
+            ))
+        if response.usage:
+            prompt_tokens += response.usage.prompt_tokens
+            completion_tokens += response.usage.completion_tokens
+
+        message = response.choices[0].message
+        if not message.tool_calls:
+            break
+        messages.append({
+            "role": "assistant",
+            "content": message.content,
+            "tool_calls": [{"id": call.id, "type": "function",
+                            "function": {"name": call.function.name, "arguments": call.function.arguments}}
+                           for call in message.tool_calls],
+        })
+        with metrics.stage("tool_calls"):
+            for call in message.tool_calls:
+                result = tools.call(call.function.name, call.function.arguments)
+                messages.append({"role": "tool", "tool_call_id": call.id,
+                                 "content": json.dumps(result, ensure_ascii=False, separators=(",", ":"))})
+
+    metrics.record_tokens(prompt_tokens, completion_tokens)
+    return {"response": message.content, "sources": []}
+
+# --- Métricas (formato Prometheus) ---
+@app.get("/metrics")
+async def metrics_endpoint():
+    metrics.PERSISTENCE_PENDING.set(PERSISTENCE.pending)
+    metrics.CHAT_SESSIONS_ACTIVE.set(len(CHAT_SESSIONS))
+    return PlainTextResponse(metrics.render_all(), media_type="text/plain; version=0.0.4")
+
+# Latência por endpoint + log estruturado de tempos por requisição
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    token = metrics.begin_request()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        # Usa o template da rota (ex.: /api/votos/data) para não explodir a cardinalidade
+        route_path = getattr(route, "path", None) or "static"
+        metrics.end_request(token, request.method, route_path, status, time.perf_counter() - start,
+                            log=route_path.startswith("/api/"))
+
+# --- Perfis de requisições lentas (ou com X-Debug-Profile) ---
+PROFILER = RequestProfiler()
+
+@app.middleware("http")
+async def capture_request_profile(request, call_next):
+    if request.url.path.startswith("/api/admin/"):
+        return await call_next(request)
+    forced = request.headers.get(PROFILE_HEADER) == "1" and is_admin(request.headers.get("x-admin-token"))
+    return await PROFILER.handle(request, call_next, forced=forced)
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Lista os perfis capturados (mais recentes primeiro)."""
+    return {"profiles": PROFILER.list(), "threshold_s": PROFILER.threshold, "sample_rate": PROFILER.sample_rate}
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: int, format: str = "collapsed"):
+    """Baixa um perfil como collapsed stacks, pstats (binário) ou resumo em texto."""
+    profile = PROFILER.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Perfil não encontrado (pode ter saído do buffer).")
+
+    if format == "collapsed":
+        return PlainTextResponse(PROFILER.collapsed(profile))
+    if format in ("pstats", "text"):
+        if profile["pstats"] is None:
+            raise HTTPException(status_code=404, detail="Perfil amostrado: só disponível em formato collapsed.")
+        if format == "text":
+            return PlainTextResponse(PROFILER.pstats_text(profile))
+        return Response(profile["pstats"], media_type="application/octet-stream", headers={
+            "Content-Disposition": f'attachment; filename="profile_{profile_id}.pstats"'
+        })
+    raise HTTPException(status_code=400, detail="Formato inválido (use collapsed, pstats ou text).")
+
+# Middleware de negociação de conteúdo (MessagePack/CBOR) para as respostas JSON da API
+@app.middleware("http")
+async def transcode_binary_response(request, call_next):
+    """Demais respostas JSON da API convertidas para o formato binário pedido em Accept (layout original)."""
+    response = await call_next(request)
+    media = negotiate(request.headers.get("accept")) if request.url.path.startswith("/api/") else None
+    if media is None or not response.headers.get("content-type", "").startswith(JSON) \
+            or "content-encoding" in response.headers:
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    headers = {k: v for k, v in response.headers.items() if k not in ("content-length", "content-type")}
+    headers["Vary"] = "Accept"
+    return Response(encode(json.loads(body), media), status_code=response.status_code, media_type=media,
+                    headers=headers)
 
 # Middleware para desabilitar cache (Desenvolvimento Mobile)
 @app.middleware("http")
 async def add_no_cache_header(request, call_next):
     response = await call_next(request)
+    if "cache-control" in response.headers:
+        return response  # a rota já definiu a política (ex.: revalidação por ETag no /api/bootstrap)
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
@@ -798,6 +1860,7 @@ async def add_no_cache_header(request, call_next):
 app.mount("/", StaticFiles(directory=".", html=True), name="static")
 
 if __name__ == "__main__":
+    import uvicorn
     print("Iniciando servidor na porta 8082...")
     print("Acesse: http://localhost:8082")
     uvicorn.run(app, host="0.0.0.0", port=8082, reload=False)
@@ -0,0 +1,153 @@
+"""
+Cidades semelhantes: matriz de atributos (NumPy) com dados do IBGE e do
+perfil do eleitorado (TSE), padronizada por coluna (z-score).
+
+A matriz e as distâncias são calculadas de forma vetorizada; a matriz
+completa de similaridade (todas as cidades × todas) é montada uma vez por
+métrica e reaproveitada enquanto os dados de referência não mudarem.
+"""
+
+import json
+import math
+import re
+
+import numpy as np
+
+METRICS = ("cosine", "euclidean")
+
+# Atributos das cidades (escala log nos que variam em ordens de grandeza)
+CITY_FEATURES = [
+    ("habitantes", True),
+    ("densidade", True),
+    ("pib_per_capita", True),
+    ("area_km2", True),
+    ("idhm", False),
+]
+AGE_BUCKETS = [(16, "idade_16_24"), (25, "idade_25_34"), (35, "idade_35_44"), (45, "idade_45_59"), (60, "idade_60_mais")]
+EDUCATION_GROUPS = {
+    "instrucao_superior": ("SUPERIOR COMPLETO", "SUPERIOR INCOMPLETO"),
+    "instrucao_medio": ("ENSINO MÉDIO COMPLETO", "ENSINO MÉDIO INCOMPLETO"),
+    "instrucao_fundamental": ("ENSINO FUNDAMENTAL COMPLETO", "ENSINO FUNDAMENTAL INCOMPLETO"),
+    "instrucao_basica": ("LÊ E ESCREVE", "ANALFABETO"),
+}
+
+FEATURE_NAMES = ([name for name, _ in CITY_FEATURES] + [name for _, name in AGE_BUCKETS]
+                 + list(EDUCATION_GROUPS) + ["eleitorado_feminino"])
+
+_FIRST_NUMBER = re.compile(r"\d+")
+
+
+def _electoral_features(data):
+    """Participação (%) por faixa etária, grupo de instrução e gênero; NaN quando não há dados."""
+    if not data:
+        return [math.nan] * (len(AGE_BUCKETS) + len(EDUCATION_GROUPS) + 1)
+    ages = [0.0] * len(AGE_BUCKETS)
+    for label, counts in (data.get("faixa_etaria") or {}).items():
+        match = _FIRST_NUMBER.match(label)
+        if not match:
+            continue
+        age = int(match.group())
+        for i in range(len(AGE_BUCKETS) - 1, -1, -1):
+            if age >= AGE_BUCKETS[i][0]:
+                ages[i] += sum(counts.values())
+                break
+    education = data.get("grau_instrucao") or {}
+    groups = [sum(education.get(key, 0.0) for key in keys) for keys in EDUCATION_GROUPS.values()]
+    female = (data.get("genero") or {}).get("feminino", math.nan)
+    return ages + groups + [female]
+
+
+def _number(value, log):
+    if not isinstance(value, (int, float)) or value <= 0:
+        return math.nan
+    return math.log(value) if log else float(value)
+
+
+class SimilarityEngine:
+    def __init__(self, cities, electoral):
+        self.slugs = list(cities)
+        self.names = [cities[slug].get("nome") for slug in self.slugs]
+        self.position = {slug: i for i, slug in enumerate(self.slugs)}
+
+        raw = np.array([
+            [_number(cities[slug].get(name), log) for name, log in CITY_FEATURES]
+            + _electoral_features(electoral.get(slug))
+            for slug in self.slugs
+        ], dtype=np.float64)
+
+        # Faltantes viram a média da coluna (0 depois da padronização)
+        means = np.nanmean(raw, axis=0)
+        raw = np.where(np.isnan(raw), means, raw)
+        std = raw.std(axis=0)
+        std[std == 0] = 1.0
+        self.matrix = (raw - means) / std
+        self._unit = self.matrix / np.maximum(np.linalg.norm(self.matrix, axis=1, keepdims=True), 1e-12)
+        self._pairwise = {}
+        self._batches = {}  # (k, métrica) -> (vizinhos de todas as cidades, JSON serializado)
+
+    def _scores_for(self, index, metric):
+        """Similaridade de uma cidade com todas (maior = mais parecida)."""
+        if metric == "cosine":
+            return self._unit @ self._unit[index]
+        return -np.linalg.norm(self.matrix - self.matrix[index], axis=1)
+
+    def pairwise(self, metric):
+        """Matriz n×n de similaridade (cosseno ou -distância euclidiana padronizada), calculada uma vez."""
+        scores = self._pairwise.get(metric)
+        if scores is None:
+            if metric == "cosine":
+                scores = self._unit @ self._unit.T
+            else:
+                sq = np.einsum("ij,ij->i", self.matrix, self.matrix)
+                scores = -np.sqrt(np.maximum(sq[:, None] + sq[None, :] - 2 * self.matrix @ self.matrix.T, 0.0))
+            np.fill_diagonal(scores, -np.inf)
+            self._pairwise[metric] = scores
+        return scores
+
+    def _top_k(self, scores, k):
+        k = min(k, len(scores) - 1)
+        top = np.argpartition(-scores, k)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def _entry(self, j, score, metric):
+        key = "similarity" if metric == "cosine" else "distance"
+        value = float(score) if metric == "cosine" else -float(score)
+        return {"id": self.slugs[j], "nome": self.names[j], key: round(value, 4)}
+
+    def similar(self, slug, k=10, metric="cosine"):
+        index = self.position[slug]
+        cached = self._pairwise.get(metric)
+        if cached is not None:
+            scores = cached[index]
+        else:
+            scores = self._scores_for(index, metric)
+            scores[index] = -np.inf
+        return [self._entry(j, scores[j], metric) for j in self._top_k(scores, k)]
+
+    def all_similar(self, k=5, metric="cosine", slugs=None):
+        """Vizinhos de várias cidades (todas por padrão) a partir da matriz completa."""
+        if not slugs and (k, metric) in self._batches:
+            return self._batches[k, metric][0]
+        scores = self.pairwise(metric)
+        k = min(k, len(self.slugs) - 1)
+        rows = [self.position[s] for s in slugs] if slugs else range(len(self.slugs))
+        subset = scores[list(rows)]
+        top = np.argpartition(-subset, k, axis=1)[:, :k]
+        order = np.take_along_axis(subset, top, axis=1).argsort(axis=1, kind="stable")[:, ::-1]
+        top = np.take_along_axis(top, order, axis=1)
+        result = {
+            self.slugs[i]: [self._entry(j, scores[i, j], metric) for j in top[r]]
+            for r, i in enumerate(rows)
+        }
+        if not slugs:
+            self._batches[k, metric] = (result, None)
+        return result
+
+    def all_similar_json(self, k=5, metric="cosine"):
+        """Resposta JSON já serializada do lote completo (reaproveitada enquanto os dados não mudarem)."""
+        result, body = self._batches.get((k, metric), (None, None))
+        if body is None:
+            result = self.all_similar(k, metric)
+            body = json.dumps({"metric": metric, "k": k, "similar": result}, ensure_ascii=False).encode("utf-8")
+            self._batches[k, metric] = (result, body)
+        return body
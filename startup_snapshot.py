@@ -0,0 +1,70 @@
+"""
+Snapshot binário das estruturas derivadas dos dados de referência.
+
+Na primeira inicialização as estruturas são montadas a partir dos JSON e
+gravadas em STARTUP_SNAPSHOT (pickle). Nas seguintes, se o hash de todos os
+arquivos de origem bater, o snapshot é carregado direto, sem reprocessar.
+
+Pode ser gerado no build do deploy (antes de subir o dyno):
+    python startup_snapshot.py
+"""
+
+import hashlib
+import os
+import pickle
+import time
+
+SNAPSHOT_PATH = os.getenv("STARTUP_SNAPSHOT", ".startup_snapshot.pkl")
+
+
+def file_digest(path):
+    if not os.path.exists(path):
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_digests(sources):
+    return {src: file_digest(src) for src in sources}
+
+
+def load_or_build(sources, build, version, path=SNAPSHOT_PATH, digests=None):
+    """
+    Devolve (dados, veio_do_snapshot). O snapshot é invalidado quando o hash
+    de qualquer arquivo em `sources` muda ou quando `version` (formato das
+    estruturas derivadas) muda. `digests` evita refazer os hashes quando o
+    chamador já os calculou.
+    """
+    key = {"version": version, "sources": digests or source_digests(sources)}
+
+    try:
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+        if payload.get("key") == key:
+            return payload["data"], True
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Snapshot de inicialização inválido, reconstruindo: {e}")
+
+    data = build()
+    try:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"key": key, "data": data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Não foi possível gravar o snapshot de inicialização: {e}")
+    return data, False
+
+
+if __name__ == "__main__":
+    import server
+
+    start = time.perf_counter()
+    _, cached = load_or_build(server.REFERENCE_FILES, server.build_reference_data, server.REFERENCE_SNAPSHOT_VERSION)
+    state = "já estava atualizado" if cached else "gerado"
+    print(f"Snapshot {SNAPSHOT_PATH} {state} em {(time.perf_counter() - start) * 1000:.0f}ms")
@@ -0,0 +1,81 @@
+"""
+Contêiner versionado (copy-on-write) para os datasets mutáveis do servidor.
+
+Leitores pegam `STATE.current` uma vez e trabalham sobre esse snapshot
+imutável, sem bloqueio. Escritores montam a próxima versão a partir do
+snapshot atual e a publicam de uma vez (troca atômica de referência), então
+ninguém vê uma reconstrução pela metade.
+"""
+
+import threading
+from types import MappingProxyType
+
+
+def freeze(value):
+    """Congela o contêiner de nível superior (dict -> mappingproxy, list -> tuple)."""
+    if isinstance(value, (MappingProxyType, tuple)):
+        return value
+    if isinstance(value, dict):
+        return MappingProxyType(value)
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+class Snapshot:
+    """Versão publicada dos dados. Os registros internos nunca são alterados após a publicação."""
+
+    __slots__ = ("version", "_data")
+
+    def __init__(self, version, data):
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "_data", MappingProxyType({k: freeze(v) for k, v in data.items()}))
+
+    def __getattr__(self, name):
+        try:
+            return self._data[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot é imutável; use VersionedState.update()")
+
+    def replace(self, **changes):
+        data = dict(self._data)
+        data.update(changes)
+        return Snapshot(self.version + 1, data)
+
+
+class VersionedState:
+    def __init__(self, **datasets):
+        self._current = Snapshot(0, datasets)
+        self._write_lock = threading.Lock()
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """listener(snapshot) a cada versão publicada, na ordem, sob o lock de escrita (deve só enfileirar)."""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    @property
+    def current(self):
+        return self._current
+
+    @property
+    def version(self):
+        return self._current.version
+
+    def update(self, build):
+        """
+        Publica uma nova versão. build(snapshot) devolve um dict com os datasets
+        alterados (objetos novos, nunca os do snapshot modificados in-place).
+        Escritores são serializados; leitores não esperam.
+        """
+        with self._write_lock:
+            changes = build(self._current)
+            if not changes:
+                return self._current
+            self._current = self._current.replace(**changes)
+            for listener in self._listeners:
+                listener(self._current)
+            return self._current
@@ -0,0 +1,467 @@
+"""
+Camada de persistência dos dados de campanha, votos e investimentos.
+
+Por padrão os dados continuam em arquivos JSON. Com STORAGE_BACKEND=sqlite
+o servidor usa um banco SQLite embutido (arquivo único, modo WAL), com
+índices por cidade/ano/área e escrita transacional em lote.
+
+Migração única dos JSON existentes:
+    python storage.py migrate
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "mapa_pr.db")
+
+# Gravação em segundo plano: intervalo máximo (s) e nº de alterações que antecipa a gravação
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "1.0"))
+FLUSH_MAX_PENDING = int(os.getenv("FLUSH_MAX_PENDING", "200"))
+
+SCHEMA = """
+-- Os dados de referência das cidades vêm sempre de cidades_pr.json; a tabela
+-- criada por versões antigas da migração nunca era lida
+DROP TABLE IF EXISTS cities;
+
+CREATE TABLE IF NOT EXISTS votos (
+    city TEXT NOT NULL,
+    ano INTEGER NOT NULL,
+    votos INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_votos_city_ano ON votos(city, ano);
+CREATE INDEX IF NOT EXISTS idx_votos_ano ON votos(ano);
+
+CREATE TABLE IF NOT EXISTS investments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cityId TEXT NOT NULL,
+    cityName TEXT,
+    ano INTEGER,
+    valor REAL NOT NULL DEFAULT 0,
+    area TEXT DEFAULT '',
+    tipo TEXT DEFAULT '',
+    descricao TEXT DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_inv_city_ano ON investments(cityId, ano);
+CREATE INDEX IF NOT EXISTS idx_inv_ano ON investments(ano);
+CREATE INDEX IF NOT EXISTS idx_inv_area ON investments(area);
+
+-- Agregado materializado por cidade (equivalente ao campaign_data.json)
+CREATE TABLE IF NOT EXISTS campaign (
+    city TEXT PRIMARY KEY,
+    votes INTEGER NOT NULL DEFAULT 0,
+    money REAL NOT NULL DEFAULT 0
+);
+"""
+
+INVESTMENT_FIELDS = ("cityId", "cityName", "ano", "valor", "area", "tipo", "descricao")
+
+
+def investment_row(inv):
+    return tuple(inv.get(k) for k in INVESTMENT_FIELDS)
+
+
+def aggregate_campaign(votos_data, investments_data):
+    """Agrega votos (soma de todos os anos) e investimentos por cidade."""
+    campaign = {}
+
+    for slug, entries in votos_data.items():
+        campaign[slug] = {"votes": sum(e["votos"] for e in entries), "money": 0}
+
+    for inv in investments_data:
+        slug = inv.get("cityId")
+        if not slug:
+            continue
+        if slug not in campaign:
+            campaign[slug] = {"votes": 0, "money": 0}
+        campaign[slug]["money"] += inv.get("valor", 0)
+
+    return campaign
+
+
+def merge_votos(current, incoming):
+    """
+    Mescla votos por cidade/ano: o ano que chega substitui o existente, os
+    demais anos ficam. Devolve (votos mesclados, contagens).
+    """
+    merged = dict(current)
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    for slug, entries in incoming.items():
+        by_year = {int(e["ano"]): e for e in merged.get(slug, [])}  # "2020" e 2020 são o mesmo ano
+        for entry in entries:
+            ano, votos = int(entry["ano"]), int(entry["votos"])
+            old = by_year.get(ano)
+            if old is None:
+                counts["inserted"] += 1
+            elif int(old["votos"]) == votos:
+                counts["unchanged"] += 1
+                continue
+            else:
+                counts["updated"] += 1
+            by_year[ano] = {"ano": ano, "votos": votos}
+        merged[slug] = sorted(by_year.values(), key=lambda e: e["ano"])
+    return merged, counts
+
+
+def investment_key(inv):
+    """
+    Chave natural de um investimento: (cityId, ano, tipo, descricao, valor),
+    com textos sem espaços nas pontas e sem diferenciar maiúsculas e valor em
+    centavos. Reimportar a mesma planilha gera as mesmas chaves.
+    """
+    return (inv.get("cityId") or "", int(inv.get("ano") or 0), (inv.get("tipo") or "").strip().casefold(),
+            (inv.get("descricao") or "").strip().casefold(), round(float(inv.get("valor") or 0) * 100))
+
+
+class InvestmentIndex:
+    """
+    Índice hash {chave natural: posição} da lista de investimentos publicada.
+    Fica associado à tupla do snapshot (por identidade): se a lista for
+    substituída por outro caminho (save, delete, recarga), é remontado uma vez
+    no próximo merge. Só é usado por escritores, sob o lock do VersionedState.
+    """
+
+    def __init__(self):
+        self._investments = None
+        self._positions = {}
+
+    def _bind(self, investments):
+        if investments is not self._investments:
+            positions = {}
+            for i, inv in enumerate(investments):
+                positions.setdefault(investment_key(inv), i)
+            self._investments, self._positions = investments, positions
+
+    def merge(self, investments, incoming):
+        """
+        Upsert em O(len(investments) + len(incoming)): chave nova é inserida;
+        chave existente com algum campo diferente (área, nome da cidade, grafia)
+        é atualizada no lugar; registro idêntico, no banco ou repetido na
+        própria importação, conta como duplicado. Devolve (tupla nova, contagens).
+        """
+        self._bind(investments)
+        merged = list(investments)
+        positions = dict(self._positions)
+        counts = {"inserted": 0, "updated": 0, "duplicate": 0}
+        for inv in incoming:
+            key = investment_key(inv)
+            i = positions.get(key)
+            if i is None:
+                positions[key] = len(merged)
+                merged.append(inv)
+                counts["inserted"] += 1
+            elif merged[i] == inv:
+                counts["duplicate"] += 1
+            else:
+                merged[i] = inv
+                counts["updated"] += 1
+        merged = tuple(merged)
+        self._investments, self._positions = merged, positions
+        return merged, counts
+
+
+def write_json_atomic(path, data, **kwargs):
+    """Grava JSON em arquivo temporário e troca atomicamente (seguro contra queda no meio da escrita)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class WriteBehindQueue:
+    """
+    Persistência write-behind: os handlers apenas marcam datasets como sujos e
+    uma tarefa em segundo plano grava periodicamente (ou ao atingir o limite de
+    alterações pendentes). Rajadas de edições viram uma única gravação.
+
+    writers: { nome: (snapshot, write) } — snapshot() roda no event loop e
+    copia os dados; write(copia) roda em uma thread e faz o I/O.
+    """
+
+    def __init__(self, writers, interval=FLUSH_INTERVAL, max_pending=FLUSH_MAX_PENDING):
+        self.writers = writers
+        self.interval = interval
+        self.max_pending = max_pending
+        self._dirty = set()
+        self._pending = 0
+        self._wake = None
+        self._task = None
+        self._flush_lock = None
+        self.flush_count = 0
+        self.write_count = 0
+        self.last_flush_seconds = 0.0
+
+    def mark_dirty(self, name):
+        self._dirty.add(name)
+        self._pending += 1
+        if self._pending >= self.max_pending and self._wake is not None:
+            self._wake.set()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    async def flush(self):
+        """Grava todos os datasets sujos (um arquivo/transação por dataset)."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            names, self._dirty, self._pending = self._dirty, set(), 0
+            start = time.perf_counter()
+            for name in sorted(names):
+                snapshot, write = self.writers[name]
+                data = snapshot()
+                try:
+                    await asyncio.to_thread(write, data)
+                    self.write_count += 1
+                except Exception as e:
+                    print(f"Erro ao gravar {name}: {e}")
+                    self._dirty.add(name)
+            self.flush_count += 1
+            self.last_flush_seconds = time.perf_counter() - start
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+        if self._pending >= self.max_pending:
+            self._wake.set()
+
+    async def stop(self):
+        """Encerra a tarefa e garante a gravação do que estiver pendente."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class SQLiteStore:
+    """
+    Persistência em SQLite. Todas as escritas são transacionais.
+
+    Os replace_* gravam só a diferença para o último estado gravado/carregado
+    (guardado em memória; os snapshots são imutáveis, então quase tudo é
+    comparado por identidade): votos e campanha por cidade, investimentos por
+    posição na lista. Sem estado anterior (migração, banco recém-aberto sem
+    load) a tabela é reescrita inteira.
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._written = {}  # dataset -> último estado gravado/carregado (investimentos: (ids, registros))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, statements):
+        """Executa uma lista de (sql, params|lista de params) em uma única transação."""
+        with self._lock:
+            cur = self._conn.cursor()
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        cur.executemany(sql, params)
+                    else:
+                        cur.execute(sql, params)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def is_empty(self):
+        row = self._query(
+            "SELECT (SELECT COUNT(*) FROM votos) + (SELECT COUNT(*) FROM investments)"
+            " + (SELECT COUNT(*) FROM campaign)"
+        )[0]
+        return row[0] == 0
+
+    def _changed_keys(self, name, data):
+        """(alteradas, removidas) em relação ao último estado gravado, ou None se não houver um."""
+        previous = self._written.get(name)
+        if previous is None:
+            return None
+        changed = [key for key, value in data.items()
+                   if (old := previous.get(key)) is not value and old != value]
+        return changed, [key for key in previous if key not in data]
+
+    # --- Votos ---
+    def load_votos(self, city=None, ano=None):
+        """Retorna { slug: [{ano, votos}, ...] } mantendo a ordem original; filtros usam os índices."""
+        sql = "SELECT city, ano, votos FROM votos"
+        where, params = [], []
+        if city is not None:
+            where.append("city = ?")
+            params.append(city)
+        if ano is not None:
+            where.append("ano = ?")
+            params.append(ano)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY city, seq"
+
+        votos = {}
+        for row in self._query(sql, params):
+            votos.setdefault(row["city"], []).append({"ano": row["ano"], "votos": row["votos"]})
+        if not where:
+            self._written["votos"] = votos
+        return votos
+
+    def replace_votos(self, votos_data):
+        diff = self._changed_keys("votos", votos_data)
+        slugs = votos_data if diff is None else diff[0]
+        rows = [
+            (slug, int(e.get("ano", 0)), int(e.get("votos", 0)), seq)
+            for slug in slugs
+            for seq, e in enumerate(votos_data[slug])
+        ]
+        if diff is None:
+            delete = ("DELETE FROM votos", ())
+        else:
+            delete = ("DELETE FROM votos WHERE city = ?", [(slug,) for slug in diff[0] + diff[1]])
+        self._transaction([delete, ("INSERT INTO votos (city, ano, votos, seq) VALUES (?, ?, ?, ?)", rows)])
+        self._written["votos"] = votos_data
+
+    # --- Investimentos ---
+    def load_investments(self, city=None, ano=None, area=None):
+        sql = f"SELECT id, {', '.join(INVESTMENT_FIELDS)} FROM investments"
+        where, params = [], []
+        for col, val in (("cityId", city), ("ano", ano), ("area", area)):
+            if val is not None:
+                where.append(f"{col} = ?")
+                params.append(val)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id"
+        rows = self._query(sql, params)
+        investments = [{k: row[k] for k in INVESTMENT_FIELDS} for row in rows]
+        if not where:
+            self._written["investments"] = ([row["id"] for row in rows], investments)
+        return investments
+
+    def replace_investments(self, investments_data):
+        """
+        Linha i do banco (ordem de id) = registro i da lista: posições com o
+        mesmo registro ficam, as diferentes são atualizadas, a cauda é inserida
+        ou removida. Merges (atualização no lugar e inserção no fim) gravam só o
+        que mudou; um DELETE no meio da lista regrava dali em diante.
+        """
+        insert_sql = f"INSERT INTO investments ({', '.join(INVESTMENT_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        previous = self._written.get("investments")
+        if previous is None:
+            ids, common, statements = [], 0, [("DELETE FROM investments", ())]
+        else:
+            ids, old = previous
+            common = min(len(ids), len(investments_data))
+            updates = [investment_row(new) + (ids[i],) for i, (prev, new) in enumerate(zip(old, investments_data))
+                       if prev is not new and prev != new]
+            statements = [(f"UPDATE investments SET {', '.join(f'{k} = ?' for k in INVESTMENT_FIELDS)} WHERE id = ?",
+                           updates)]
+            if len(ids) > common:
+                statements.append(("DELETE FROM investments WHERE id >= ?", (ids[common],)))
+        statements.append((insert_sql, [investment_row(inv) for inv in investments_data[common:]]))
+        self._transaction(statements)
+        # AUTOINCREMENT: as linhas inseridas têm ids maiores que qualquer id anterior
+        last = ids[common - 1] if common else 0
+        ids = ids[:common] + [r["id"] for r in self._query("SELECT id FROM investments WHERE id > ? ORDER BY id", (last,))]
+        self._written["investments"] = (ids, list(investments_data))
+
+    # --- Campanha (agregado materializado) ---
+    def load_campaign(self):
+        return {
+            row["city"]: {"votes": row["votes"], "money": row["money"]}
+            for row in self._query("SELECT city, votes, money FROM campaign ORDER BY city")
+        }
+
+    def replace_campaign(self, campaign_data):
+        diff = self._changed_keys("campaign", campaign_data)
+        slugs = campaign_data if diff is None else diff[0]
+        rows = [(slug, campaign_data[slug].get("votes", 0) or 0, campaign_data[slug].get("money", 0) or 0)
+                for slug in slugs]
+        if diff is None:
+            delete = ("DELETE FROM campaign", ())
+        else:
+            delete = ("DELETE FROM campaign WHERE city = ?", [(slug,) for slug in diff[0] + diff[1]])
+        self._transaction([delete, ("INSERT INTO campaign (city, votes, money) VALUES (?, ?, ?)", rows)])
+        self._written["campaign"] = campaign_data
+
+    def refresh_campaign(self):
+        """Recalcula o agregado por cidade a partir de votos e investimentos (mesma regra de aggregate_campaign)."""
+        self._transaction([
+            ("DELETE FROM campaign", ()),
+            ("""
+            INSERT INTO campaign (city, votes, money)
+            SELECT city, SUM(votes), SUM(money) FROM (
+                SELECT city, votos AS votes, 0 AS money FROM votos
+                UNION ALL
+                SELECT cityId AS city, 0 AS votes, valor AS money FROM investments WHERE cityId <> ''
+            ) GROUP BY city
+            """, ()),
+        ])
+        campaign = self.load_campaign()
+        self._written["campaign"] = campaign
+        return campaign
+
+    # --- Migração ---
+    def migrate_from_json(self, directory="."):
+        """Importa os arquivos JSON existentes para o banco (operação única)."""
+        def read(name, default):
+            path = os.path.join(directory, name)
+            if not os.path.exists(path):
+                return default
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        votos = read("votos_data.json", {})
+        investments = read("investments_data.json", [])
+
+        self.replace_votos(votos)
+        self.replace_investments(investments)
+        campaign = self.refresh_campaign()
+        return {"votos": len(votos), "investments": len(investments), "campaign": len(campaign)}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Uso: python storage.py migrate [arquivo.db]")
+        sys.exit(1)
+
+    db_path = sys.argv[2] if len(sys.argv) > 2 else SQLITE_PATH
+    store = SQLiteStore(db_path)
+    counts = store.migrate_from_json()
+    store.close()
+    print(f"Migração concluída em {db_path}: {counts}")
@@ -0,0 +1,22 @@
+"""
+Normalização de texto compartilhada (chaves de cache, busca e índices).
+"""
+
+import re
+import unicodedata
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,;:!?¿¡\"'"
+
+
+def fold_accents(text):
+    """Remove acentos e passa para minúsculas ("Maringá" -> "maringa")."""
+    if not text:
+        return ""
+    nfkd = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in nfkd if not unicodedata.combining(c)).lower()
+
+
+def normalize_message(message):
+    """Forma canônica de uma pergunta: sem acentos, minúscula, espaços colapsados e sem pontuação nas pontas."""
+    return _SPACES.sub(" ", fold_accents(message)).strip(_EDGE_PUNCTUATION)
@@ -0,0 +1,288 @@
+"""
+Cubo do perfil do eleitorado: distribuição conjunta (gênero × faixa etária ×
+instrução × estado civil × cor/raça) por município, a partir do CSV de
+perfil do TSE.
+
+O dados_eleitorais.json guarda só marginais independentes por cidade, o que
+não responde "mulheres de 25 a 34 anos com ensino superior em Maringá". Aqui
+cada combinação com eleitores vira uma linha de um cubo esparso gravado em
+colunas .npy (um arquivo por dimensão):
+- dimensões codificadas por dicionário (uint8 por linha, rótulos em dims.json);
+- contagens em uint32;
+- linhas ordenadas por município, com offsets (formato CSR), então as linhas
+  de uma cidade são um trecho contíguo de cada coluna.
+
+Na leitura as colunas são abertas com mmap: uma consulta só toca as páginas
+das cidades e dimensões envolvidas, sem carregar o cubo inteiro na memória.
+Filtros viram tabelas de consulta booleanas por código e o group-by é um
+np.bincount sobre a chave mista (códigos em base variável) das dimensões.
+
+Gerado por download_tse_data.py (ou `python voter_cube.py perfil.csv`).
+"""
+
+import csv
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+CUBE_DIR = os.getenv("VOTER_CUBE_DIR", "perfil_cubo")
+CITY_DIM = "municipio"
+# Dimensão -> coluna do CSV de perfil do TSE (colunas ausentes no arquivo são ignoradas)
+DIMENSIONS = {
+    "genero": "DS_GENERO",
+    "faixa_etaria": "DS_FAIXA_ETARIA",
+    "grau_instrucao": "DS_GRAU_ESCOLARIDADE",
+    "estado_civil": "DS_ESTADO_CIVIL",
+    "cor_raca": "DS_COR_RACA",
+}
+COUNT_COLUMN = "QT_ELEITORES_PERFIL"
+CHUNK_ROWS = 1 << 18  # linhas por bloco nas consultas
+
+_AGE_RANGE = re.compile(r"(\d+)(?:\s*a\s*(\d+))?\s*anos(\s*ou mais)?", re.IGNORECASE)
+
+
+def _normalize(text):
+    from download_tse_data import normalize_key
+    return normalize_key(str(text).strip())
+
+
+def age_range(label):
+    """(mínima, máxima) de um rótulo de faixa etária do TSE; None se não for uma faixa ("Inválida")."""
+    match = _AGE_RANGE.search(label)
+    if not match:
+        return None
+    low = int(match.group(1))
+    high = int(match.group(2)) if match.group(2) else (200 if match.group(3) else low)
+    return low, high
+
+
+# --- Gravação (ETL) ---
+
+def aggregate_csv(csv_path, uf="PR", encoding="latin-1"):
+    """Lê o CSV de perfil em streaming e soma eleitores por (município, combinação das dimensões)."""
+    from download_tse_data import normalize_key
+
+    joint = defaultdict(int)
+    with open(csv_path, "r", encoding=encoding, newline="") as f:
+        reader = csv.reader(f, delimiter=";")
+        header = next(reader)
+        index = {name: i for i, name in enumerate(header)}
+        dims = [dim for dim, column in DIMENSIONS.items() if column in index]
+        columns = [index[DIMENSIONS[dim]] for dim in dims]
+        uf_i, city_i, count_i = index["SG_UF"], index["NM_MUNICIPIO"], index[COUNT_COLUMN]
+        names = {}
+        for row in reader:
+            if row[uf_i] != uf:
+                continue
+            city = row[city_i]
+            slug = names.get(city)
+            if slug is None:
+                slug = names[city] = normalize_key(city.strip())
+            joint[(slug, *(row[i].strip() for i in columns))] += int(row[count_i] or 0)
+    return dims, joint
+
+
+def write_cube(dims, joint, path=CUBE_DIR):
+    """
+    Grava o cubo esparso em `path` (diretório com dims.json e um .npy por
+    coluna). A troca é atômica: grava num diretório temporário e renomeia.
+    """
+    values = {dim: sorted({key[d + 1] for key in joint}) for d, dim in enumerate(dims)}
+    for dim, labels in values.items():
+        if len(labels) > 255:
+            raise ValueError(f"Dimensão {dim} com {len(labels)} valores (máximo 255)")
+    codes = {dim: {label: i for i, label in enumerate(labels)} for dim, labels in values.items()}
+    cities = sorted({key[0] for key in joint})
+    city_code = {slug: i for i, slug in enumerate(cities)}
+
+    keys = sorted((k for k, count in joint.items() if count), key=lambda k: (city_code[k[0]], k[1:]))
+    n = len(keys)
+    columns = {dim: np.fromiter((codes[dim][k[d + 1]] for k in keys), dtype=np.uint8, count=n)
+               for d, dim in enumerate(dims)}
+    counts = np.fromiter((joint[k] for k in keys), dtype=np.uint32, count=n)
+    city_rows = np.bincount(np.fromiter((city_code[k[0]] for k in keys), dtype=np.int64, count=n),
+                            minlength=len(cities))
+    offsets = np.concatenate(([0], np.cumsum(city_rows))).astype(np.int64)
+
+    tmp_path, old_path = f"{path}.tmp", f"{path}.old"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for dim, column in columns.items():
+        np.save(os.path.join(tmp_path, f"{dim}.npy"), column)
+    np.save(os.path.join(tmp_path, "count.npy"), counts)
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+    with open(os.path.join(tmp_path, "dims.json"), "w", encoding="utf-8") as f:
+        json.dump({"dims": dims, "values": values, "cities": cities, "rows": n}, f, ensure_ascii=False)
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return n
+
+
+def build_cube(csv_path, path=CUBE_DIR):
+    start = time.perf_counter()
+    dims, joint = aggregate_csv(csv_path)
+    rows = write_cube(dims, joint, path)
+    size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    print(f"Cubo do perfil: {rows:,} combinações com eleitores, {len(dims)} dimensões, "
+          f"{size / 1024:,.0f} KiB em {path}/ ({time.perf_counter() - start:.1f}s)")
+    return rows
+
+
+# --- Consulta ---
+
+class CubeQueryError(ValueError):
+    pass
+
+
+class VoterCube:
+    def __init__(self, path=CUBE_DIR):
+        with open(os.path.join(path, "dims.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.path = path
+        self.dims = meta["dims"]
+        self.values = meta["values"]
+        self.cities = meta["cities"]
+        self.city_index = {slug: i for i, slug in enumerate(self.cities)}
+        self.rows = meta["rows"]
+        self.columns = {dim: np.load(os.path.join(path, f"{dim}.npy"), mmap_mode="r") for dim in self.dims}
+        self.counts = np.load(os.path.join(path, "count.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self._normalized = {dim: [_normalize(label) for label in labels] for dim, labels in self.values.items()}
+        self._ages = [age_range(label) for label in self.values.get("faixa_etaria", [])]
+
+    def describe(self):
+        return {"dims": [CITY_DIM] + self.dims, "values": self.values, "cities": len(self.cities), "rows": self.rows}
+
+    def match(self, dim, wanted):
+        """
+        Códigos da dimensão que atendem aos valores pedidos: rótulo exato (sem
+        acento e sem diferenciar maiúsculas) ou, se nenhum for exato, parte do
+        rótulo ("superior" -> SUPERIOR COMPLETO e SUPERIOR INCOMPLETO).
+        """
+        if dim not in self.values:
+            raise CubeQueryError(f"Dimensão desconhecida: {dim} (use {', '.join(self.dims)})")
+        labels = self._normalized[dim]
+        selected = set()
+        for value in wanted:
+            key = _normalize(value)
+            exact = [i for i, label in enumerate(labels) if label == key]
+            partial = exact or [i for i, label in enumerate(labels) if key and key in label]
+            if not partial:
+                raise CubeQueryError(f"Valor '{value}' não encontrado em {dim}")
+            selected.update(partial)
+        return selected
+
+    def match_ages(self, low, high):
+        """Faixas etárias inteiramente dentro de [low, high]."""
+        selected = {i for i, bounds in enumerate(self._ages) if bounds and low <= bounds[0] and bounds[1] <= high}
+        if not selected:
+            raise CubeQueryError(f"Nenhuma faixa etária do TSE cabe em {low}-{high} anos")
+        return selected
+
+    def _city_rows(self, slugs):
+        """Índices das cidades e trechos [início, fim) das suas linhas (cidades vizinhas no cubo viram um trecho só)."""
+        if slugs is None:
+            return np.arange(len(self.cities)), [(0, self.rows)]
+        unknown = [s for s in slugs if s not in self.city_index]
+        if unknown:
+            raise CubeQueryError(f"Cidades fora do cubo: {', '.join(unknown)}")
+        indices = np.array(sorted({self.city_index[s] for s in slugs}), dtype=np.int64)
+        spans = []
+        for i in indices:
+            start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+            if spans and spans[-1][1] == start:
+                spans[-1] = (spans[-1][0], end)
+            else:
+                spans.append((start, end))
+        return indices, spans
+
+    @staticmethod
+    def _chunks(spans):
+        for start, end in spans:
+            for chunk in range(start, end, CHUNK_ROWS):
+                yield chunk, min(chunk + CHUNK_ROWS, end)
+
+    def crosstab(self, cities=None, filters=None, group_by=(), ages=None):
+        """
+        Eleitores das cidades (None = todas) que atendem aos filtros
+        ({dimensão: valores}; `ages` = (mín, máx) para a faixa etária),
+        agrupados pelas dimensões de `group_by` (pode incluir "municipio").
+        Devolve total, universo (todos os eleitores das cidades) e grupos.
+        """
+        filters = filters or {}
+        group_by = list(dict.fromkeys(group_by))
+        for dim in group_by:
+            if dim != CITY_DIM and dim not in self.values:
+                raise CubeQueryError(f"Dimensão desconhecida: {dim} (use {', '.join([CITY_DIM] + self.dims)})")
+        allowed = {dim: self.match(dim, wanted) for dim, wanted in filters.items() if wanted}
+        if ages is not None:
+            age_codes = self.match_ages(*ages)
+            allowed["faixa_etaria"] = allowed.get("faixa_etaria", age_codes) & age_codes
+
+        indices, spans = self._city_rows(cities)
+        lookups = {}
+        for dim, selected in allowed.items():
+            lookup = np.zeros(len(self.values[dim]), dtype=bool)
+            lookup[list(selected)] = True
+            lookups[dim] = lookup
+        sizes = [len(indices) if dim == CITY_DIM else len(self.values[dim]) for dim in group_by]
+        sums = np.zeros(int(np.prod(sizes)) if group_by else 0)
+        if CITY_DIM in group_by:
+            position = np.full(len(self.cities), -1, dtype=np.int64)
+            position[indices] = np.arange(len(indices))
+
+        # Blocos de CHUNK_ROWS linhas das cidades pedidas, lidos direto do mmap e só nas colunas usadas:
+        # a memória de trabalho fica limitada mesmo nas consultas do estado inteiro
+        universe = total = 0
+        for start, end in self._chunks(spans):
+            counts = self.counts[start:end]
+            universe += int(counts.sum(dtype=np.int64))
+            mask = None
+            for dim, lookup in lookups.items():
+                matches = lookup[self.columns[dim][start:end]]
+                mask = matches if mask is None else mask & matches
+            selected = counts if mask is None else counts[mask]
+            total += int(selected.sum(dtype=np.int64))
+            if not group_by:
+                continue
+            keys = np.zeros(len(selected), dtype=np.int64)
+            for dim, size in zip(group_by, sizes):
+                if dim == CITY_DIM:
+                    # Linhas de cada cidade dentro do bloco (as linhas são ordenadas por cidade)
+                    column = np.repeat(position, np.diff(np.clip(self.offsets, start, end)))
+                else:
+                    column = self.columns[dim][start:end]
+                keys = keys * size + (column if mask is None else column[mask])
+            sums += np.bincount(keys, weights=selected, minlength=len(sums))
+
+        groups = []
+        for flat in np.flatnonzero(sums):
+            group = {}
+            for dim, code in zip(group_by, np.unravel_index(flat, sizes)):
+                group[dim] = self.cities[indices[code]] if dim == CITY_DIM else self.values[dim][code]
+            group["eleitores"] = int(sums[flat])
+            group["percentual"] = round(100 * sums[flat] / universe, 2) if universe else 0.0
+            groups.append(group)
+        groups.sort(key=lambda g: -g["eleitores"])
+        return {
+            "total": total,
+            "universo": universe,
+            "percentual": round(100 * total / universe, 2) if universe else 0.0,
+            "groups": groups,
+        }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python voter_cube.py perfil_eleitorado_ATUAL.csv [diretório]")
+        sys.exit(1)
+    build_cube(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else CUBE_DIR)